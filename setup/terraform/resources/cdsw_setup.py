@@ -16,6 +16,7 @@ from optparse import OptionParser
 from subprocess import Popen, PIPE
 
 from labs import get_base_dir, get_the_pwd, get_truststore_path, get_url_scheme, is_tls_enabled
+from labs.polling import poll
 from labs.utils import cm
 
 IP_LOOKUP_URLS = [
@@ -952,20 +953,20 @@ class CdswDeployer(object):
         print(f'Job ID: {job["id"]}')
 
         print('# Running job until it succeeds')
+
+        def _job_finished():
+            job_status = self.cdsw_api.cdsw_get_job(DEFAULT_USERNAME, DEFAULT_PROJECT_NAME, job['id'])['latest']['status']
+            print(f'Job {job["id"]} status: {job_status}')
+            return job_status if job_status in ['succeeded', 'failed'] else None
+
         status = None
         while status != 'succeeded':
             self.cdsw_api.cdsw_start_job(DEFAULT_USERNAME, DEFAULT_PROJECT_NAME, job['id'])
-            while True:
-                job = self.cdsw_api.cdsw_get_job(DEFAULT_USERNAME, DEFAULT_PROJECT_NAME, job['id'])
-                status = job['latest']['status']
-                print(f'Job {job["id"]} status: {status}')
-                if status == 'succeeded':
-                    break
-                if status == 'failed':
-                    print('Job failed. Will retry in 5 seconds.')
-                    time.sleep(5)
-                    break
-                time.sleep(10)
+            status = poll(_job_finished, initial_interval_secs=2, max_interval_secs=10,
+                          name='CdswDeployer.deploy_model:job')
+            if status == 'failed':
+                print('Job failed. Will retry in 5 seconds.')
+                time.sleep(5)
 
         print('# Getting engine image to use for model')
         engine_image = self.cdsw_api.cdsw_get_project_engine_image(DEFAULT_USERNAME, DEFAULT_PROJECT_NAME)
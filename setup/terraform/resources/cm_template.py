@@ -1,12 +1,16 @@
 '''
 '''
+import copy
+import hashlib
 import json
 import logging
 import os
 import re
+import tempfile
+import time
 import yaml
 from optparse import OptionParser, OptionGroup
-from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, meta, nodes
 from jinja2.exceptions import UndefinedError
 
 # Represent None as empty instead of "null"
@@ -24,6 +28,24 @@ TEMPLATE_DIR = './templates'
 
 JINJA2_ENV = None
 
+# Cache of rendered templates and merged outputs. Most templates interpolate THE_PWD, so the entries contain secrets:
+# the cache is kept next to this script, in the directory of the run, readable only by its owner (0700 directories,
+# 0600 files), and entries are evicted after CACHE_MAX_AGE_SECS or when the cache exceeds CACHE_MAX_BYTES.
+CACHE_DIR_ENV_VAR = 'CM_TEMPLATE_CACHE_DIR'
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cm-template-cache')
+# Change this to discard all the cache entries when the rendering or the merging logic changes
+CACHE_VERSION = '1'
+CACHE_MAX_AGE_SECS = 24 * 3600
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+CACHE_DIR = None
+CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# Results of the analysis of the templates and of the dependencies file, persisted in the templates directory
+CATALOG_FILE_NAME = '.catalog.json'
+CATALOG_VERSION = 1
+DEPENDENCIES_FILE_NAME = 'dependencies'
+CATALOG = None
+
 def to_int(x):
     try:
         return(int(x))
@@ -68,11 +90,108 @@ def init_jinja2_env(template_dir):
     JINJA2_ENV.tests['lt'] = lt
 
 def merge_templates(templates):
+    return _IndexedMerger().merge(templates)
+
+def merge_templates_legacy(templates):
+    """Reference implementation of merge_templates, kept for benchmarking and output verification."""
     merged = {}
     for template in templates:
         update_object(merged, template)
     return merged
 
+def _get_idempotent_id(item):
+    for attr in IDEMPOTENT_IDS:
+        if attr in item:
+            return attr
+    return None
+
+class _IndexedMerger(object):
+    """
+    Merges templates with the same result as update_object, in linear time. List items are found by their
+    idempotent id in a per-list index instead of a scan of the list, and the lists that received merges are sorted
+    once, at the end, deepest first, with the serialization of each item computed only once.
+    """
+    def __init__(self):
+        self._indexes = {}  # id(list) -> (list, {(attr, value): item})
+        self._merged_lists = {}  # id(list) -> list, for the lists that must be sorted
+
+    def merge(self, templates):
+        merged = {}
+        for template in templates:
+            self._update_object(merged, template)
+        self._sort(merged)
+        return merged
+
+    def _update_object(self, base, template, breadcrumbs=''):
+        if isinstance(base, dict) and isinstance(template, dict):
+            self._update_dict(base, template, breadcrumbs)
+            return True
+        elif isinstance(base, list) and isinstance(template, list):
+            self._update_list(base, template, breadcrumbs)
+            return True
+        return False
+
+    def _update_dict(self, base, template, breadcrumbs=''):
+        for key, value in template.items():
+            crumb = breadcrumbs + '/' + key
+            if key in IDEMPOTENT_IDS:
+                if base[key] != value:
+                    LOG.error('Objects with distinct IDs should not be merged: ' + crumb)
+                continue
+            if key not in base:
+                base[key] = value
+            elif not self._update_object(base[key], value, crumb) and base[key] != value:
+                LOG.warn("Value being overwritten for key [%s], Old: [%s], New: [%s]", crumb, base[key], value)
+                base[key] = value
+
+    def _get_index(self, base):
+        if id(base) not in self._indexes:
+            index = {}
+            for item in base:
+                self._add_to_index(index, item)
+            # Keep a reference to the list, so that its id is not reused while merging
+            self._indexes[id(base)] = (base, index)
+        return self._indexes[id(base)][1]
+
+    @staticmethod
+    def _add_to_index(index, item):
+        if isinstance(item, dict):
+            for attr in IDEMPOTENT_IDS:
+                if attr in item:
+                    # The first item with a given id is the one found by a scan of the list
+                    index.setdefault((attr, item[attr]), item)
+
+    def _update_list(self, base, template, breadcrumbs=''):
+        index = self._get_index(base)
+        self._merged_lists[id(base)] = base
+        for item in template:
+            if isinstance(item, dict):
+                idempotent_id = _get_idempotent_id(item)
+                if idempotent_id:
+                    namesake = index.get((idempotent_id, item[idempotent_id]))
+                    if namesake is not None:
+                        self._update_dict(namesake, item,
+                                          breadcrumbs + '/[' + idempotent_id + '=' + item[idempotent_id] + ']')
+                        continue
+            base.append(item)
+            self._add_to_index(index, item)
+
+    def _sort(self, obj):
+        """
+        Sort the merged lists within obj, deepest first, and return the serialization of obj, which is the same as
+        json.dumps(obj, sort_keys=True) and is used as the sort key of obj in its parent list.
+        """
+        if isinstance(obj, dict):
+            return '{' + ', '.join(json.dumps(k) + ': ' + self._sort(obj[k]) for k in sorted(obj)) + '}'
+        elif isinstance(obj, list):
+            keys = [self._sort(item) for item in obj]
+            if self._merged_lists.get(id(obj)) is obj:
+                pairs = sorted(zip(keys, range(len(obj))))
+                obj[:] = [obj[i] for _, i in pairs]
+                keys = [k for k, _ in pairs]
+            return '[' + ', '.join(keys) + ']'
+        return json.dumps(obj)
+
 def update_object(base, template, breadcrumbs=''):
     if isinstance(base, dict) and isinstance(template, dict):
         update_dict(base, template, breadcrumbs)
@@ -113,11 +232,186 @@ def update_list(base, template, breadcrumbs=''):
         base.append(item)
     base.sort(key=lambda x: json.dumps(x, sort_keys=True))
 
+def _hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _cache_path(kind, key):
+    return os.path.join(CACHE_DIR, kind, key[:2], key)
+
+def cache_get(kind, key):
+    if not CACHE_DIR:
+        return None
+    try:
+        with open(_cache_path(kind, key)) as cache_file:
+            content = cache_file.read()
+        CACHE_STATS['hits'] += 1
+        return content
+    except (IOError, OSError):
+        CACHE_STATS['misses'] += 1
+        return None
+
+def _makedirs_private(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    os.chmod(path, 0o700)
+
+def cache_put(kind, key, content):
+    # Entries are written to a temporary file and renamed, so that concurrent builds never read partial entries.
+    # mkstemp creates the file with mode 0600.
+    if not CACHE_DIR:
+        return
+    path = _cache_path(kind, key)
+    try:
+        for cache_dir in [CACHE_DIR, os.path.dirname(os.path.dirname(path)), os.path.dirname(path)]:
+            _makedirs_private(cache_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'w') as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_path, path)
+    except (IOError, OSError) as exc:
+        LOG.warn('Failed to write cache entry %s: %s', path, exc)
+
+def prune_cache(cache_dir, max_age_secs=CACHE_MAX_AGE_SECS, max_bytes=CACHE_MAX_BYTES):
+    """Remove the cache entries older than max_age_secs and then the oldest ones until the cache fits in max_bytes."""
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for dir_path, _, file_names in os.walk(cache_dir):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort(reverse=True)
+    now = time.time()
+    total_bytes = 0
+    for mtime, size, path in entries:
+        total_bytes += size
+        if now - mtime > max_age_secs or total_bytes > max_bytes:
+            try:
+                os.remove(path)
+                CACHE_STATS['evictions'] += 1
+            except OSError as exc:
+                LOG.warn('Failed to evict cache entry %s: %s', path, exc)
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def analyze_template(source):
+    """Parse the template once and return the variables it references, its CDH version constraints and branches."""
+    ast = jinja2_env().parse(source)
+    variables = sorted(meta.find_undeclared_variables(ast))
+    printed = set(node.name for output in ast.find_all(nodes.Output) for node in output.nodes
+                  if isinstance(node, nodes.Name))
+    return {
+        'sha256': _hash(source),
+        'variables': variables,
+        'printed_variables': sorted(v for v in printed if not v.startswith(REQUIRES_PREFIX)),
+        'requires': [v for v in variables if v.startswith(REQUIRES_PREFIX)],
+        'has_branches': [v for v in variables if v.startswith('HAS_')],
+    }
+
+def parse_dependencies(dep_file):
+    dependencies = {}
+    with open(dep_file) as deps:
+        for line in deps:
+            line = line.rstrip()
+            m = re.match(r'^ *([^ ]*)  *requires  *([^ ]*) *$', line)
+            if m:
+                svc, deps = m.groups()
+                dependencies[svc] = deps.split(',')
+            else:
+                LOG.error('Invalid line in dependencies file: %s', line)
+    return dependencies
+
+def sort_dependencies(dependencies):
+    """Return all the services of the dependency graph, each one after its dependencies (ties sorted by name)."""
+    services = set(dependencies).union(dep for deps in dependencies.values() for dep in deps)
+    remaining = {svc: set(dependencies.get(svc, [])) for svc in services}
+    order = []
+    while remaining:
+        ready = sorted(svc for svc, deps in remaining.items() if not deps)
+        if not ready:
+            raise RuntimeError('Circular dependencies found between services: {}'.format(', '.join(sorted(remaining))))
+        for svc in ready:
+            order.append(svc)
+            del remaining[svc]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return order
+
+def load_catalog(template_dir, template_files):
+    """
+    Return the catalog of the templates and dependencies of the template directory. The catalog is persisted in the
+    directory and only the files whose modification time or size changed are analyzed again.
+    """
+    catalog_path = os.path.join(template_dir, CATALOG_FILE_NAME)
+    try:
+        with open(catalog_path) as catalog_file:
+            catalog = json.load(catalog_file)
+        if catalog.get('version') != CATALOG_VERSION:
+            catalog = None
+    except (IOError, OSError, ValueError):
+        catalog = None
+    catalog = catalog or {'version': CATALOG_VERSION, 'templates': {}, 'dependencies': None}
+    changed = False
+
+    templates = {}
+    for template_file in template_files:
+        signature = _file_signature(os.path.join(template_dir, template_file))
+        entry = catalog['templates'].get(template_file)
+        if entry is None or entry['signature'] != signature:
+            with open(os.path.join(template_dir, template_file)) as f:
+                entry = analyze_template(f.read())
+            entry['signature'] = signature
+            changed = True
+        templates[template_file] = entry
+    changed = changed or set(templates) != set(catalog['templates'])
+    catalog['templates'] = templates
+
+    dep_file = os.path.join(template_dir, DEPENDENCIES_FILE_NAME)
+    signature = _file_signature(dep_file)
+    if catalog['dependencies'] is None or catalog['dependencies']['signature'] != signature:
+        dependencies = parse_dependencies(dep_file)
+        catalog['dependencies'] = {'signature': signature, 'graph': dependencies,
+                                   'order': sort_dependencies(dependencies)}
+        changed = True
+
+    if changed:
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=template_dir, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(catalog, tmp_file, indent=2, sort_keys=True)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, catalog_path)
+        except (IOError, OSError) as exc:
+            LOG.warn('Failed to write the template catalog %s: %s', catalog_path, exc)
+    return catalog
+
+def get_render_key(json_file, configs):
+    """Return the cache key of the rendered template: a hash of its source and of the variables it references."""
+    entry = CATALOG['templates'][json_file]
+    context = {var: configs.get(var) for var in entry['variables']}
+    return _hash(CACHE_VERSION, entry['sha256'], json.dumps(context, sort_keys=True, default=str))
+
 def load_template(json_file, configs):
+    key = get_render_key(json_file, configs) if CACHE_DIR else None
+    json_content = cache_get('rendered', key) if key else None
+    if json_content is not None:
+        return json.loads(json_content)
     template = jinja2_env().get_template(json_file)
     try:
         json_content = template.render(**configs)
-        return json.loads(json_content)
+        parsed = json.loads(json_content)
+        if key:
+            cache_put('rendered', key, json_content)
+        return parsed
     except UndefinedError as exc:
         m = re.match('.*' + REQUIRES_PREFIX + '([0-9]*).*is undefined', exc.message)
         if m:
@@ -131,10 +425,8 @@ def load_template(json_file, configs):
 def gen_var_template(template_names, yaml_template):
     vars = {}
     for json_file in [TEMPLATES[name] for name in template_names]:
-        template = open(os.path.join(TEMPLATE_DIR, json_file)).read()
-        for var in re.findall(r'{{ *([A-Za-z0-9_]*) *}}', template):
-            if not var.startswith(REQUIRES_PREFIX):
-                vars[var] = None
+        for var in CATALOG['templates'][json_file]['printed_variables']:
+            vars[var] = None
 
     if os.path.exists(yaml_template):
         vars.update(yaml.load(open(yaml_template)))
@@ -144,13 +436,14 @@ def gen_var_template(template_names, yaml_template):
     output.close()
 
 def load_templates(template_dir):
-    global TEMPLATES, TEMPLATE_DIR
+    global TEMPLATES, TEMPLATE_DIR, CATALOG
     TEMPLATE_DIR = template_dir
     files = os.listdir(template_dir)
     for template_file in files:
-        if re.match(r'.*\.json$', template_file):
+        if re.match(r'[^.].*\.json$', template_file):
             template_name, = re.match(r'.*?([^/.]*)\.json$', template_file).groups()
             TEMPLATES[template_name.upper()] = template_file
+    CATALOG = load_catalog(template_dir, TEMPLATES.values())
     for template in TEMPLATES:
         os.environ['HAS_' + template] = ''
 
@@ -179,55 +472,91 @@ def parse_args():
                       dest='gen_var_template', default=None,
                       metavar='FILE',
                       help='Generates a YAML file with the required variables for the given templates.')
+    parser.add_option('--benchmark-merge', action='store', type='int',
+                      dest='benchmark_merge', default=None,
+                      metavar='RUNS',
+                      help='Compare the speed and output of the legacy and indexed template merge engines.')
+    parser.add_option('--cache-dir', action='store', type='string',
+                      dest='cache_dir', default=os.environ.get(CACHE_DIR_ENV_VAR, DEFAULT_CACHE_DIR),
+                      metavar='PATH',
+                      help='Directory of the cache of rendered templates. The entries contain the rendered '
+                           'passwords (THE_PWD), so the directory should be private to the run: it is created '
+                           'with mode 0700 and entries are evicted after {} hours or beyond {} MB. '
+                           'Default: ${} or {}'.format(CACHE_MAX_AGE_SECS // 3600, CACHE_MAX_BYTES // (1024 * 1024),
+                                                       CACHE_DIR_ENV_VAR, DEFAULT_CACHE_DIR))
+    parser.add_option('--no-cache', action='store_true',
+                      dest='no_cache',
+                      help='Do not use the cache of rendered templates.')
     return parser.parse_args()
 
 def print_valid_templates():
     print('Valid template names are:')
     for template in sorted(TEMPLATES):
-        requires = re.findall(REQUIRES_PREFIX + '.', open(os.path.join(TEMPLATE_DIR, TEMPLATES[template])).read())
+        requires = CATALOG['templates'][TEMPLATES[template]]['requires']
         print('    - {} {}'.format(template, '({})'.format(', '.join(requires)) if requires else ''))
 
 def fix_dependencies(template_dir, selected_services):
-    # Load dependencies file
-    dep_file = os.path.join(template_dir, 'dependencies')
-    dependencies = {}
-    with open(dep_file) as deps:
-        for line in deps:
-            line = line.rstrip()
-            m = re.match(r'^ *([^ ]*)  *requires  *([^ ]*) *$', line)
-            if m:
-                svc, deps = m.groups()
-                dependencies[svc] = deps.split(',')
-            else:
-                LOG.error('Invalid line in dependencies file: %s', line)
+    dependencies = CATALOG['dependencies']['graph']
+    order = CATALOG['dependencies']['order']
 
+    # Walking the services in reverse topological order adds all the transitive dependencies in a single pass
     svc_set = set(selected_services)
-    while True:
-        base_set = svc_set.copy()
-        for svc in base_set.union(['all']):
+    for svc in ['all'] + order[::-1]:
+        if svc in svc_set or svc == 'all':
             for dep in dependencies.get(svc, []):
                 if dep not in svc_set:
                     svc_set.add(dep)
                     LOG.info("Adding service %s since it is required by %s", dep, svc)
-        if svc_set == base_set:
-            break
 
-    return list(svc_set)
+    # Dependencies first, so that the merge order (and the merge cache key) doesn't depend on the set order
+    return [svc for svc in order if svc in svc_set] + sorted(svc_set.difference(order))
 
-def get_template(template_names, config_file):
+def get_configs(config_file):
     # Get properties from environment variables and configuration file, if specified
     configs = {}
     configs.update(os.environ)
     if config_file:
         configs.update(yaml.load(open(config_file)))
+    return configs
 
+def get_template(template_names, config_file):
+    configs = get_configs(config_file)
+    merge_key = None
+    if CACHE_DIR:
+        merge_key = _hash(CACHE_VERSION, *[get_render_key(TEMPLATES[name], configs) for name in template_names])
+        output = cache_get('merged', merge_key)
+        if output is not None:
+            return output
     chosen_templates = []
     for template_name in template_names:
         chosen_templates.append(load_template(TEMPLATES[template_name], configs))
     merged = merge_templates(chosen_templates)
-    return json.dumps(merged, indent=2, sort_keys=True)
+    output = json.dumps(merged, indent=2, sort_keys=True)
+    if merge_key:
+        cache_put('merged', merge_key, output)
+    return output
+
+def benchmark_merge(template_names, config_file, repeat):
+    """Time the legacy and indexed merge engines on the rendered templates and check that their outputs match."""
+    configs = get_configs(config_file)
+    rendered = [load_template(TEMPLATES[template_name], configs) for template_name in template_names]
+    outputs = {}
+    for name, merge_func in [('legacy', merge_templates_legacy), ('indexed', merge_templates)]:
+        # Merging modifies the templates, so each run gets its own copy
+        copies = [copy.deepcopy(rendered) for _ in range(repeat)]
+        start = time.time()
+        for templates in copies:
+            merged = merge_func(templates)
+        elapsed = time.time() - start
+        outputs[name] = json.dumps(merged, indent=2, sort_keys=True)
+        print('{:<8} {:>10.3f} ms per merge ({} templates, {} runs)'.format(
+            name, 1000 * elapsed / repeat, len(rendered), repeat))
+    if outputs['legacy'] != outputs['indexed']:
+        raise RuntimeError('The outputs of the legacy and indexed merge engines differ.')
+    print('Outputs are identical ({} bytes).'.format(len(outputs['indexed'])))
 
 def main():
+    global CACHE_DIR
     (options, args) = parse_args()
 
     if options.template_dir is None:
@@ -262,6 +591,17 @@ def main():
 
     choices = fix_dependencies(options.template_dir, choices)
 
+    if not options.no_cache and not options.benchmark_merge:
+        CACHE_DIR = options.cache_dir
+        try:
+            prune_cache(CACHE_DIR)
+        except (IOError, OSError) as exc:
+            LOG.warn('Failed to prune the cache %s: %s', CACHE_DIR, exc)
+
+    if options.benchmark_merge:
+        benchmark_merge(choices, options.config_file, options.benchmark_merge)
+        exit(0)
+
     output = get_template(choices, options.config_file)
     if options.validate_only:
         exit(0)
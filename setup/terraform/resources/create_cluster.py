@@ -4,23 +4,32 @@
 """Cluster creation controls for Cloudera Manager submission"""
 
 from cm_client.rest import ApiException
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from datetime import datetime
+from glob import glob
 from optparse import OptionParser
+import calendar
 import cm_client
 import json
 import os
 import re
 import requests
 import socket
+import threading
 import time
 import urllib3
 
+from labs.polling import poll
+from labs.utils.aio import run_graph
+from labs.tracing import get_report_dir
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 OPT_PARSER = None
 HEADER_COLORS = ['BLUE', 'DARKBLUE', 'GREEN', 'TEAL', 'PURPLE', 'PINK', 'GRAY', 'RED', 'YELLOW', 'BROWN']
 LOG_FILE_PATH = '/var/log/cloudera-scm-server/cloudera-scm-server.log'
+SETUP_MAX_WORKERS = 4
 
 
 def print_cmd(cmd, indent=0):
@@ -56,6 +65,125 @@ def print_cmd(cmd, indent=0):
     return cmd_status, ' '.join(item for item in [cmd_name, details, latest_child_details] if item)
 
 
+def _parse_cm_time(cm_time):
+    if not cm_time:
+        return None
+    match = re.match(r'([0-9-]+T[0-9:]+)(\.[0-9]+)?', cm_time)
+    if not match:
+        return None
+    secs = calendar.timegm(datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S').timetuple())
+    return secs + float(match.group(2) or 0)
+
+
+def command_to_dict(cmd):
+    """Convert a CM command and its children into a timeline tree, with the start/end times reported by CM."""
+    start = _parse_cm_time(cmd.start_time)
+    end = _parse_cm_time(cmd.end_time)
+    node = {
+        'kind': 'command',
+        'name': cmd.name,
+        'id': int(cmd.id),
+        'start_time': cmd.start_time,
+        'end_time': cmd.end_time,
+        'secs': round(end - start, 3) if start is not None and end is not None else None,
+        'active': bool(cmd.active),
+        'success': bool(cmd.success),
+        'result_message': cmd.result_message,
+    }
+    if cmd.children and cmd.children.items:
+        node['children'] = [command_to_dict(child) for child in
+                            sorted(cmd.children.items, key=lambda x: (x.start_time or '9999', int(x.id)))]
+    return node
+
+
+class PhaseTracker:
+    """
+    Timeline of a cluster build: a tree of timed phases, each with the CM commands (and their child commands)
+    executed in it. Phases opened from worker threads must be given their parent phase explicitly.
+    """
+    def __init__(self, action):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.root = {'kind': 'phase', 'name': action, 'start': time.time(), 'end': None, 'secs': None,
+                     'success': None, 'children': []}
+
+    def current_phase(self):
+        return getattr(self._local, 'phase', None) or self.root
+
+    @contextmanager
+    def phase(self, name, parent=None):
+        parent = parent or self.current_phase()
+        node = {'kind': 'phase', 'name': name, 'start': time.time(), 'end': None, 'secs': None, 'success': None,
+                'children': []}
+        with self._lock:
+            parent['children'].append(node)
+        previous = getattr(self._local, 'phase', None)
+        self._local.phase = node
+        try:
+            yield node
+            node['success'] = True
+        except BaseException:
+            node['success'] = False
+            raise
+        finally:
+            node['end'] = time.time()
+            node['secs'] = round(node['end'] - node['start'], 3)
+            self._local.phase = previous
+
+    def record_command(self, cmd):
+        node = command_to_dict(cmd)
+        with self._lock:
+            self.current_phase()['children'].append(node)
+        return node
+
+    def write(self, path=None):
+        """Write the timeline to a JSON file (by default in the run reports directory) and return its path."""
+        self.root['end'] = time.time()
+        self.root['secs'] = round(self.root['end'] - self.root['start'], 3)
+        if path is None:
+            report_dir = get_report_dir()
+            os.makedirs(report_dir, exist_ok=True)
+            path = os.path.join(report_dir, 'cluster-{}-{}.json'.format(
+                self.root['name'], datetime.now().strftime('%Y%m%d%H%M%S')))
+        with self._lock, open(path, 'w') as timeline_file:
+            json.dump(self.root, timeline_file, indent=2)
+        return path
+
+
+def _timeline_durations(node, prefix=''):
+    path = prefix + node['name']
+    if node.get('secs') is not None:
+        yield path, node['kind'], node['secs']
+    for child in node.get('children', []):
+        for item in _timeline_durations(child, path + ' > '):
+            yield item
+
+
+def summarize_timelines(paths, top=20):
+    """
+    Aggregate the phases and commands of many cluster build timelines by their path in the tree and return the
+    slowest ones, by mean duration, as a list of dicts.
+    """
+    durations = {}
+    for path in paths:
+        with open(path) as timeline_file:
+            timeline = json.load(timeline_file)
+        for node_path, kind, secs in _timeline_durations(timeline):
+            durations.setdefault((node_path, kind), []).append(secs)
+    summary = [{'path': node_path, 'kind': kind, 'builds': len(secs), 'mean_secs': round(sum(secs) / len(secs), 3),
+                'max_secs': max(secs)} for (node_path, kind), secs in durations.items()]
+    return sorted(summary, key=lambda x: x['mean_secs'], reverse=True)[:top]
+
+
+def print_timeline_summary(pattern, top=20):
+    paths = sorted(glob(pattern)) if not os.path.isdir(pattern) else sorted(
+        glob(os.path.join(pattern, 'cluster-*.json')))
+    print('Slowest steps across {} timeline(s):'.format(len(paths)))
+    for item in summarize_timelines(paths, top):
+        print('{:>10.1f} {:>10.1f} {:>4} {:<8} {}'.format(item['mean_secs'], item['max_secs'], item['builds'],
+                                                        item['kind'], item['path']))
+
+
 def _get_parser():
     global OPT_PARSER
     if OPT_PARSER is None:
@@ -64,6 +192,9 @@ def _get_parser():
                               help='Setup Cloudera Manager.')
         OPT_PARSER.add_option('--create-cluster', action='store_true', dest='create_cluster',
                               help='Create cluster.')
+        OPT_PARSER.add_option('--summarize-timelines', action='store', dest='summarize_timelines',
+                              help='Print the slowest steps of the cluster build timelines in the given directory '
+                                   'or matching the given glob pattern.')
         # Create cluster options
         OPT_PARSER.add_option('--template', action='store', dest='template',
                               help='Cluster template file.')
@@ -164,6 +295,8 @@ class ClusterCreator:
         self._cluster_api = None
         self._command_api = None
 
+        self.timeline = PhaseTracker('build')
+
         self.remote_repo_usr = remote_repo_usr if remote_repo_usr else None
         self.remote_repo_pwd = remote_repo_pwd if remote_repo_pwd else None
 
@@ -257,28 +390,20 @@ class ClusterCreator:
         if cmd.id == self.SYNCHRONOUS_COMMAND_ID:
             return cmd
 
-        if timeout_secs is None:
-            deadline = None
-        else:
-            deadline = time.time() + timeout_secs
-
         try:
-            while True:
-                cmd = self.command_api.read_command(int(cmd.id))
+            last_cmd = [cmd]
+
+            def _cmd_finished():
+                last_cmd[0] = self.command_api.read_command(int(cmd.id))
                 print(datetime.strftime(datetime.now(), '%c'))
-                status, details = print_cmd(cmd)
+                status, details = print_cmd(last_cmd[0])
                 print('STATUS:%s: %s' % (status, details))
-                if not cmd.active:
-                    return cmd
-
-                if deadline is not None:
-                    now = time.time()
-                    if deadline < now:
-                        return cmd
-                    else:
-                        time.sleep(min(self.WAIT_SLEEP_SECS, int(deadline - now)))
-                else:
-                    time.sleep(self.WAIT_SLEEP_SECS)
+                return not last_cmd[0].active
+
+            poll(_cmd_finished, timeout_secs=timeout_secs, initial_interval_secs=1,
+                 max_interval_secs=self.WAIT_SLEEP_SECS, raise_on_timeout=False, name='ClusterCreator.wait')
+            self.timeline.record_command(last_cmd[0])
+            return last_cmd[0]
         except ApiException as e:
             print("Exception while waiting a command to finish: %s\n" % e)
 
@@ -307,7 +432,56 @@ class ClusterCreator:
         return self.command_api.retry(int(cmd.id))
 
     def setup_cm(self, key_file, cm_repo_url, use_kerberos, use_tls, kerberos_type, ipa_host):
-
+        def _kerberos():
+            if use_kerberos:
+                self._enable_kerberos(kerberos_type, ipa_host)
+
+        def _tls():
+            if use_tls:
+                self._enable_tls()
+
+        # Step name -> (prereq steps, function). The banner and SMM host config steps only change CM configuration and
+        # are executed concurrently with the others. As before, Kerberos and then TLS are enabled only after CMS has
+        # started, so that the generation of the CMS credentials cannot hit a half-configured KDC.
+        steps = OrderedDict([
+            ('begin_trial', ([], self._begin_trial)),
+            ('host_install', (['begin_trial'], lambda: self._install_host(key_file, cm_repo_url))),
+            ('banner_config', ([], self._update_banner)),
+            ('smm_host_config', ([], self._update_smm_host_config)),
+            ('cms_setup', (['host_install'], self._setup_cms)),
+            ('kerberos', (['cms_setup'], _kerberos)),
+            ('tls', (['kerberos'], _tls)),
+            # Wait for Service Monitor to be up before restarting Mgmt Services
+            # Note: This is to avoid corruption of SMON LevelDB files
+            ('smon_wait', (['cms_setup'], self._wait_for_service_monitor)),
+            ('mgmt_restart', (['banner_config', 'smm_host_config', 'kerberos', 'tls', 'smon_wait'],
+                              lambda: self.wait(self.mgmt_api.restart_command()))),
+        ])
+        with self.timeline.phase('setup_cm'):
+            self._run_steps(steps)
+
+    def _run_steps(self, steps, max_workers=SETUP_MAX_WORKERS):
+        """Execute the steps as soon as their prereqs are completed, each in a timeline phase. Return the durations."""
+        # Create the API objects before they are shared by the worker threads
+        _ = (self.cm_api, self.mgmt_api, self.hosts_api, self.all_hosts_api, self.command_api)
+        parent_phase = self.timeline.current_phase()
+
+        def _run_step(name):
+            with self.timeline.phase(name, parent=parent_phase) as phase:
+                steps[name][1]()
+            return phase['secs']
+
+        def _on_done(name, secs):
+            print('STATUS:Step {} completed in {:.1f} secs'.format(name, secs))
+
+        def _on_error(name, exc):
+            print('STATUS:Step {} FAILED: {}'.format(name, exc))
+
+        return run_graph(OrderedDict((name, (prereqs, lambda n=name: _run_step(n)))
+                                     for name, (prereqs, _) in steps.items()),
+                         max_workers=max_workers, on_done=_on_done, on_error=_on_error, thread_name_prefix='setup')
+
+    def _begin_trial(self):
         # Accept trial licence
         try:
             self.cm_api.begin_trial()
@@ -317,6 +491,7 @@ class ClusterCreator:
             else:
                 raise
 
+    def _install_host(self, key_file, cm_repo_url):
         # Install CM Agent on host
         with open(key_file, "r") as f:
             key = f.read()
@@ -335,6 +510,7 @@ class ClusterCreator:
             if not cmd.success:
                 raise RuntimeError('Failed to add host to the cluster')
 
+    def _setup_cms(self):
         # Create MGMT/CMS
         try:
             self.mgmt_api.read_service()
@@ -356,6 +532,7 @@ class ClusterCreator:
             if not cmd.success:
                 raise RuntimeError('Failed to start Management Services')
 
+    def _update_banner(self):
         # Update cluster banner
         c_id = cluster_id()
         banner = 'Cluster ID: {}, Host: {}'.format(c_id, socket.gethostname())
@@ -368,6 +545,7 @@ class ClusterCreator:
             ])
         )
 
+    def _update_smm_host_config(self):
         # Update host-level parameter required by SMM
         self.all_hosts_api.update_config(
             message='Updating parameter for SMM',
@@ -379,34 +557,24 @@ class ClusterCreator:
             ])
         )
 
-        # Enable kerberos
-        if use_kerberos:
-            self._enable_kerberos(kerberos_type, ipa_host)
-
-        # Enable TLS
-        if use_tls:
-            self._enable_tls()
-
-        # Wait for Service Monitor to be up before restarting Mgmt Services
-        # Note: This is to avoid corruption of SMON LevelDB files
-        timeout_secs=300
+    def _wait_for_service_monitor(self, timeout_secs=300):
         smon_url = 'http://{}:9997/'.format(local_hostname())
-        while timeout_secs > 0:
-            try:
-                requests.get(smon_url)
-                break
-            except Exception as exc:
-                print('STATUS:Waiting for Service Monitor to fully start ({})...'.format(smon_url))
-                timeout_secs -= 1
-                time.sleep(1)
 
-        # Restart Mgmt Services
-        cmd = self.mgmt_api.restart_command()
-        self.wait(cmd)
+        def _smon_is_up():
+            requests.get(smon_url)
+            return True
+
+        poll(_smon_is_up, timeout_secs=timeout_secs, max_interval_secs=2, retry_on=(Exception,),
+             raise_on_timeout=False, name='ClusterCreator.wait_for_service_monitor',
+             on_retry=lambda *args: print('STATUS:Waiting for Service Monitor to fully start ({})...'.format(smon_url)))
 
     def create_cluster(self, template, import_retries=2):
+        with self.timeline.phase('create_cluster'):
+            self._create_cluster(template, import_retries)
 
-        self._import_paywall_credentials()
+    def _create_cluster(self, template, import_retries):
+        with self.timeline.phase('paywall_credentials'):
+            self._import_paywall_credentials()
 
         # Create the cluster using the template
         with open(template) as f:
@@ -422,36 +590,40 @@ class ClusterCreator:
         Response = namedtuple("Response", "data")
         dst_cluster_template = self.api_client.deserialize(response=Response(json_str),
                                                            response_type=cm_client.ApiClusterTemplate)
-        cmd = self.cm_api.import_cluster_template(add_repositories=True, body=dst_cluster_template)
-        retries = 0
-        while True:
-            # TODO: It doesn't hurt to have a retry for the Import Cluster action. Nevertheless, the reason
-            # for the retry logic here is an intermittent failure on First Run of YARN Queue Manager that causes
-            # it to fail due to failing to bind to port 8081. I haven't been able to identify the root cause for that
-            # yet. Hence, the retry. Once that's fixed this could be removed.
-            cmd = self.wait(cmd)
-            if cmd.success or retries >= import_retries:
-                break
-            retries += 1
-            print('WARNING: Import Cluster failed. Restarting Mgmt Services before starting retry attempt #{}.'.format(retries))
-
-            # Some failures are due to stale Mgmt Services, so let's give them a bounce and wait for the cluster
-            # health to be GOOD
-            mgmt_restart_cmd = self.mgmt_api.restart_command()
-            self.wait(mgmt_restart_cmd)
-            self.wait_for_good_health(cluster_name)
-
-            # Retry original command
-            cmd = self.retry(cmd)
-        if not cmd.success:
-            raise RuntimeError('Failed to deploy cluster template')
+        with self.timeline.phase('template_import'):
+            cmd = self.cm_api.import_cluster_template(add_repositories=True, body=dst_cluster_template)
+            retries = 0
+            while True:
+                # TODO: It doesn't hurt to have a retry for the Import Cluster action. Nevertheless, the reason
+                # for the retry logic here is an intermittent failure on First Run of YARN Queue Manager that causes
+                # it to fail due to failing to bind to port 8081. I haven't been able to identify the root cause for that
+                # yet. Hence, the retry. Once that's fixed this could be removed.
+                cmd = self.wait(cmd)
+                if cmd.success or retries >= import_retries:
+                    break
+                retries += 1
+                print('WARNING: Import Cluster failed. Restarting Mgmt Services before starting retry attempt #{}.'.format(retries))
+
+                # Some failures are due to stale Mgmt Services, so let's give them a bounce and wait for the cluster
+                # health to be GOOD
+                with self.timeline.phase('import_retry_{}_mgmt_restart'.format(retries)):
+                    mgmt_restart_cmd = self.mgmt_api.restart_command()
+                    self.wait(mgmt_restart_cmd)
+                    self.wait_for_good_health(cluster_name)
+
+                # Retry original command
+                cmd = self.retry(cmd)
+            if not cmd.success:
+                raise RuntimeError('Failed to deploy cluster template')
 
         # All parcel downloads should've already been done at this point, so we can safely remove the paywall credentials
-        self._reset_paywall_credentials()
+        with self.timeline.phase('reset_paywall_credentials'):
+            self._reset_paywall_credentials()
 
         # Restart Mgmt Services
-        cmd = self.mgmt_api.restart_command()
-        cmd = self.wait(cmd)
+        with self.timeline.phase('mgmt_restart'):
+            cmd = self.mgmt_api.restart_command()
+            cmd = self.wait(cmd)
 
     def _enable_kerberos(self, kerberos_type, ipa_host):
         # Update Kerberos configuration
@@ -524,6 +696,10 @@ class ClusterCreator:
 if __name__ == '__main__':
     (options, args) = parse_args()
 
+    if options.summarize_timelines:
+        print_timeline_summary(options.summarize_timelines)
+        exit(0)
+
     if len(args) != 1:
         _get_parser().print_help()
         exit(1)
@@ -544,3 +720,8 @@ if __name__ == '__main__':
     except:
         print_errors(3)
         raise
+    finally:
+        try:
+            print('Cluster build timeline written to {}'.format(CLUSTER_CREATOR.timeline.write()))
+        except Exception as exc:
+            print('WARNING: Failed to write the cluster build timeline: {}'.format(exc))
@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import ast
+import hashlib
+import inspect
+import json
 import logging
 import os
 import re
 import socket
+import sys
+import tempfile
+import textwrap
+import threading
 import time
+import types
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict, namedtuple
 from contextlib import contextmanager
 from datetime import datetime
+from functools import wraps
 from importlib import import_module
 from inspect import getmembers
 
 #import pytest
 import requests
 
+from . import polling, sessions, tracing
+
+_PROCESS_START_TIME = time.time()
+
 logging.basicConfig(level=logging.WARN)
 LOG = logging.getLogger(__package__)
 LOG.setLevel(logging.INFO)
@@ -28,7 +43,74 @@ THE_PWD_FILE_NAME = 'the_pwd.txt'
 ENABLE_TLS_FILE_NAME = '.enable-tls'
 ENABLE_KERBEROS_FILE_NAME = '.enable-kerberos'
 DEFAULT_TRUSTSTORE_PATH = '/opt/cloudera/security/x509/truststore.pem'
-WORKSHOPS = {}
+WORKSHOP_STATE_FILE_NAME = '.workshop-state.json'
+WORKSHOP_STATE_MAX_RUNS = 10
+TEARDOWN_MAX_WORKERS = 4
+CM_METRICS_INTERVAL_ENV_VAR = 'WORKSHOP_CM_METRICS_INTERVAL_SECS'
+IMPORT_REPORT_ENV_VAR = 'WORKSHOP_IMPORT_REPORT'
+
+# Setup status of a workshop (see AbstractWorkshop.get_setup_status)
+SETUP_SATISFIED = 'satisfied'
+SETUP_RESUMABLE = 'resumable'
+SETUP_STALE = 'stale'
+
+
+class _WorkshopRegistry(dict):
+    """
+    Workshop classes by workshop id. The ids and prereqs of the workshops are read from the workshop_*.py files
+    without importing them (see _load_workshops) and each workshop module is only imported when its class is
+    accessed.
+    """
+    def __missing__(self, workshop_id):
+        _load_workshops()
+        if workshop_id not in _WORKSHOP_METADATA:
+            raise KeyError(workshop_id)
+        _import_workshop_module(_WORKSHOP_METADATA[workshop_id]['module'])
+        return dict.__getitem__(self, workshop_id)
+
+    def __contains__(self, workshop_id):
+        _load_workshops()
+        return dict.__contains__(self, workshop_id) or workshop_id in _WORKSHOP_METADATA
+
+    def __iter__(self):
+        _load_workshops()
+        return iter(sorted(set(dict.keys(self)) | set(_WORKSHOP_METADATA)))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[workshop_id] for workshop_id in self]
+
+    def items(self):
+        return [(workshop_id, self[workshop_id]) for workshop_id in self]
+
+    def get(self, workshop_id, default=None):
+        return self[workshop_id] if workshop_id in self else default
+
+
+WORKSHOPS = _WorkshopRegistry()
+_WORKSHOP_METADATA = None  # workshop id -> {'module': module name, 'prereqs': prereqs list or None if unknown}
+_IMPORT_TIMES = OrderedDict()  # module name -> {'secs': import time, 'new_packages': top-level packages imported}
+_METADATA_SCAN_SECS = None
+_LAST_TEARDOWN_STATS = None
+
+EnvProfile = namedtuple('EnvProfile', ['tls_enabled', 'kerberos_enabled', 'hostname', 'the_pwd', 'truststore_path',
+                                       'url_scheme'])
+_ENV_PROFILE = None
+_ENV_PROFILE_LOCK = threading.RLock()
+_ENV_PROFILE_FS_CHECKS = {}  # profile field -> filesystem checks needed to resolve it
+_ENV_PROFILE_LOOKUPS = {}  # profile field -> number of lookups served from the profile
+_ENV_PROFILE_RESOLUTIONS = 0
+_SERVICE_VERSIONS = {}
+_CONTEXT_ATTRS = {}  # function -> attributes of the workshop context it reads and sets
+_STATE_LOCK = threading.RLock()  # serializes the load/modify/save cycles of concurrent setups and teardowns
 
 
 def _get_step_number(method_name):
@@ -55,72 +137,150 @@ def _get_parent_dir(path):
     return os.path.realpath(os.path.join(path, '..'))
 
 
-def get_the_pwd():
-    if THE_PWD_ENV_VAR in os.environ:
-        return os.environ[THE_PWD_ENV_VAR]
+def _find_file_upwards(file_name, path=None):
+    """Return the path of the file in the given dir or its closest ancestor, or None, and the number of checks made."""
+    path = path if path is not None else get_base_dir()
+    checks = 0
+    while path != '/':
+        file_path = os.path.join(path, file_name)
+        checks += 1
+        if os.path.exists(file_path):
+            return file_path, checks
+        path = _get_parent_dir(path)
+    return None, checks
 
-    return _get_the_pwd_from_file(get_base_dir())
 
+def _resolve_hostname(public_ip=None):
+    public_ip = public_ip if public_ip else os.environ[PUBLIC_IP_ENV_VAR] if PUBLIC_IP_ENV_VAR in os.environ else None
+    if HOSTNAME_ENV_VAR in os.environ:
+        return os.environ[HOSTNAME_ENV_VAR]
+    elif public_ip:
+        return f'cdp.{public_ip}.nip.io'
+    else:
+        return socket.gethostname()
 
-def _get_the_pwd_from_file(path):
-    if path == '/':
-        raise RuntimeError('Cannot get The Pwd. Please set the THE_PWD env variable.')
 
-    file_path = os.path.join(path, THE_PWD_FILE_NAME)
-    if os.path.exists(file_path):
-        return open(file_path).read()
-    else:
-        return _get_the_pwd_from_file(_get_parent_dir(path))
+def refresh_env_profile():
+    """
+    Resolve the environment profile again. Needed only if the environment (security settings, hostname, password)
+    changes during the execution of the process. Cached service versions are discarded too.
+    """
+    global _ENV_PROFILE
+    global _ENV_PROFILE_RESOLUTIONS
+    with _ENV_PROFILE_LOCK:
+        tls_file, tls_checks = _find_file_upwards(ENABLE_TLS_FILE_NAME)
+        kerberos_file, kerberos_checks = _find_file_upwards(ENABLE_KERBEROS_FILE_NAME)
+        if THE_PWD_ENV_VAR in os.environ:
+            the_pwd, pwd_checks = os.environ[THE_PWD_ENV_VAR], 0
+        else:
+            pwd_file, pwd_checks = _find_file_upwards(THE_PWD_FILE_NAME)
+            the_pwd = open(pwd_file).read() if pwd_file else None
+        _ENV_PROFILE = EnvProfile(
+            tls_enabled=tls_file is not None,
+            kerberos_enabled=kerberos_file is not None,
+            hostname=_resolve_hostname(),
+            the_pwd=the_pwd,
+            truststore_path=DEFAULT_TRUSTSTORE_PATH,
+            url_scheme='https' if tls_file is not None else 'http',
+        )
+        _ENV_PROFILE_FS_CHECKS.update({'tls_enabled': tls_checks, 'url_scheme': tls_checks,
+                                       'kerberos_enabled': kerberos_checks, 'the_pwd': pwd_checks})
+        _ENV_PROFILE_RESOLUTIONS += 1
+        _SERVICE_VERSIONS.clear()
+        LOG.debug('Environment profile: %s', _ENV_PROFILE._replace(the_pwd='********'))
+        return _ENV_PROFILE
+
+
+def get_env_profile():
+    """Return the environment profile, resolving it on the first call."""
+    if _ENV_PROFILE is None:
+        with _ENV_PROFILE_LOCK:
+            if _ENV_PROFILE is None:
+                refresh_env_profile()
+    return _ENV_PROFILE
+
+
+def _get_profile_field(field):
+    _ENV_PROFILE_LOOKUPS[field] = _ENV_PROFILE_LOOKUPS.get(field, 0) + 1
+    return getattr(get_env_profile(), field)
+
+
+def get_env_profile_stats():
+    """Return how many profile lookups were made and how many filesystem checks the profile saved."""
+    fs_checks_saved = sum(count * _ENV_PROFILE_FS_CHECKS.get(field, 0) for field, count in _ENV_PROFILE_LOOKUPS.items())
+    fs_checks_made = sum(v for k, v in _ENV_PROFILE_FS_CHECKS.items() if k != 'url_scheme') * _ENV_PROFILE_RESOLUTIONS
+    return {
+        'resolutions': _ENV_PROFILE_RESOLUTIONS,
+        'lookups': dict(_ENV_PROFILE_LOOKUPS),
+        'fs_checks_saved': max(0, fs_checks_saved - fs_checks_made),
+        'service_versions': {k: str(v) for k, v in _SERVICE_VERSIONS.items()},
+    }
+
+
+tracing.register_report_section('env_profile', get_env_profile_stats)
+
+
+def get_service_version(service, resolver):
+    """Return the version of the service, calling resolver() only the first time after a profile refresh."""
+    with _ENV_PROFILE_LOCK:
+        if service not in _SERVICE_VERSIONS:
+            _SERVICE_VERSIONS[service] = resolver()
+        return _SERVICE_VERSIONS[service]
+
+
+def get_the_pwd():
+    the_pwd = _get_profile_field('the_pwd')
+    if the_pwd is None:
+        raise RuntimeError('Cannot get The Pwd. Please set the THE_PWD env variable.')
+    return the_pwd
 
 
 def get_truststore_path():
-    return DEFAULT_TRUSTSTORE_PATH
+    return _get_profile_field('truststore_path')
 
 
 def is_tls_enabled(path=None):
     if path is None:
-        path = get_base_dir()
-
-    if path == '/':
-        return False
-    elif os.path.exists(os.path.join(path, ENABLE_TLS_FILE_NAME)):
-        return True
-    else:
-        return is_tls_enabled(_get_parent_dir(path))
+        return _get_profile_field('tls_enabled')
+    return _find_file_upwards(ENABLE_TLS_FILE_NAME, path)[0] is not None
 
 
 def is_kerberos_enabled(path=None):
     if path is None:
-        path = get_base_dir()
-
-    if path == '/':
-        return False
-    elif os.path.exists(os.path.join(path, ENABLE_KERBEROS_FILE_NAME)):
-        return True
-    else:
-        return is_kerberos_enabled(_get_parent_dir(path))
+        return _get_profile_field('kerberos_enabled')
+    return _find_file_upwards(ENABLE_KERBEROS_FILE_NAME, path)[0] is not None
 
 
 def get_hostname(public_ip=None):
-    public_ip = public_ip if public_ip else os.environ[PUBLIC_IP_ENV_VAR] if PUBLIC_IP_ENV_VAR in os.environ else None
-    if HOSTNAME_ENV_VAR in os.environ:
-        return os.environ[HOSTNAME_ENV_VAR]
-    elif public_ip:
-        return f'cdp.{public_ip}.nip.io'
-    else:
-        return socket.gethostname()
+    if public_ip:
+        # An explicit public IP may refer to a different host than the profile's
+        return _resolve_hostname(public_ip)
+    return _get_profile_field('hostname')
 
 
 def get_url_scheme():
-    return 'https' if is_tls_enabled() else 'http'
+    return _get_profile_field('url_scheme')
+
+
+def get_service_session(service, auth_factory=None, public_ip=None, verify=None):
+    """
+    Return the pooled session for the service on the cluster host (see labs.sessions).
+    By default, TLS certificates are verified with the cluster truststore if TLS is enabled.
+    """
+    if verify is None and is_tls_enabled():
+        verify = get_truststore_path()
+    return sessions.get_session(service, get_hostname(public_ip), auth_factory=auth_factory, verify=verify)
 
 
 def api_request(method, url, expected_codes=None, auth=None, session=None, **kwargs):
     if not expected_codes:
         expected_codes = [requests.codes.ok]
-    truststore = get_truststore_path() if is_tls_enabled() else None
+    # Sessions carry their own verification settings
+    truststore = get_truststore_path() if session is None and is_tls_enabled() else None
     LOG.debug('Request: method: %s, url: %s, auth: %s, verify: %s, kwargs: %s',
               method, url, 'yes' if auth else 'no', truststore, kwargs)
+    if session is None:
+        kwargs.setdefault('hooks', {'response': tracing.trace_response})
     req = session or requests
     resp = req.request(method, url, auth=auth, verify=truststore, **kwargs)
     if resp.status_code not in expected_codes:
@@ -145,6 +305,121 @@ def api_patch(url, expected_codes=None, auth=None, session=None, **kwargs):
     return api_request('PATCH', url, expected_codes=expected_codes, auth=auth, session=session, **kwargs)
 
 
+def _get_state_file_path():
+    return os.path.join(_get_parent_dir(get_base_dir()), WORKSHOP_STATE_FILE_NAME)
+
+
+def _load_state():
+    path = _get_state_file_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except ValueError:
+        LOG.warning('Ignoring corrupted workshop state file %s', path)
+        return {}
+
+
+def _save_state(state):
+    # Keep only the most recent runs to prevent the file from growing forever when RUN_ID is not persisted
+    for run_id in sorted(state, key=lambda r: _to_int(r))[:-WORKSHOP_STATE_MAX_RUNS]:
+        del state[run_id]
+    path = _get_state_file_path()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=WORKSHOP_STATE_FILE_NAME, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as state_file:
+            json.dump(state, state_file, indent=2, sort_keys=True)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _to_int(x):
+    try:
+        return int(x)
+    except (TypeError, ValueError):
+        return 0
+
+
+def get_completed_labs(run_id, workshop_id):
+    """Return a dict with the labs of the workshop completed in the given run and their fingerprints."""
+    return _load_state().get(str(run_id), {}).get(workshop_id, {})
+
+
+def _record_lab(run_id, workshop_id, lab_name, fingerprint):
+    with _STATE_LOCK:
+        state = _load_state()
+        state.setdefault(str(run_id), {}).setdefault(workshop_id, {})[lab_name] = fingerprint
+        _save_state(state)
+
+
+def _clear_labs(run_id, workshop_id=None):
+    with _STATE_LOCK:
+        state = _load_state()
+        if workshop_id is None:
+            state.pop(str(run_id), None)
+        elif str(run_id) in state:
+            state[str(run_id)].pop(workshop_id, None)
+        _save_state(state)
+
+
+def _update_code_fingerprint(hasher, code):
+    hasher.update(code.co_code)
+    hasher.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code_fingerprint(hasher, const)
+        else:
+            hasher.update(repr(const).encode())
+
+
+def _lab_fingerprint(func):
+    """
+    Return a hash of the inputs of a lab function: its code, the values of the module-level constants it
+    references (e.g. SQL statements, schemas) and the security setup of the environment.
+    Changes to helper functions in labs.utils are not tracked.
+    """
+    hasher = hashlib.sha256()
+    _update_code_fingerprint(hasher, func.__code__)
+    for name in func.__code__.co_names:
+        value = func.__globals__.get(name)
+        if isinstance(value, (str, int, float, bool, list, tuple, dict)):
+            hasher.update(json.dumps(value, sort_keys=True, default=str).encode())
+    hasher.update(json.dumps([get_hostname(), is_tls_enabled(), is_kerberos_enabled()]).encode())
+    return hasher.hexdigest()
+
+
+def _get_context_attrs(func):
+    """
+    Return the sets of attributes of self.context that the function reads and sets. A read of the whole context
+    (e.g. passing it to a helper) is reported as the attribute '*'.
+    """
+    if func not in _CONTEXT_ATTRS:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+        parents = {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+        loads, stores = set(), set()
+        for node in ast.walk(tree):
+            if not (isinstance(node, ast.Attribute) and node.attr == 'context'
+                    and isinstance(node.value, ast.Name) and node.value.id == 'self'):
+                continue
+            parent = parents.get(node)
+            if isinstance(parent, ast.Attribute) and parent.value is node:
+                (stores if isinstance(parent.ctx, ast.Store) else loads).add(parent.attr)
+            else:
+                loads.add('*')
+        _CONTEXT_ATTRS[func] = (loads, stores)
+    return _CONTEXT_ATTRS[func]
+
+
+def _get_prereq_target(prereq):
+    if isinstance(prereq, str):
+        return prereq, 99
+    return prereq
+
+
 class AbstractWorkshopMeta(ABCMeta):
     def __init__(cls, name, bases, dct):
         type.__init__(cls, name, bases, dct)
@@ -196,68 +471,233 @@ class AbstractWorkshop(metaclass=AbstractWorkshopMeta):
     def teardown(self):
         pass
 
+    @classmethod
+    def requires_prereq_context(cls):
+        """
+        Return True if the labs of this workshop rely on the context built by the labs of its prereqs.
+        When that's the case the prereqs cannot be skipped (and have to be set up again) whenever the labs of
+        this workshop are executed. This method can be overriden by workshops that are self-contained.
+        """
+        return True
+
+    @classmethod
+    def teardown_resources(cls):
+        """
+        Return the set of shared resources (e.g. 'nifi' for the NiFi canvas, 'ssb', 'schreg') cleaned up by the
+        teardown of this workshop. Teardowns that share resources are never executed concurrently.
+        None means that the teardown can touch anything and must be executed alone.
+        """
+        return None
+
+    @classmethod
+    def get_prereq_targets(cls):
+        """Return the prereqs of this workshop as a list of (workshop, lab) tuples."""
+        return [_get_prereq_target(prereq) for prereq in cls.prereqs()]
+
+    @classmethod
+    def get_lab_setup_functions(cls):
+        return sorted([(_get_step_number(n), n, f) for n, f in
+                       getmembers(cls) if _get_step_number(n) is not None])
+
+    def _get_expected_labs(self, target_lab):
+        return OrderedDict((func_name, _lab_fingerprint(func)) for lab_number, func_name, func
+                           in self.get_lab_setup_functions() if lab_number < target_lab)
+
+    def _can_resume(self, missing_funcs):
+        """
+        Return True if the missing labs only read context attributes set by before_setup() or by the missing labs
+        themselves: the context built by the labs completed in a previous execution (or by the prereqs) is lost.
+        """
+        available = set(_get_context_attrs(type(self).before_setup)[1])
+        for func in missing_funcs:
+            available |= _get_context_attrs(func)[1]
+        return all(_get_context_attrs(func)[0] <= available for func in missing_funcs)
+
+    def get_setup_status(self, target_lab=99):
+        """
+        Return SETUP_SATISFIED if all the labs of this workshop numbered lower than target_lab (and no others) have
+        been completed in the current run with the same inputs they have now, SETUP_RESUMABLE if the completed labs
+        are the first ones of those, with the same inputs, and the missing labs don't depend on their context, or
+        SETUP_STALE otherwise.
+        """
+        expected = self._get_expected_labs(target_lab)
+        completed = get_completed_labs(self.run_id, self.workshop_id())
+        if completed == expected:
+            return SETUP_SATISFIED
+        first_labs = list(expected)[:len(completed)]
+        if (not completed or set(completed) != set(first_labs)
+                or any(completed[name] != expected[name] for name in first_labs)):
+            return SETUP_STALE
+        missing_funcs = [func for lab_number, func_name, func in self.get_lab_setup_functions()
+                         if func_name in expected and func_name not in completed]
+        return SETUP_RESUMABLE if self._can_resume(missing_funcs) else SETUP_STALE
+
+    def is_setup_satisfied(self, target_lab=99, include_prereqs=False):
+        """
+        Return True if all the labs of this workshop numbered lower than target_lab (and no others) have been
+        completed in the current run with the same inputs they have now.
+        """
+        if self.get_setup_status(target_lab) != SETUP_SATISFIED:
+            return False
+        return not include_prereqs or self._are_prereqs_satisfied()
+
     def _setup_prereqs(self):
         global WORKSHOPS
-        for prereq in self.prereqs():
-            if isinstance(prereq, str):
-                workshop = prereq
-                lab = 99
-            else:
-                workshop, lab = prereq
-
+        for workshop, lab in self.get_prereq_targets():
             LOG.info('Executing prereqs setup: Workshop {}, Lab < {}'.format(workshop, lab))
-            WORKSHOPS[workshop](self.run_id, self.context).execute_setup(lab)
+            WORKSHOPS[workshop](self.run_id, self.context).execute_setup(lab, force=self.requires_prereq_context())
 
     def _teardown_prereqs(self):
         global WORKSHOPS
-        for prereq in self.prereqs():
-            if isinstance(prereq, str):
-                workshop = prereq
-            else:
-                workshop, _ = prereq
-
+        for workshop, _ in self.get_prereq_targets():
             LOG.info('Executing prereqs teardown: Workshop {}'.format(workshop))
             WORKSHOPS[workshop](self.run_id, self.context).execute_teardown()
 
-    def execute_setup(self, target_lab=99):
+    def _are_prereqs_satisfied(self):
+        return all(WORKSHOPS[workshop](self.run_id, self.context).is_setup_satisfied(lab, include_prereqs=True)
+                   for workshop, lab in self.get_prereq_targets())
+
+    def execute_setup(self, target_lab=99, force=False):
         if not self.is_runnable():
             LOG.warning("Workshop is not runnable.")
             return None
-        self._setup_prereqs()
-        self.before_setup()
-        lab_setup_functions = sorted([(_get_step_number(n), n, f) for n, f in
-                                      getmembers(self.__class__) if _get_step_number(n) is not None])
-        LOG.debug("Found Lab Setup Functions: %s", str(map(lambda x: x[2], lab_setup_functions)))
-        for lab_number, func_name, func in lab_setup_functions:
-            if lab_number < target_lab:
-                LOG.info("Executing {}::{}".format(self.workshop_id(), func_name))
-                try:
-                    func(self)
-                except Exception as err:
-                    LOG.info("Execution of {}::{} FAILED!".format(self.workshop_id(), func_name))
-                    raise err
-            else:
-                LOG.debug("[{0}] is numbered higher than target [lab{1}], skipping".format(func_name, target_lab))
-        self.after_setup()
+        status = SETUP_STALE if force else self.get_setup_status(target_lab)
+        completed = {}
+        if status != SETUP_STALE:
+            # The labs to execute, if any, don't need the context of the prereqs, which only need to be up to date
+            for workshop, lab in self.get_prereq_targets():
+                WORKSHOPS[workshop](self.run_id, self.context).execute_setup(lab)
+            if status == SETUP_SATISFIED:
+                LOG.info('Workshop {} is already set up up to lab {}, skipping.'.format(self.workshop_id(), target_lab))
+                return self.context
+            completed = get_completed_labs(self.run_id, self.workshop_id())
+            LOG.info('Resuming the setup of Workshop {} after lab(s) {}.'.format(
+                self.workshop_id(), ', '.join(sorted(completed))))
+        else:
+            self._setup_prereqs()
+            _clear_labs(self.run_id, self.workshop_id())
+        with tracing.TRACER.span('setup', self.workshop_id()):
+            with tracing.TRACER.span('step', 'before_setup'):
+                self.before_setup()
+            lab_setup_functions = self.get_lab_setup_functions()
+            LOG.debug("Found Lab Setup Functions: %s", str(map(lambda x: x[2], lab_setup_functions)))
+            for lab_number, func_name, func in lab_setup_functions:
+                if func_name in completed:
+                    LOG.debug("[{0}] was already completed, skipping".format(func_name))
+                elif lab_number < target_lab:
+                    LOG.info("Executing {}::{}".format(self.workshop_id(), func_name))
+                    try:
+                        with tracing.TRACER.span('lab', func_name):
+                            func(self)
+                    except Exception as err:
+                        LOG.info("Execution of {}::{} FAILED!".format(self.workshop_id(), func_name))
+                        raise err
+                    _record_lab(self.run_id, self.workshop_id(), func_name, _lab_fingerprint(func))
+                else:
+                    LOG.debug("[{0}] is numbered higher than target [lab{1}], skipping".format(func_name, target_lab))
+            with tracing.TRACER.span('step', 'after_setup'):
+                self.after_setup()
         return self.context
 
-    def execute_teardown(self):
+    def execute_teardown(self, include_prereqs=True):
         if not self.is_runnable():
             LOG.warning("Workshop is not runnable.")
             return
-        self.teardown()
-        self._teardown_prereqs()
+        with tracing.TRACER.span('teardown', self.workshop_id()):
+            self.teardown()
+        _clear_labs(self.run_id, self.workshop_id())
+        if include_prereqs:
+            self._teardown_prereqs()
 
     def get_artifacts_dir(self):
         return os.path.join(os.path.dirname(__file__), 'artifacts', self.workshop_id())
 
 
+def _get_returned_literal(func_def):
+    for node in ast.walk(func_def):
+        if isinstance(node, ast.Return):
+            return ast.literal_eval(node.value)
+    return None
+
+
+def _read_workshop_metadata(file_path):
+    """Return the id and prereqs of the workshop defined in the file, without importing it."""
+    with open(file_path) as f:
+        tree = ast.parse(f.read(), file_path)
+    for cls in [node for node in tree.body if isinstance(node, ast.ClassDef)]:
+        methods = {node.name: node for node in cls.body if isinstance(node, ast.FunctionDef)}
+        if 'workshop_id' not in methods:
+            continue
+        try:
+            workshop_id = _get_returned_literal(methods['workshop_id'])
+        except ValueError:
+            return None, None
+        try:
+            prereqs = _get_returned_literal(methods['prereqs']) if 'prereqs' in methods else None
+        except ValueError:
+            prereqs = None  # Not a literal. Will be read from the class.
+        return workshop_id, prereqs
+    return None, None
+
+
 def _load_workshops():
+    """Read the workshop metadata. Modules whose metadata cannot be read statically are imported."""
+    global _WORKSHOP_METADATA
+    global _METADATA_SCAN_SECS
+    if _WORKSHOP_METADATA is not None:
+        return
+    start = time.time()
+    metadata = {}
     base_dir = get_base_dir()
-    for f in os.listdir(base_dir):
-        if f.startswith('workshop_') and os.path.isfile(os.path.join(base_dir, f)):
-            f = '.' + f.replace('.py', '')
-            import_module(f, package=__package__)
+    for f in sorted(os.listdir(base_dir)):
+        if f.startswith('workshop_') and f.endswith('.py') and os.path.isfile(os.path.join(base_dir, f)):
+            module_name = '.' + f.replace('.py', '')
+            workshop_id, prereqs = _read_workshop_metadata(os.path.join(base_dir, f))
+            if workshop_id is None:
+                _import_workshop_module(module_name)
+            else:
+                metadata[workshop_id] = {'module': module_name, 'prereqs': prereqs}
+    _WORKSHOP_METADATA = metadata
+    _METADATA_SCAN_SECS = time.time() - start
+
+
+def _import_workshop_module(module_name):
+    before = set(sys.modules)
+    start = time.time()
+    import_module(module_name, package=__package__)
+    elapsed = time.time() - start
+    # the REST clients used by the workshop are only imported with it
+    tracing.instrument_clients()
+    if module_name not in _IMPORT_TIMES:
+        new_packages = sorted(set(m.split('.')[0] for m in set(sys.modules) - before) - {__package__})
+        _IMPORT_TIMES[module_name] = {'secs': round(elapsed, 6), 'new_packages': new_packages}
+        LOG.debug('import time: %10d us | %s (new packages: %s)', elapsed * 1000000, module_name,
+                  ', '.join(new_packages))
+
+
+def get_import_report():
+    """Return the time spent reading the workshop metadata and importing each workshop module."""
+    return {
+        'metadata_scan_secs': round(_METADATA_SCAN_SECS, 6) if _METADATA_SCAN_SECS is not None else None,
+        'imported_workshop_modules': [dict(module=module, **times) for module, times in _IMPORT_TIMES.items()],
+        'secs_since_labs_import': round(time.time() - _PROCESS_START_TIME, 6),
+    }
+
+
+def format_import_report():
+    """Return the import report in the format of "python -X importtime" (times in microseconds)."""
+    report = get_import_report()
+    lines = ['import time: self [us] | imported package']
+    if report['metadata_scan_secs'] is not None:
+        lines.append('import time: {:>10} | (workshop metadata scan)'.format(int(report['metadata_scan_secs'] * 1e6)))
+    for module in report['imported_workshop_modules']:
+        lines.append('import time: {:>10} | {}{}'.format(
+            int(module['secs'] * 1e6), __package__ + module['module'],
+            ' (new: {})'.format(', '.join(module['new_packages'])) if module['new_packages'] else ''))
+    return '\n'.join(lines)
+
+
+tracing.register_report_section('imports', get_import_report)
 
 
 def is_workshop_runnable(target_workshop):
@@ -266,6 +706,45 @@ def is_workshop_runnable(target_workshop):
     return False
 
 
+def _start_metrics_collector():
+    """Start collecting CM metrics (see labs.utils.cm_metrics) if enabled in the environment."""
+    if not os.environ.get(CM_METRICS_INTERVAL_ENV_VAR):
+        return None
+    try:
+        cm_metrics = import_module('.utils.cm_metrics', package=__package__)
+        return cm_metrics.MetricsCollector(interval_secs=cm_metrics.get_interval_from_env()).start()
+    except Exception as exc:
+        LOG.warning('Failed to start the CM metrics collection: {}'.format(exc))
+        return None
+
+
+def _with_run_report(action):
+    """Trace the decorated function and write the run report (see labs.tracing) when it completes or fails."""
+    def wrap(f):
+        @wraps(f)
+        def wrapped_f(*args, **kwargs):
+            tracing.instrument_clients()
+            tracing.TRACER.reset(action)
+            collector = _start_metrics_collector()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                if collector:
+                    try:
+                        LOG.info('CM metrics written to {}'.format(collector.stop().write()))
+                    except Exception as exc:
+                        LOG.warning('Failed to write the CM metrics: {}'.format(exc))
+                try:
+                    LOG.info('Run report written to {}'.format(tracing.TRACER.write_report()))
+                except Exception as exc:
+                    LOG.warning('Failed to write the run report: {}'.format(exc))
+                if os.environ.get(IMPORT_REPORT_ENV_VAR, '').lower() in ['1', 'true', 'yes']:
+                    print(format_import_report())
+        return wrapped_f
+    return wrap
+
+
+@_with_run_report('setup')
 def workshop_setup(target_workshop='base', target_lab=99, run_id=None, ignore=False):
     _load_workshops()
     if target_workshop in WORKSHOPS:
@@ -278,20 +757,176 @@ def workshop_setup(target_workshop='base', target_lab=99, run_id=None, ignore=Fa
     LOG.info('Global setup completed successfully!')
 
 
+@_with_run_report('teardown')
 def workshop_teardown(target_workshop, run_id=None, ignore=False):
     _load_workshops()
     if target_workshop in WORKSHOPS:
         LOG.info('Executing teardown for Workshop {}'.format(target_workshop))
-        WORKSHOPS[target_workshop](run_id).execute_teardown()
+        _execute_teardown_plan([target_workshop], run_id)
     elif target_workshop is not None and ignore:
         LOG.info('Passing')
     elif target_workshop is None:
-        for target_workshop in WORKSHOPS:
-            LOG.info('Executing teardown for Workshop {}'.format(target_workshop))
-            WORKSHOPS[target_workshop](run_id).execute_teardown()
+        LOG.info('Executing teardown for all Workshops')
+        _execute_teardown_plan(list(WORKSHOPS), run_id)
     LOG.info('Global teardown completed successfully!')
 
 
+def _get_teardown_nodes(target_workshops):
+    """Return an OrderedDict with the target workshops and all their prereqs, each one once, and their prereqs."""
+    nodes = OrderedDict()
+
+    def _add(workshop):
+        if workshop not in nodes:
+            nodes[workshop] = [p for p, _ in _get_workshop_prereq_targets(workshop)]
+            for prereq in nodes[workshop]:
+                _add(prereq)
+
+    for target_workshop in target_workshops:
+        _add(target_workshop)
+    return nodes
+
+
+def _get_serial_teardown_order(target_workshops):
+    """Return the teardown order of the serial implementation, where prereqs are torn down once per dependent."""
+    order = []
+
+    def _add(workshop):
+        order.append(workshop)
+        for prereq, _ in _get_workshop_prereq_targets(workshop):
+            _add(prereq)
+
+    for target_workshop in target_workshops:
+        _add(target_workshop)
+    return order
+
+
+def _resources_conflict(resources1, resources2):
+    return resources1 is None or resources2 is None or bool(set(resources1) & set(resources2))
+
+
+def _execute_teardown_plan(target_workshops, run_id=None, max_workers=TEARDOWN_MAX_WORKERS):
+    """
+    Tear down the target workshops and their prereqs. Each workshop is torn down once, after all the workshops that
+    depend on it, and teardowns that don't share resources (see AbstractWorkshop.teardown_resources) are executed
+    concurrently.
+    """
+    global _LAST_TEARDOWN_STATS
+    nodes = _get_teardown_nodes(target_workshops)
+    dependents = {workshop: set() for workshop in nodes}
+    for workshop, prereqs in nodes.items():
+        for prereq in prereqs:
+            dependents[prereq].add(workshop)
+    resources = {workshop: WORKSHOPS[workshop].teardown_resources() for workshop in nodes}
+    parent_span = tracing.TRACER.current_span()
+
+    def _teardown(workshop):
+        with tracing.TRACER.activate(parent_span):
+            LOG.info('Executing teardown for Workshop {}'.format(workshop))
+            start_time = time.time()
+            WORKSHOPS[workshop](run_id).execute_teardown(include_prereqs=False)
+            return time.time() - start_time
+
+    def _on_error(workshop, _):
+        LOG.info('Teardown of Workshop {} FAILED!'.format(workshop))
+
+    # A workshop is torn down after all the workshops that depend on it
+    tasks = OrderedDict((workshop, (dependents[workshop], lambda w=workshop: _teardown(w))) for workshop in nodes)
+    start = time.time()
+    durations = import_module('.utils.aio', package=__package__).run_graph(
+        tasks, max_workers=max_workers, on_error=_on_error, thread_name_prefix='teardown',
+        can_start=lambda workshop, running: not any(_resources_conflict(resources[workshop], resources[w])
+                                                    for w in running))
+
+    wall_secs = time.time() - start
+    serial_secs = sum(durations[w] for w in _get_serial_teardown_order(target_workshops))
+    _LAST_TEARDOWN_STATS = {
+        'workshops': [{'workshop': w, 'secs': round(secs, 3)} for w, secs in durations.items()],
+        'wall_secs': round(wall_secs, 3),
+        'serial_secs': round(serial_secs, 3),
+        'saved_secs': round(serial_secs - wall_secs, 3),
+    }
+    LOG.info('Teardown of {} workshop(s) took {:.1f} secs. The serial teardown, with repeated prereq teardowns, would '
+             'have taken about {:.1f} secs.'.format(len(durations), wall_secs, serial_secs))
+
+
+def _get_last_teardown_stats():
+    return _LAST_TEARDOWN_STATS
+
+
+tracing.register_report_section('teardown_plan', _get_last_teardown_stats)
+
+
+def _get_workshop_prereq_targets(workshop_id):
+    """Return the prereq targets of the workshop, without importing its module when the metadata has them."""
+    _load_workshops()
+    prereqs = _WORKSHOP_METADATA.get(workshop_id, {}).get('prereqs')
+    if prereqs is None:
+        return WORKSHOPS[workshop_id].get_prereq_targets()
+    return [_get_prereq_target(prereq) for prereq in prereqs]
+
+
+def _get_setup_plan(target_workshop, target_lab, plan=None):
+    """Return an OrderedDict with the workshops required by the target workshop, in setup order, and their target labs."""
+    if plan is None:
+        plan = OrderedDict()
+    for workshop, lab in _get_workshop_prereq_targets(target_workshop):
+        _get_setup_plan(workshop, lab, plan)
+    plan[target_workshop] = max(plan.get(target_workshop, 0), target_lab)
+    return plan
+
+
+@_with_run_report('reset')
+def workshop_reset(target_workshop='base', target_lab=99, run_id=None):
+    """
+    Bring the environment to the state of the target workshop/lab. Labs already completed in a previous execution
+    with the same run_id are not executed again: workshops set up up to an earlier lab only execute the missing
+    labs, unless these rely on the context built by the completed ones (see AbstractWorkshop.get_setup_status).
+    Workshops that were set up beyond the target lab, or whose labs changed since, are torn down and set up again.
+    Teardowns work at the workshop level, so a rollback replays all the labs of the affected workshops.
+    The state is trusted as recorded: changes made to the environment by other means are not detected.
+    """
+    _load_workshops()
+    if target_workshop not in WORKSHOPS:
+        raise RuntimeError("Workshop [{}] not found. Known workshops are: {}".format(target_workshop, WORKSHOPS))
+    run_id = run_id if run_id is not None else get_run_id()
+    plan = _get_setup_plan(target_workshop, target_lab)
+    recorded = [w for w, labs in _load_state().get(str(run_id), {}).items() if labs]
+
+    if any(w not in plan for w in recorded):
+        # Teardowns of workshops outside of the target chain can clobber resources shared with the chain
+        LOG.info('Found workshops set up outside of the target chain ({}). Executing a full reset.'.format(
+            ', '.join(w for w in recorded if w not in plan)))
+        for workshop in [w for w in recorded if w not in plan] + list(reversed(plan)):
+            LOG.info('Executing teardown for Workshop {}'.format(workshop))
+            WORKSHOPS[workshop](run_id).execute_teardown(include_prereqs=False)
+    else:
+        statuses = {w: WORKSHOPS[w](run_id).get_setup_status(plan[w]) for w in plan}
+        stale = set(w for w in plan if statuses[w] == SETUP_STALE)
+        while True:
+            expanded = set(stale)
+            for workshop in plan:
+                prereqs = [p for p, _ in _get_workshop_prereq_targets(workshop)]
+                if workshop in stale and WORKSHOPS[workshop].requires_prereq_context():
+                    expanded.update(prereqs)
+                if any(p in stale for p in prereqs):
+                    expanded.add(workshop)
+            if expanded == stale:
+                break
+            stale = expanded
+        for workshop in reversed(plan):
+            if workshop in stale:
+                LOG.info('Rolling back Workshop {}'.format(workshop))
+                WORKSHOPS[workshop](run_id).execute_teardown(include_prereqs=False)
+            elif statuses[workshop] == SETUP_RESUMABLE:
+                LOG.info('Workshop {} is missing labs. Resuming its setup.'.format(workshop))
+            else:
+                LOG.info('Workshop {} is up to date. Keeping it.'.format(workshop))
+
+    LOG.info('Executing setup for Lab {} in Workshop {}'.format(target_lab, target_workshop))
+    WORKSHOPS[target_workshop](run_id).execute_setup(target_lab)
+    LOG.info('Global reset completed successfully!')
+
+
 @contextmanager
 def exception_context(obj):
     try:
@@ -304,20 +939,19 @@ def exception_context(obj):
 def retry_test(max_retries=0, wait_time_secs=0):
     def wrap(f):
         def wrapped_f(*args, **kwargs):
-            retries = 0
-            while True:
-                try:
-                    f(*args, **kwargs)
-                    break
-                except Exception:
-                    if retries >= max_retries:
-                        raise
-                    else:
-                        retries += 1
-                        time.sleep(wait_time_secs)
-                        print('{} - {} - Retry #{}'.format(datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S'),
-                                                           f.__name__,
-                                                           retries))
+            def _attempt():
+                f(*args, **kwargs)
+                return True
+
+            def _on_retry(attempt, _):
+                print('{} - {} - Retry #{}'.format(datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S'),
+                                                   f.__name__,
+                                                   attempt))
+
+            # max_retries retries after fixed waits, however long each attempt takes
+            polling.poll(_attempt, max_attempts=max_retries + 1, initial_interval_secs=wait_time_secs,
+                         max_interval_secs=wait_time_secs, backoff_factor=1.0, jitter=0.0,
+                         retry_on=Exception, on_retry=_on_retry, name='retry_test:' + f.__name__)
 
         return wrapped_f
 
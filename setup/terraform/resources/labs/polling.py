@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Polling engine used to wait for services and asynchronous operations.
+
+poll() calls a condition until it returns a truthy value. The first checks are made at short intervals, which
+then grow exponentially (with jitter) up to a maximum, so that waits end soon after the condition is met without
+hammering the services during long waits. Waits can have a deadline, a maximum number of attempts and can be
+cancelled with a threading.Event. The time spent waiting is recorded per call site and added to the run reports.
+"""
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import tracing
+
+DEFAULT_INITIAL_INTERVAL_SECS = 0.5
+DEFAULT_MAX_INTERVAL_SECS = 10
+DEFAULT_BACKOFF_FACTOR = 2.0
+DEFAULT_JITTER = 0.1
+
+_STATS = {}  # call site -> stats dict
+_STATS_LOCK = threading.Lock()
+
+
+class PollTimeout(RuntimeError):
+    pass
+
+
+class PollCancelled(RuntimeError):
+    pass
+
+
+def _get_call_site(depth):
+    frame = sys._getframe(depth + 1)
+    return '{}:{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name)
+
+
+def _record(name, attempts, waited_secs, elapsed_secs, outcome):
+    with _STATS_LOCK:
+        stats = _STATS.setdefault(name, {'calls': 0, 'attempts': 0, 'wait_secs': 0.0, 'elapsed_secs': 0.0,
+                                         'max_elapsed_secs': 0.0, 'timeouts': 0, 'cancellations': 0, 'errors': 0})
+        stats['calls'] += 1
+        stats['attempts'] += attempts
+        stats['wait_secs'] += waited_secs
+        stats['elapsed_secs'] += elapsed_secs
+        stats['max_elapsed_secs'] = max(stats['max_elapsed_secs'], elapsed_secs)
+        if outcome == 'timeout':
+            stats['timeouts'] += 1
+        elif outcome == 'cancelled':
+            stats['cancellations'] += 1
+        elif outcome == 'error':
+            stats['errors'] += 1
+
+
+def get_stats():
+    """Return the polling statistics per call site."""
+    with _STATS_LOCK:
+        return {name: {k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()}
+                for name, stats in sorted(_STATS.items())}
+
+
+def reset_stats():
+    with _STATS_LOCK:
+        _STATS.clear()
+
+
+def intervals(initial_interval_secs=DEFAULT_INITIAL_INTERVAL_SECS, max_interval_secs=DEFAULT_MAX_INTERVAL_SECS,
+              backoff_factor=DEFAULT_BACKOFF_FACTOR, jitter=DEFAULT_JITTER):
+    """Generate the sleep intervals between attempts: exponential backoff with a relative jitter."""
+    interval = initial_interval_secs
+    while True:
+        yield max(0.0, min(interval, max_interval_secs) * (1 + random.uniform(-jitter, jitter)))
+        interval *= backoff_factor
+
+
+def poll(condition, timeout_secs=None, max_attempts=None, initial_interval_secs=DEFAULT_INITIAL_INTERVAL_SECS,
+         max_interval_secs=DEFAULT_MAX_INTERVAL_SECS, backoff_factor=DEFAULT_BACKOFF_FACTOR, jitter=DEFAULT_JITTER,
+         retry_on=(), raise_on_timeout=True, cancel_event=None, on_retry=None, name=None):
+    """
+    Call condition() until it returns a truthy value, and return that value.
+    :param timeout_secs: deadline for the wait. None means no deadline.
+    :param max_attempts: maximum number of calls to condition(). None means no limit.
+    :param retry_on: exception types raised by condition() that are treated as a falsy result.
+    :param raise_on_timeout: if True, raise PollTimeout (or the last exception of a retry_on type) when the
+                             deadline or the maximum number of attempts is reached. Otherwise return the last result.
+    :param cancel_event: threading.Event that, when set, interrupts the wait with PollCancelled.
+    :param on_retry: function called with the attempt number and the result (or exception) of a failed attempt,
+                     before waiting for the next one.
+    :param name: name of the call site for the statistics. Defaults to the calling module and function.
+    """
+    name = name or _get_call_site(1)
+    start = time.time()
+    deadline = start + timeout_secs if timeout_secs is not None else None
+    attempts = 0
+    waited_secs = 0.0
+    result = None
+    error = None
+    outcome = 'error'
+    try:
+        for interval in intervals(initial_interval_secs, max_interval_secs, backoff_factor, jitter):
+            if cancel_event is not None and cancel_event.is_set():
+                outcome = 'cancelled'
+                raise PollCancelled('Wait for {} was cancelled.'.format(name))
+            attempts += 1
+            try:
+                result = condition()
+                error = None
+            except retry_on as exc:
+                result = None
+                error = exc
+            if result:
+                outcome = 'ok'
+                return result
+            if max_attempts is not None and attempts >= max_attempts:
+                break
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                interval = min(interval, remaining)
+            if on_retry is not None:
+                on_retry(attempts, error if error is not None else result)
+            sleep_start = time.time()
+            if cancel_event is not None:
+                cancel_event.wait(interval)
+            else:
+                time.sleep(interval)
+            waited_secs += time.time() - sleep_start
+        outcome = 'timeout'
+        if raise_on_timeout:
+            if error is not None:
+                raise error
+            raise PollTimeout('Timed out waiting for {} after {} attempt(s) and {:.1f} secs.'.format(
+                name, attempts, time.time() - start))
+        return result
+    finally:
+        _record(name, attempts, waited_secs, time.time() - start, outcome)
+
+
+def poll_all(conditions, max_workers=None, **kwargs):
+    """
+    Wait for many conditions in parallel. conditions is a dict of name -> condition function and the return value
+    is a dict of name -> result. The remaining arguments are passed to poll() for each condition.
+    When a wait fails, the other waits are cancelled and the exception is raised.
+    """
+    if not conditions:
+        return {}
+    cancel_event = kwargs.pop('cancel_event', None) or threading.Event()
+    site = kwargs.pop('name', None) or _get_call_site(1)
+    parent_span = tracing.TRACER.current_span()
+
+    def _poll(item):
+        cond_name, condition = item
+        with tracing.TRACER.activate(parent_span):
+            return poll(condition, cancel_event=cancel_event, name='{}[{}]'.format(site, cond_name), **kwargs)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(conditions), thread_name_prefix='poll') as executor:
+        futures = {cond_name: executor.submit(_poll, (cond_name, condition))
+                   for cond_name, condition in conditions.items()}
+        results = {}
+        try:
+            for cond_name, future in futures.items():
+                results[cond_name] = future.result()
+        except BaseException:
+            cancel_event.set()
+            raise
+    return results
+
+
+tracing.register_report_section('polling', get_stats)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registry of pooled, keep-alive HTTP sessions, one per service and host.
+
+Sessions are created on first use with the service's auth object and TLS verification settings, a connection pool
+adapter and transport-level retries (with exponential backoff) for idempotent methods. Reusing the same session keeps
+the TCP/TLS connections alive and, for SPNEGO, lets the auth cookie returned by the server be reused.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import tracing
+
+POOL_CONNECTIONS_ENV_VAR = 'WORKSHOP_HTTP_POOL_CONNECTIONS'
+POOL_MAXSIZE_ENV_VAR = 'WORKSHOP_HTTP_POOL_MAXSIZE'
+RETRIES_ENV_VAR = 'WORKSHOP_HTTP_RETRIES'
+BACKOFF_FACTOR_ENV_VAR = 'WORKSHOP_HTTP_BACKOFF_FACTOR'
+
+RETRY_STATUS_CODES = [502, 503, 504]
+
+_SESSIONS = {}  # (service, host) -> requests.Session
+_SESSIONS_LOCK = threading.Lock()
+_CONFIG = {
+    'pool_connections': int(os.environ.get(POOL_CONNECTIONS_ENV_VAR, '4')),
+    'pool_maxsize': int(os.environ.get(POOL_MAXSIZE_ENV_VAR, '10')),
+    'retries': int(os.environ.get(RETRIES_ENV_VAR, '3')),
+    'backoff_factor': float(os.environ.get(BACKOFF_FACTOR_ENV_VAR, '0.5')),
+}
+
+
+def configure(pool_connections=None, pool_maxsize=None, retries=None, backoff_factor=None):
+    """Change the settings used for sessions created from now on."""
+    for key, value in [('pool_connections', pool_connections), ('pool_maxsize', pool_maxsize),
+                       ('retries', retries), ('backoff_factor', backoff_factor)]:
+        if value is not None:
+            _CONFIG[key] = value
+
+
+def _new_adapter():
+    # Retry's default allowed methods are the idempotent ones (GET, HEAD, PUT, DELETE, OPTIONS, TRACE)
+    retry = Retry(total=_CONFIG['retries'], connect=_CONFIG['retries'], read=_CONFIG['retries'],
+                  status=_CONFIG['retries'], backoff_factor=_CONFIG['backoff_factor'],
+                  status_forcelist=RETRY_STATUS_CODES, raise_on_status=False)
+    return HTTPAdapter(pool_connections=_CONFIG['pool_connections'], pool_maxsize=_CONFIG['pool_maxsize'],
+                       max_retries=retry)
+
+
+def get_session(service, host, auth_factory=None, verify=None):
+    """
+    Return the session for the given service and host, creating it if needed.
+    auth_factory is only called when the session is created, so the auth object is shared by all the calls.
+    verify is set on the session if not None.
+    """
+    key = (service, host)
+    with _SESSIONS_LOCK:
+        if key not in _SESSIONS:
+            session = requests.Session()
+            for prefix in ['http://', 'https://']:
+                session.mount(prefix, _new_adapter())
+            if auth_factory:
+                session.auth = auth_factory()
+            if verify is not None:
+                session.verify = verify
+            _SESSIONS[key] = tracing.trace_session(session, service)
+        return _SESSIONS[key]
+
+
+def close_sessions(service=None):
+    """Close and forget the sessions of the given service, or all of them."""
+    with _SESSIONS_LOCK:
+        for key in [k for k in _SESSIONS if service is None or k[0] == service]:
+            _SESSIONS.pop(key).close()
+
+
+def _pools(session):
+    for adapter in session.adapters.values():
+        pools = adapter.poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is not None:
+                yield pool
+
+
+def get_connection_stats():
+    """Return, per service, the number of requests sent and connections opened by the registry sessions."""
+    stats = {}
+    with _SESSIONS_LOCK:
+        for (service, _), session in _SESSIONS.items():
+            service_stats = stats.setdefault(service, {'sessions': 0, 'requests': 0, 'connections': 0})
+            service_stats['sessions'] += 1
+            for pool in _pools(session):
+                service_stats['requests'] += pool.num_requests
+                service_stats['connections'] += pool.num_connections
+    for service_stats in stats.values():
+        requests_count = service_stats['requests']
+        service_stats['reused_connections_ratio'] = round(
+            1 - float(service_stats['connections']) / requests_count, 3) if requests_count else None
+    return stats
+
+
+tracing.register_report_section('connections', get_connection_stats)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Timing and HTTP call instrumentation for workshop setups and teardowns.
+
+Lab executions are recorded as nested spans. HTTP calls are attributed to the innermost active span and aggregated
+per service and endpoint. At the end of a run a JSON report and a flame graph compatible trace (collapsed stacks,
+with values in milliseconds) are written to the reports directory.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+REPORT_DIR_ENV_VAR = 'WORKSHOP_REPORT_DIR'
+DEFAULT_REPORT_DIR_NAME = 'run-reports'
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Swagger-generated REST clients used by nipyapi and cm_client, and the service names they are reported under
+_REST_CLIENTS = [
+    ('nipyapi.nifi.rest', 'nifi'),
+    ('nipyapi.registry.rest', 'nifireg'),
+    ('cm_client.rest', 'cm'),
+]
+
+_REPORT_SECTIONS = {}
+
+_ID_SEGMENT_REGEX = re.compile(r'^([0-9]+|[0-9a-fA-F-]{16,}|[0-9a-fA-F]{8}-[0-9a-fA-F-]+)$')
+
+
+def _normalize_path(path):
+    return '/'.join('{id}' if _ID_SEGMENT_REGEX.match(segment) else segment for segment in path.split('/'))
+
+
+def _bucket_label(elapsed_ms):
+    for bound in LATENCY_BUCKETS_MS:
+        if elapsed_ms <= bound:
+            return '<={}'.format(bound)
+    return '>{}'.format(LATENCY_BUCKETS_MS[-1])
+
+
+class _Stats(object):
+    def __init__(self):
+        self.count = 0
+        self.secs = 0.0
+        self.max_secs = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.errors = 0
+        self.histogram = {}
+
+    def add(self, elapsed, bytes_sent, bytes_received, error):
+        self.count += 1
+        self.secs += elapsed
+        self.max_secs = max(self.max_secs, elapsed)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.errors += 1 if error else 0
+        label = _bucket_label(elapsed * 1000)
+        self.histogram[label] = self.histogram.get(label, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.secs += other.secs
+        self.max_secs = max(self.max_secs, other.max_secs)
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.errors += other.errors
+        for label, count in other.histogram.items():
+            self.histogram[label] = self.histogram.get(label, 0) + count
+
+    def to_dict(self, with_histogram=False):
+        stats = {
+            'requests': self.count,
+            'secs': round(self.secs, 6),
+            'max_secs': round(self.max_secs, 6),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'errors': self.errors,
+        }
+        if with_histogram:
+            stats['latency_histogram_ms'] = {label: self.histogram[label] for label in
+                                             ['<={}'.format(b) for b in LATENCY_BUCKETS_MS] +
+                                             ['>{}'.format(LATENCY_BUCKETS_MS[-1])] if label in self.histogram}
+        return stats
+
+
+class Span(object):
+    def __init__(self, kind, name, parent=None):
+        self.kind = kind
+        self.name = name
+        self.parent = parent
+        self.start = time.time()
+        self.end = None
+        self.children = []
+        self.calls = {}  # (service, endpoint) -> _Stats
+
+    @property
+    def secs(self):
+        return (self.end or time.time()) - self.start
+
+    def total_calls(self):
+        stats = _Stats()
+        for call_stats in self.calls.values():
+            stats.merge(call_stats)
+        for child in self.children:
+            stats.merge(child.total_calls())
+        return stats
+
+    def to_dict(self):
+        span = {
+            'kind': self.kind,
+            'name': self.name,
+            'start': self.start,
+            'secs': round(self.secs, 6),
+        }
+        span['http'] = self.total_calls().to_dict()
+        if self.calls:
+            span['calls'] = [dict(service=service, endpoint=endpoint, **stats.to_dict())
+                             for (service, endpoint), stats in sorted(self.calls.items())]
+        if self.children:
+            span['children'] = [child.to_dict() for child in self.children]
+        return span
+
+    def collapsed_stacks(self, prefix=''):
+        """Yield (stack, milliseconds) tuples with the exclusive time of this span and its HTTP calls."""
+        stack = '{}{}'.format(prefix, self.name.replace(';', ':'))
+        children_secs = sum(child.secs for child in self.children)
+        calls_secs = 0.0
+        for (service, endpoint), stats in sorted(self.calls.items()):
+            calls_secs += stats.secs
+            yield '{};{};{}'.format(stack, service, endpoint), stats.secs * 1000
+        # Children and calls may overlap when executed concurrently
+        yield stack, max(0.0, self.secs - children_secs - calls_secs) * 1000
+        for child in self.children:
+            for item in child.collapsed_stacks(stack + ';'):
+                yield item
+
+
+class Tracer(object):
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self, action='run'):
+        with self._lock:
+            self.root = Span('run', action)
+            self.endpoints = {}  # (service, endpoint) -> _Stats
+
+    def current_span(self):
+        return getattr(self._local, 'span', None) or self.root
+
+    @contextmanager
+    def activate(self, span):
+        """Make the given span the parent of the spans and calls in the current thread (e.g. a worker thread)."""
+        previous = getattr(self._local, 'span', None)
+        self._local.span = span
+        try:
+            yield span
+        finally:
+            self._local.span = previous
+
+    @contextmanager
+    def span(self, kind, name):
+        parent = self.current_span()
+        span = Span(kind, name, parent)
+        with self._lock:
+            parent.children.append(span)
+        with self.activate(span):
+            try:
+                yield span
+            finally:
+                span.end = time.time()
+
+    def open_spans(self):
+        """Return the most recently started chain of spans that are still open, from any thread, below the root."""
+        spans = []
+        with self._lock:
+            span = self.root
+            while True:
+                open_children = [child for child in span.children if child.end is None]
+                if not open_children:
+                    return spans
+                span = open_children[-1]
+                spans.append(span)
+
+    def record_request(self, service, method, url, elapsed, status=None, bytes_sent=0, bytes_received=0):
+        parsed = urlparse(url)
+        service = service or parsed.netloc
+        endpoint = '{} {}'.format(method.upper(), _normalize_path(parsed.path))
+        error = status is None or not isinstance(status, int) or status >= 400
+        key = (service, endpoint)
+        with self._lock:
+            for stats_map in [self.endpoints, self.current_span().calls]:
+                if key not in stats_map:
+                    stats_map[key] = _Stats()
+                stats_map[key].add(elapsed, bytes_sent, bytes_received, error)
+
+    def report(self):
+        with self._lock:
+            self.root.end = time.time()
+            services = {}
+            for (service, _), stats in self.endpoints.items():
+                services.setdefault(service, _Stats()).merge(stats)
+            report = {
+                'action': self.root.name,
+                'started': datetime.fromtimestamp(self.root.start).isoformat(),
+                'wall_secs': round(self.root.secs, 6),
+                'spans': self.root.to_dict(),
+                'services': {service: stats.to_dict() for service, stats in sorted(services.items())},
+                'endpoints': [dict(service=service, endpoint=endpoint, **stats.to_dict(with_histogram=True))
+                              for (service, endpoint), stats in sorted(self.endpoints.items())],
+            }
+        for name, func in _REPORT_SECTIONS.items():
+            report[name] = func()
+        return report
+
+    def write_report(self, report_dir=None, file_prefix=None):
+        """Write the JSON report and the collapsed stacks trace. Return the path of the JSON report."""
+        report_dir = report_dir or get_report_dir()
+        os.makedirs(report_dir, exist_ok=True)
+        file_prefix = file_prefix or '{}-{}'.format(self.root.name, datetime.now().strftime('%Y%m%d%H%M%S'))
+        report = self.report()
+        json_path = os.path.join(report_dir, file_prefix + '.json')
+        with open(json_path, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+        with open(os.path.join(report_dir, file_prefix + '.folded'), 'w') as folded_file:
+            for stack, millis in self.root.collapsed_stacks():
+                if int(round(millis)) > 0:
+                    folded_file.write('{} {}\n'.format(stack, int(round(millis))))
+        return json_path
+
+
+TRACER = Tracer()
+
+
+def register_report_section(name, func):
+    """Add a section to the run reports, with the value returned by func() when the report is generated."""
+    _REPORT_SECTIONS[name] = func
+
+
+def get_report_dir():
+    if REPORT_DIR_ENV_VAR in os.environ:
+        return os.environ[REPORT_DIR_ENV_VAR]
+    return os.path.realpath(os.path.join(os.path.dirname(__file__), '..', DEFAULT_REPORT_DIR_NAME))
+
+
+def trace_response(resp, *args, **kwargs):
+    """Response hook for requests, to be registered in the "hooks" argument or in Session.hooks."""
+    service = getattr(resp, '_service_name', None)
+    body = resp.request.body if resp.request is not None else None
+    received = 0 if kwargs.get('stream') else len(resp.content or b'')
+    TRACER.record_request(service, resp.request.method, resp.url, resp.elapsed.total_seconds(), resp.status_code,
+                          len(body) if body else 0, received)
+    return resp
+
+
+def trace_session(session, service_name):
+    """Register the tracing hook in a requests Session and tag its calls with the given service name."""
+    def _hook(resp, *args, **kwargs):
+        resp._service_name = service_name
+        return trace_response(resp, *args, **kwargs)
+
+    session.service_name = service_name
+    session.hooks['response'].append(_hook)
+    return session
+
+
+def _trace_rest_client(module_name, service_name):
+    rest = sys.modules.get(module_name)
+    if rest is None:
+        return
+    orig_request = rest.RESTClientObject.request
+    if getattr(orig_request, '_traced', False):
+        return
+
+    def request(self, method, url, *args, **kwargs):
+        start = time.time()
+        status = None
+        received = 0
+        try:
+            resp = orig_request(self, method, url, *args, **kwargs)
+            status = resp.status
+            if isinstance(getattr(resp, 'data', None), (bytes, str)):
+                received = len(resp.data)
+            return resp
+        except Exception as exc:
+            status = getattr(exc, 'status', None)
+            raise
+        finally:
+            TRACER.record_request(service_name, method, url, time.time() - start, status, 0, received)
+
+    request._traced = True
+    rest.RESTClientObject.request = request
+
+
+def instrument_clients():
+    """
+    Instrument the REST clients of nipyapi and cm_client that are already imported; clients are never imported just
+    to be instrumented. Safe to call multiple times, e.g. after importing the modules that use them.
+    """
+    for module_name, service_name in _REST_CLIENTS:
+        _trace_rest_client(module_name, service_name)
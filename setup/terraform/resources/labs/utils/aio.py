@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio variants of the labs.utils service clients.
+
+aio.<module>.<function> is a coroutine function with the same signature as labs.utils.<module>.<function>. Calls
+are executed in a shared thread pool, on top of the pooled sessions of labs.sessions, and each service has a cap on
+the number of concurrent calls. Services whose clients keep login/CSRF state in a single session are capped at 1.
+
+Example (from synchronous code, e.g. a teardown):
+    aio.run_all(aio.schreg.delete_all_schemas(), aio.kudu.drop_table())
+
+run_graph() executes synchronous functions with dependencies between them in a thread pool, each one as soon as
+the ones it requires are completed (e.g. setup steps, teardowns or provisioning operations).
+"""
+import asyncio
+import functools
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from importlib import import_module
+
+from . import *
+
+MAX_WORKERS = 16
+DEFAULT_CONCURRENCY = 4
+SERVICE_CONCURRENCY = {
+    'dataviz': 1,
+    'efm': 1,
+    'ssb': 1,
+    'kudu': 2,
+    'nifi': 2,
+}
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+_SEMAPHORES = weakref.WeakKeyDictionary()  # event loop -> {service: asyncio.Semaphore}
+
+
+def _get_executor():
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='labs-aio')
+        return _EXECUTOR
+
+
+def _get_semaphore(service):
+    semaphores = _SEMAPHORES.setdefault(asyncio.get_running_loop(), {})
+    if service not in semaphores:
+        semaphores[service] = asyncio.Semaphore(SERVICE_CONCURRENCY.get(service, DEFAULT_CONCURRENCY))
+    return semaphores[service]
+
+
+async def call(service, func, *args, **kwargs):
+    """Execute the synchronous func in the thread pool, within the concurrency cap of the service."""
+    span = tracing.TRACER.current_span()
+
+    def _traced_call():
+        with tracing.TRACER.activate(span):
+            return func(*args, **kwargs)
+
+    async with _get_semaphore(service):
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), _traced_call)
+
+
+async def sequence(*coros):
+    """
+    Await the coroutines one after the other. Useful to gather chains of dependent operations. If one fails, the
+    following ones are not executed.
+    """
+    results = []
+    try:
+        for coro in coros:
+            results.append(await coro)
+    finally:
+        for coro in coros[len(results) + 1:]:
+            coro.close()
+    return results
+
+
+def run_all(*coros, return_exceptions=False):
+    """
+    Run the coroutines concurrently from synchronous code and return their results, in order. All the coroutines are
+    run to completion, even when some of them fail, so that no call is left running in the thread pool; the first
+    error (in the order of the coroutines) is then raised, unless return_exceptions is True.
+    This runs its own event loop: it cannot be called from a coroutine or any thread with a running event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        for coro in coros:
+            coro.close()
+        raise RuntimeError('aio.run_all() cannot be called from a running event loop; await the coroutines instead.')
+
+    async def _gather():
+        return await asyncio.gather(*coros, return_exceptions=True)
+
+    results = asyncio.run(_gather())
+    if not return_exceptions:
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+    return results
+
+
+def run_graph(tasks, max_workers=DEFAULT_CONCURRENCY, can_start=None, on_done=None, on_error=None,
+              thread_name_prefix='labs-graph'):
+    """
+    Execute the tasks of a dependency graph in a thread pool, each one as soon as the tasks it requires are completed.
+    Once a task fails, no more tasks are started; the running ones are waited for and the first error is raised.
+    Return an OrderedDict of task key -> result of its function, in completion order.
+    :param tasks: OrderedDict of task key -> (keys of the required tasks, function). Required keys that are not
+                  tasks are satisfied.
+    :param can_start: function called with the key of a ready task and the keys of the running tasks. If it returns
+                      False, the task is started later.
+    :param on_done: function called with the key and the result of each completed task.
+    :param on_error: function called with the key and the exception of each failed task.
+    """
+    pending = list(tasks)
+    running = {}  # future -> task key
+    results = OrderedDict()
+    error = None
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix) as executor:
+        while pending or running:
+            for key in list(pending if error is None else []):
+                if any(req in tasks and req not in results for req in tasks[key][0]):
+                    continue
+                if can_start is not None and not can_start(key, list(running.values())):
+                    continue
+                pending.remove(key)
+                running[executor.submit(tasks[key][1])] = key
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key = running.pop(future)
+                try:
+                    results[key] = future.result()
+                except Exception as exc:
+                    if on_error is not None:
+                        on_error(key, exc)
+                    error = error or exc
+                    continue
+                if on_done is not None:
+                    on_done(key, results[key])
+    if error is not None:
+        raise error
+    if pending:
+        raise RuntimeError('Tasks with unsatisfied requirements (circular dependencies): {}'.format(
+            ', '.join(' '.join(k) if isinstance(k, tuple) else str(k) for k in pending)))
+    return results
+
+
+class _AsyncModule(object):
+    """
+    Async variant of a labs.utils module. The module is only imported on the first access to one of its functions,
+    so that importing aio doesn't pull in the dependencies of all the service clients.
+    """
+    def __init__(self, module_name, service):
+        self._module_name = module_name
+        self._service = service
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        func = getattr(import_module('.' + self._module_name, package=__package__), name)
+        # the module may have imported REST clients (e.g. nipyapi)
+        tracing.instrument_clients()
+        if name.startswith('_') or not callable(func) or isinstance(func, type):
+            return func
+
+        @functools.wraps(func)
+        async def _async_func(*args, **kwargs):
+            return await call(self._service, func, *args, **kwargs)
+
+        setattr(self, name, _async_func)
+        return _async_func
+
+
+cdsw = _AsyncModule('cdsw', 'cdsw')
+cm = _AsyncModule('cm', 'cm')
+dataviz = _AsyncModule('dataviz', 'dataviz')
+efm = _AsyncModule('efm', 'efm')
+kudu = _AsyncModule('kudu', 'kudu')
+nifi = _AsyncModule('nifi', 'nifi')
+nifireg = _AsyncModule('nifireg', 'nifireg')
+postgres = _AsyncModule('postgres', 'postgres')
+schreg = _AsyncModule('schreg', 'schreg')
+smm = _AsyncModule('smm', 'smm')
+ssb = _AsyncModule('ssb', 'ssb')
+ssb_savepoints = _AsyncModule('ssb_savepoints', 'ssb')
@@ -36,9 +36,7 @@ def is_cdsw_installed():
 def get_session():
     global _CDSW_SESSION
     if not _CDSW_SESSION:
-        _CDSW_SESSION = requests.Session()
-        if is_tls_enabled():
-            _CDSW_SESSION.verify = get_truststore_path()
+        _CDSW_SESSION = get_service_session('cdsw')
         r = _CDSW_SESSION.post(_get_api_url() + '/authenticate',
                                json={'login': _CDSW_USERNAME, 'password': get_the_pwd()}, )
         _CDSW_SESSION.headers.update({'Authorization': 'Bearer ' + r.json()['auth_token']})
@@ -160,7 +158,7 @@ def create_model_api_key(return_object=False):
 
 
 def get_model_access_key():
-    while True:
+    def _get_access_key():
         model = get_model()
         if not model:
             status = 'not created yet'
@@ -174,7 +172,10 @@ def get_model_access_key():
         else:
             status = model['latestModelDeployment']['status']
         LOG.info('Model not deployed yet. Model status is currently "%s". Waiting for deployment to finish.', status)
-        time.sleep(10)
+        return None
+
+    return polling.poll(_get_access_key, initial_interval_secs=2, max_interval_secs=15,
+                        name='cdsw.get_model_access_key')
 
 
 def get_applications(project_name=None, project_id=None):
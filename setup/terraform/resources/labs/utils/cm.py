@@ -1,19 +1,88 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import threading
 from datetime import datetime, timedelta
 
 import requests
 
 from . import *
 
-_API_VERSION = None
-_CLUSTER_NAME = None
+DISCOVERY_CACHE_TTL_SECS = 300
+COMMAND_TIMEOUT_SECS = 300
+
+_DISCOVERY_CACHE = {}  # key -> (expiration time or None, value)
+_DISCOVERY_CACHE_LOCK = threading.RLock()  # held only to read or change the cache, never during a CM call
+_DISCOVERY_LOAD_LOCKS = {}  # key -> lock held while loading the key, so that each key is loaded only once at a time
+_DISCOVERY_CACHE_EPOCH = 0  # incremented by each invalidation, to discard the loads that started before it
+_DISCOVERY_CACHE_STATS = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_COMMAND_HISTORY = []  # reports of the commands tracked by CommandTracker instances
+_COMMAND_HISTORY_LOCK = threading.Lock()
+
+
+def _get_cached(key):
+    """Return True and the cached value for the key, counting a hit, or False and None if missing or expired."""
+    with _DISCOVERY_CACHE_LOCK:
+        if key in _DISCOVERY_CACHE:
+            expiration, value = _DISCOVERY_CACHE[key]
+            if expiration is None or expiration > time.time():
+                _DISCOVERY_CACHE_STATS['hits'] += 1
+                return True, value
+        return False, None
+
+
+def _get_discovered(key, loader, ttl_secs=DISCOVERY_CACHE_TTL_SECS):
+    """
+    Return the cached value for the key, calling loader() to get it if missing or expired (ttl_secs=None: never).
+    Only the lookups of the same key wait for a load in progress.
+    """
+    found, value = _get_cached(key)
+    if found:
+        return value
+    with _DISCOVERY_CACHE_LOCK:
+        load_lock = _DISCOVERY_LOAD_LOCKS.setdefault(key, threading.RLock())
+    with load_lock:
+        found, value = _get_cached(key)
+        if found:
+            return value
+        with _DISCOVERY_CACHE_LOCK:
+            _DISCOVERY_CACHE_STATS['misses'] += 1
+            epoch = _DISCOVERY_CACHE_EPOCH
+        value = loader()
+        with _DISCOVERY_CACHE_LOCK:
+            if epoch == _DISCOVERY_CACHE_EPOCH:
+                _DISCOVERY_CACHE[key] = (time.time() + ttl_secs if ttl_secs is not None else None, value)
+        return value
+
+
+def invalidate_discovery_cache(*keys):
+    """Discard the given keys (e.g. 'services') of the CM discovery cache, or all of them if no keys are given."""
+    global _DISCOVERY_CACHE_EPOCH
+    with _DISCOVERY_CACHE_LOCK:
+        _DISCOVERY_CACHE_EPOCH += 1
+        for key in keys or list(_DISCOVERY_CACHE):
+            if _DISCOVERY_CACHE.pop(key, None) is not None:
+                _DISCOVERY_CACHE_STATS['invalidations'] += 1
+
+
+def get_discovery_cache_stats():
+    """Return the CM discovery cache statistics. Each hit is a CM API call saved."""
+    with _DISCOVERY_CACHE_LOCK:
+        stats = dict(_DISCOVERY_CACHE_STATS)
+        stats['cm_calls_saved'] = stats['hits']
+        return stats
+
+
+tracing.register_report_section('cm_discovery', get_discovery_cache_stats)
 
 
 def _default_cm_auth():
     return 'admin', get_the_pwd()
 
 
+def _get_session():
+    return get_service_session('cm', auth_factory=_default_cm_auth)
+
+
 def _get_cm_port():
     return 7183 if is_tls_enabled() else 7180
 
@@ -23,12 +92,8 @@ def _get_cm_api_version_url():
 
 
 def _get_cm_api_version(cm_auth=None):
-    global _API_VERSION
-    if not _API_VERSION:
-        if not cm_auth:
-            cm_auth = _default_cm_auth()
-        return api_request('GET', _get_cm_api_version_url(), auth=cm_auth).text
-    return _API_VERSION
+    return _get_discovered('api_version', lambda: api_request('GET', _get_cm_api_version_url(), auth=cm_auth,
+                                                              session=_get_session()).text, ttl_secs=None)
 
 
 def get_cm_api_url(public_ip=None, cm_auth=None):
@@ -38,32 +103,153 @@ def get_cm_api_url(public_ip=None, cm_auth=None):
 
 def _api_request(method, endpoint, expected_codes=None, **kwargs):
     url = get_cm_api_url() + endpoint
-    if 'auth' not in kwargs:
-        kwargs['auth'] = _default_cm_auth()
-    return api_request(method, url, expected_codes, **kwargs)
+    return api_request(method, url, expected_codes, session=_get_session(), **kwargs)
 
 
 def _get_cluster_name():
-    global _CLUSTER_NAME
-    if not _CLUSTER_NAME:
+    def _load():
         clusters = _api_request('GET', '/clusters').json()
         assert len(clusters['items']) == 1
-        _CLUSTER_NAME = clusters['items'][0]['name']
-    return _CLUSTER_NAME
+        return clusters['items'][0]['name']
+
+    return _get_discovered('cluster_name', _load, ttl_secs=None)
+
+
+class CommandTracker(object):
+    """
+    Wait for many CM commands at once. All the active commands are polled in a single loop with backoff, and the
+    duration and outcome of each command are recorded. Only the top-level commands are requested: the state of their
+    child commands is read from the children of the parent command.
+
+    Example:
+        tracker = CommandTracker()
+        for service_name in ['kafka', 'schemaregistry']:
+            tracker.track(restart_service(service_name, wait=False))
+        tracker.track(deploy_client_config(wait=False))
+        tracker.wait()
+    """
+
+    def __init__(self, timeout_secs=COMMAND_TIMEOUT_SECS, follow_children=True):
+        self.timeout_secs = timeout_secs
+        self.follow_children = follow_children
+        self._records = OrderedDict()  # command id -> record dict
+        self._lock = threading.Lock()
+
+    def track(self, cmd, label=None, parent_id=None):
+        """Start tracking the command (an ApiCommand dict) and return it. None is ignored."""
+        if cmd:
+            with self._lock:
+                if cmd['id'] not in self._records:
+                    self._new_record(cmd, label, parent_id)
+        return cmd
+
+    def _new_record(self, cmd, label, parent_id):
+        record = {'id': cmd['id'], 'label': label or cmd.get('name'), 'parent_id': parent_id, 'start': time.time(),
+                  'end': None, 'timed_out': False, 'command': cmd}
+        self._records[cmd['id']] = record
+        self._update(record, cmd)
+
+    def _update(self, record, cmd):
+        record['command'] = cmd
+        if not cmd.get('active') and record['end'] is None:
+            record['end'] = time.time()
+        if self.follow_children:
+            for child in cmd.get('children', {}).get('items', []):
+                if child['id'] not in self._records:
+                    self._new_record(child, None, cmd['id'])
+                else:
+                    self._update(self._records[child['id']], child)
+
+    def _active_records(self):
+        with self._lock:
+            return [r for r in self._records.values() if r['command'].get('active')]
+
+    def _refresh(self):
+        active = self._active_records()
+        active_ids = set(r['id'] for r in active)
+        # children are updated with their parent, unless the parent finished while they are still reported active
+        for record in [r for r in active if r['parent_id'] not in active_ids]:
+            cmd = get_command(record['id'])
+            with self._lock:
+                self._update(record, cmd)
+        return not self._active_records()
+
+    def get_command(self, cmd_id):
+        """Return the latest known state of a tracked command."""
+        return self._records[cmd_id]['command']
+
+    def wait(self, timeout_secs=None, raise_on_failure=False):
+        """
+        Wait until all the tracked commands are finished or the deadline passes, and return the command reports.
+        Commands still active at the deadline are reported as timed out. Failures are logged, or raised as a
+        RuntimeError if raise_on_failure is True.
+        """
+        timeout_secs = self.timeout_secs if timeout_secs is None else timeout_secs
+        if self._active_records():
+            polling.poll(self._refresh, timeout_secs=timeout_secs, initial_interval_secs=0.5, max_interval_secs=5,
+                         raise_on_timeout=False, name='cm.CommandTracker.wait')
+        for record in self._active_records():
+            record['timed_out'] = True
+        reports = self.report()
+        with _COMMAND_HISTORY_LOCK:
+            _COMMAND_HISTORY.extend(r for r in reports if r['status'] != 'running')
+        failures = [r for r in reports if r['status'] == 'failed' and r['parent_id'] is None]
+        for failure in failures:
+            LOG.warning('CM command %s (%s) failed: %s', failure['label'], failure['id'], failure['message'])
+        if raise_on_failure and failures:
+            raise RuntimeError('{} CM command(s) failed: {}'.format(
+                len(failures), ', '.join('{} ({})'.format(f['label'], f['message']) for f in failures)))
+        return reports
+
+    def report(self):
+        """Return a list of dicts with the id, label, parent id, status, duration and result of each command."""
+        reports = []
+        with self._lock:
+            for record in self._records.values():
+                cmd = record['command']
+                if cmd.get('active'):
+                    status = 'timed_out' if record['timed_out'] else 'running'
+                else:
+                    status = 'succeeded' if cmd.get('success') else 'failed'
+                reports.append({
+                    'id': record['id'],
+                    'label': record['label'],
+                    'parent_id': record['parent_id'],
+                    'status': status,
+                    'secs': round((record['end'] or time.time()) - record['start'], 3),
+                    'message': cmd.get('resultMessage'),
+                })
+        return reports
+
+
+def get_command_stats():
+    """Return the number of tracked CM commands per status, and the slowest commands."""
+    with _COMMAND_HISTORY_LOCK:
+        history = list(_COMMAND_HISTORY)
+    statuses = {}
+    for report in history:
+        statuses[report['status']] = statuses.get(report['status'], 0) + 1
+    return {
+        'commands': statuses,
+        'slowest': sorted(history, key=lambda r: r['secs'], reverse=True)[:10],
+    }
+
+
+tracing.register_report_section('cm_commands', get_command_stats)
 
 
-def _wait_for_command(cmds, timeout_secs=300):
+def _wait_for_command(cmds, timeout_secs=COMMAND_TIMEOUT_SECS):
     if not isinstance(cmds, list):
         cmds = [cmds]
-    cmd = None
-    for cmd in [c for c in cmds if c]:
-        while timeout_secs > 0:
-            if not cmd['active']:
-                break
-            timeout_secs -= 1
-            time.sleep(1)
-            cmd = get_command(cmd['id'])
-    return cmd
+    cmds = [c for c in cmds if c]
+    if not cmds:
+        return None
+    tracker = CommandTracker(timeout_secs=timeout_secs)
+    for cmd in cmds:
+        tracker.track(cmd)
+    if timeout_secs:
+        tracker.wait()
+    return tracker.get_command(cmds[-1]['id'])
 
 
 def _execute_service_cmd(service_name, cmd, wait=True, ok_not_found=True):
@@ -73,8 +259,9 @@ def _execute_service_cmd(service_name, cmd, wait=True, ok_not_found=True):
         if ok_not_found:
             return None
         raise RuntimeError("Service {} not found when trying to execute command {}.".format(service_name, cmd))
+    invalidate_discovery_cache('services')
     cmd = resp.json()
-    return _wait_for_command(cmd, timeout_secs=300 if wait else 0)
+    return _wait_for_command(cmd, timeout_secs=COMMAND_TIMEOUT_SECS if wait else 0)
 
 
 def _apilize_config(config):
@@ -88,7 +275,7 @@ def _apilize_config(config):
 
 
 def get_host_ref():
-    hosts = _api_request('GET', '/hosts'.format(_get_cluster_name())).json()
+    hosts = _get_discovered('hosts', lambda: _api_request('GET', '/hosts').json())
     if len(hosts['items']) == 0:
         raise RuntimeError('Cluster has no nodes.')
     if len(hosts['items']) > 1:
@@ -97,23 +284,67 @@ def get_host_ref():
     return {'hostId': host['hostId'], 'hostname': host['hostname']}
 
 
+def _get_parcel_index():
+    """Return a dict of (product, stage) -> list of parcel versions."""
+    def _load():
+        index = {}
+        for parcel in _api_request('GET', '/clusters/{}/parcels'.format(_get_cluster_name())).json()['items']:
+            index.setdefault((parcel['product'], parcel['stage']), []).append(parcel['version'])
+        return index
+
+    return _get_discovered('parcels', _load)
+
+
 def get_product_version(product, stage='ACTIVATED'):
-    products = _api_request('GET', '/clusters/{}/parcels'.format(_get_cluster_name())).json()
-    selected_version = [p for p in products['items'] if p['product'] == product and p['stage'] == stage]
+    selected_version = _get_parcel_index().get((product, stage), [])
     assert len(selected_version) == 1
-    return selected_version[0]['version']
+    return selected_version[0]
 
 
 def get_command(cmd_id):
     return _api_request('GET', '/commands/{}'.format(cmd_id)).json()
 
 
-def get_services(service_type=None):
-    services = _api_request('GET', '/clusters/{}/services'.format(_get_cluster_name())).json()
+def get_services(service_type=None, fresh=False):
+    """Return the cluster services of the given type (or all). Set fresh=True to bypass the discovery cache."""
+    if fresh:
+        invalidate_discovery_cache('services')
+    services = _get_discovered('services', lambda: _api_request('GET', '/clusters/{}/services'.format(
+        _get_cluster_name())).json())
     selected_services = [s for s in services['items'] if service_type is None or s['type'] == service_type]
     return selected_services
 
 
+def _get_rcg_index():
+    """Return a dict of (service name, role type) -> list of role config group names, from a single listing."""
+    def _load():
+        index = {}
+        services = _api_request('GET', '/clusters/{}/services'.format(_get_cluster_name()),
+                                params={'view': 'full'}).json()
+        for svc in services['items']:
+            # roleConfigGroups is only included in the full view; fall back to one listing for the service otherwise
+            rcgs = svc.get('roleConfigGroups')
+            if rcgs is None:
+                rcgs = _api_request('GET', '/clusters/{}/services/{}/roleConfigGroups'.format(
+                    _get_cluster_name(), svc['name'])).json()['items']
+            for rcg in rcgs:
+                index.setdefault((svc['name'], rcg['roleType']), []).append(rcg['name'])
+        return index
+
+    return _get_discovered('role_config_groups', _load)
+
+
+def _get_rcg_name(service_name, role_type):
+    rcg_names = _get_rcg_index().get((service_name, role_type), [])
+    if not rcg_names:
+        raise RuntimeError('Could not find role config group of type {} for service {}.'.format(role_type,
+                                                                                                service_name))
+    elif len(rcg_names) > 1:
+        raise RuntimeError('Found multiple role config groups ({}) of type {} for service {}.'.format(
+            len(rcg_names), role_type, service_name))
+    return rcg_names[0]
+
+
 def get_rcgs(service_name, role_type=None):
     rcgs = _api_request('GET', '/clusters/{}/services/{}/roleConfigGroups'.format(_get_cluster_name(),
                                                                                   service_name)).json()
@@ -132,29 +363,47 @@ def restart_service(service_name, wait=True):
     return _execute_service_cmd(service_name, 'restart', wait)
 
 
+def execute_service_cmds(service_names, cmd, wait=True, timeout_secs=COMMAND_TIMEOUT_SECS):
+    """Issue the command (e.g. "restart") to all the services at once and wait for all of them with one tracker."""
+    tracker = CommandTracker(timeout_secs=timeout_secs)
+    for service_name in service_names:
+        tracker.track(_execute_service_cmd(service_name, cmd, wait=False), '{} {}'.format(cmd, service_name))
+    if wait:
+        tracker.wait()
+    return tracker
+
+
 def restart_stale_services(wait=True):
-    cmds = []
-    for svc in get_services():
-        if svc['configStalenessStatus'] != 'FRESH':
-            cmds.append(restart_service(svc['name'], wait=False))
-    _wait_for_command(cmds)
+    stale_services = [svc['name'] for svc in get_services(fresh=True) if svc['configStalenessStatus'] != 'FRESH']
+    return execute_service_cmds(stale_services, 'restart', wait=wait)
+
+
+def restart_stale_services_and_deploy_client_config(wait=True):
+    """Restart the stale services and redeploy the client configuration with a single cluster restart command."""
+    cmd = _api_request('POST', '/clusters/{}/commands/restart'.format(_get_cluster_name()),
+                       json={'restartOnlyStaleServices': True, 'redeployClientConfiguration': True}).json()
+    invalidate_discovery_cache('services')
+    return _wait_for_command(cmd, timeout_secs=COMMAND_TIMEOUT_SECS if wait else 0)
 
 
 def deploy_client_config(wait=True, force=True):
     if not force:
-        for svc in get_services():
+        for svc in get_services(fresh=True):
             if svc['clientConfigStalenessStatus'] != 'FRESH':
                 break
         else:
             return None
 
     cmd = _api_request('POST', '/clusters/{}/commands/deployClientConfig'.format(_get_cluster_name())).json()
-    return _wait_for_command(cmd, timeout_secs=300 if wait else 0)
+    invalidate_discovery_cache('services')
+    return _wait_for_command(cmd, timeout_secs=COMMAND_TIMEOUT_SECS if wait else 0)
 
 
 def delete_service(service_name):
-    return _api_request('DELETE', '/clusters/{}/services/{}'.format(_get_cluster_name(), service_name),
+    resp = _api_request('DELETE', '/clusters/{}/services/{}'.format(_get_cluster_name(), service_name),
                         expected_codes=[requests.codes.ok, requests.codes.not_found])
+    invalidate_discovery_cache('services', 'role_config_groups')
+    return resp
 
 
 def add_service(service_name, service_type, roles, configs=None, display_name=None):
@@ -178,32 +427,85 @@ def add_service(service_name, service_type, roles, configs=None, display_name=No
             }
         ]
     }
-    svc = _api_request('POST', '/clusters/{}/services'.format(_get_cluster_name()), json=service_spec)
+    _api_request('POST', '/clusters/{}/services'.format(_get_cluster_name()), json=service_spec)
+    invalidate_discovery_cache('services', 'role_config_groups')
 
-    for role_type, cfg in configs.items():
+    txn = ConfigTransaction(restart=False)
+    for role_type, cfg in (configs or {}).items():
         if role_type == 'SERVICE-WIDE':
             continue
-        update_rcg_config(service_name, role_type, cfg)
+        txn.set_rcg_config(service_name, role_type, cfg)
+    txn.commit()
 
 
 def update_service_config(service_name, config):
-    return _api_request('PUT', '/clusters/{}/services/{}/config'.format(_get_cluster_name(), service_name),
+    resp = _api_request('PUT', '/clusters/{}/services/{}/config'.format(_get_cluster_name(), service_name),
                         json=_apilize_config(config))
+    invalidate_discovery_cache('services')
+    return resp
 
 
 def update_rcg_config(service_name, role_type, config):
-    rcgs = get_rcgs(service_name, role_type)
-    if not rcgs:
-        raise RuntimeError('Could not find role config group of type {} for service {}.'.format(role_type,
-                                                                                                service_name))
-    elif len(rcgs) > 1:
-        raise RuntimeError('Found multiple role config groups ({}) of type {} for service {}.'.format(
-            len(rcgs), role_type, service_name))
-    rcg = rcgs[0]
-    return _api_request('PUT', '/clusters/{}/services/{}/roleConfigGroups/{}/config'.format(_get_cluster_name(),
-                                                                                            service_name,
-                                                                                            rcg['name']),
-                        json=_apilize_config(config))
+    resp = _api_request('PUT', '/clusters/{}/services/{}/roleConfigGroups/{}/config'.format(
+        _get_cluster_name(), service_name, _get_rcg_name(service_name, role_type)), json=_apilize_config(config))
+    invalidate_discovery_cache('services')
+    return resp
+
+
+class ConfigTransaction(object):
+    """
+    Collect configuration changes for many services and role config groups and apply them at once.
+
+    commit() sends one PUT per service for the service-wide changes and one PUT per role config group, with all
+    the changes of the group merged (the CM API has no bulk update of role config groups). The group names are
+    resolved from a single cached listing. Then, if restart is True, the stale services are restarted and the client
+    configuration is redeployed with a single cluster command.
+
+    Example:
+        with cm.ConfigTransaction() as txn:
+            txn.set_service_config('kafka', {'auto.create.topics.enable': 'true'})
+            txn.set_rcg_config('kafka', 'KAFKA_BROKER', {'log.retention.hours': '1'})
+    """
+
+    def __init__(self, restart=True, wait=True):
+        self.restart = restart
+        self.wait = wait
+        self._service_configs = OrderedDict()  # service name -> config dict
+        self._rcg_configs = OrderedDict()  # (service name, role type) -> config dict
+
+    def set_service_config(self, service_name, config):
+        self._service_configs.setdefault(service_name, OrderedDict()).update(config)
+        return self
+
+    def set_rcg_config(self, service_name, role_type, config):
+        self._rcg_configs.setdefault((service_name, role_type), OrderedDict()).update(config)
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+
+    def commit(self):
+        """Apply the pending changes. Return the restart command, if one was executed."""
+        rcg_names = OrderedDict(((service_name, role_type), _get_rcg_name(service_name, role_type))
+                                for service_name, role_type in self._rcg_configs)
+        for service_name, config in self._service_configs.items():
+            _api_request('PUT', '/clusters/{}/services/{}/config'.format(_get_cluster_name(), service_name),
+                         json=_apilize_config(config))
+        for (service_name, role_type), config in self._rcg_configs.items():
+            _api_request('PUT', '/clusters/{}/services/{}/roleConfigGroups/{}/config'.format(
+                _get_cluster_name(), service_name, rcg_names[(service_name, role_type)]), json=_apilize_config(config))
+        changed = bool(self._service_configs or self._rcg_configs)
+        self._service_configs.clear()
+        self._rcg_configs.clear()
+        if changed:
+            invalidate_discovery_cache('services')
+            if self.restart:
+                return restart_stale_services_and_deploy_client_config(wait=self.wait)
+        return None
 
 
 def delete_peer_kafka_external_account(account_name):
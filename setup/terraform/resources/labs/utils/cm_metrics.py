@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Collector of Cloudera Manager time-series metrics for lab runs and load tests.
+
+MetricsCollector queries the CM /timeseries API in a background thread at a fixed interval. Each sample becomes one
+row, with the sampling time, the active phase and one column per metric, so that rows of different runs line up.
+The phase is the one set with set_phase() (e.g. a load test step) or, by default, the lab currently executing
+according to labs.tracing. Samples are written as CSV or, if pyarrow is installed, as Parquet.
+
+Example:
+    with cm_metrics.MetricsCollector(interval_secs=15) as collector:
+        collector.set_phase('ramp-up')
+        ...
+    collector.write()
+
+Set WORKSHOP_CM_METRICS_INTERVAL_SECS to collect metrics during all the workshop setups and teardowns.
+"""
+import csv
+from datetime import datetime, timedelta
+
+from . import *
+from . import cm
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+INTERVAL_ENV_VAR = CM_METRICS_INTERVAL_ENV_VAR
+DEFAULT_INTERVAL_SECS = 30
+
+# CM only stores raw data points at its own collection interval (usually one minute), so each query looks back this
+# far and keeps the most recent data point of each time series
+LOOKBACK_SECS = 180
+
+# Column name -> tsquery. When a query returns several time series (e.g. one per host), their values are added up.
+# Metrics of other services (e.g. NiFi or Kudu) can be collected by passing metrics to MetricsCollector.
+DEFAULT_METRICS = OrderedDict([
+    ('kafka_bytes_in_rate', 'select total_kafka_bytes_received_rate_across_kafka_brokers'),
+    ('kafka_bytes_out_rate', 'select total_kafka_bytes_fetched_rate_across_kafka_brokers'),
+    ('host_cpu_percent', 'select cpu_percent_across_hosts where category = CLUSTER'),
+    ('host_memory_used_bytes', 'select physical_memory_used where category = HOST'),
+])
+
+FIXED_COLUMNS = ['timestamp', 'phase']
+
+
+def _parse_timestamp(value):
+    return datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+
+
+def _format_timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def query_latest(tsquery, now=None):
+    """Return the sum of the most recent data points of the time series returned by the tsquery, or None."""
+    now = now or datetime.utcnow()
+    resp = cm._api_request('GET', '/timeseries', params={
+        'query': tsquery,
+        'from': _format_timestamp(now - timedelta(seconds=LOOKBACK_SECS)),
+        'to': _format_timestamp(now),
+        'desiredRollup': 'RAW',
+    })
+    values = []
+    for item in resp.json().get('items', []):
+        for series in item.get('timeSeries', []):
+            points = series.get('data', [])
+            if points:
+                values.append(max(points, key=lambda p: _parse_timestamp(p['timestamp']))['value'])
+    return sum(values) if values else None
+
+
+class MetricsCollector(object):
+    def __init__(self, metrics=None, interval_secs=DEFAULT_INTERVAL_SECS, run_id=None):
+        self.metrics = OrderedDict(metrics or DEFAULT_METRICS)
+        self.interval_secs = interval_secs
+        self.run_id = run_id
+        self.rows = []
+        self.errors = 0
+        self._phase = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def columns(self):
+        return FIXED_COLUMNS + list(self.metrics.keys())
+
+    def set_phase(self, phase):
+        """Tag the following samples with the given phase. None reverts to the lab being executed."""
+        self._phase = phase
+
+    def get_phase(self):
+        if self._phase is not None:
+            return self._phase
+        return '/'.join(span.name for span in tracing.TRACER.open_spans()) or None
+
+    def sample(self):
+        """Query all the metrics once and append the row to the collected samples."""
+        now = datetime.utcnow()
+        row = OrderedDict([('timestamp', now.isoformat()), ('phase', self.get_phase())])
+        for name, tsquery in self.metrics.items():
+            try:
+                row[name] = query_latest(tsquery, now)
+            except Exception as exc:
+                self.errors += 1
+                LOG.debug('Failed to collect metric %s: %s', name, exc)
+                row[name] = None
+        with self._lock:
+            self.rows.append(row)
+        return row
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            start = time.time()
+            self.sample()
+            self._stop_event.wait(max(0.0, self.interval_secs - (time.time() - start)))
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='cm-metrics', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def write(self, path=None):
+        """
+        Write the samples to the given path, as Parquet if it ends with .parquet and as CSV otherwise. The default
+        path is in the run reports directory, in Parquet format if pyarrow is installed. Return the path.
+        """
+        if path is None:
+            path = os.path.join(tracing.get_report_dir(), 'cm-metrics-{}{}.{}'.format(
+                datetime.now().strftime('%Y%m%d%H%M%S'), '-' + str(self.run_id) if self.run_id is not None else '',
+                'parquet' if pyarrow else 'csv'))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            rows = list(self.rows)
+        if path.endswith('.parquet'):
+            if pyarrow is None:
+                raise RuntimeError('pyarrow must be installed to write metrics in Parquet format.')
+            table = pyarrow.table(OrderedDict((col, [row.get(col) for row in rows]) for col in self.columns))
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with open(path, 'w', newline='') as csv_file:
+                writer = csv.DictWriter(csv_file, fieldnames=self.columns)
+                writer.writeheader()
+                writer.writerows(rows)
+        return path
+
+
+def get_interval_from_env():
+    """Return the sampling interval set in the environment, or None if metrics collection is not enabled."""
+    value = os.environ.get(INTERVAL_ENV_VAR)
+    return float(value) if value else None
@@ -82,9 +82,7 @@ def _api_delete(path, data=None):
 def _get_session():
     global _DATAVIZ_SESSION
     if not _DATAVIZ_SESSION:
-        _DATAVIZ_SESSION = requests.Session()
-        if is_tls_enabled():
-            _DATAVIZ_SESSION.verify = get_truststore_path()
+        _DATAVIZ_SESSION = get_service_session('dataviz')
 
         _api_get('/apps/login')
         _api_post('/apps/login?', {'next': '', 'username': _DATAVIZ_USER, 'password': get_the_pwd()})
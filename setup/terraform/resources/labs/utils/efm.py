@@ -15,9 +15,7 @@ def _get_session():
     global _EFM_SESSION
     global _XSRF_TOKEN
     if not _EFM_SESSION:
-        _EFM_SESSION = requests.Session()
-        if is_tls_enabled():
-            _EFM_SESSION.verify = get_truststore_path()
+        _EFM_SESSION = get_service_session('efm')
         if is_kerberos_enabled():
             _EFM_SESSION.post(_get_auth_url(), auth=('admin', get_the_pwd()))
             resp = _EFM_SESSION.get(_get_api_url() + '/access')
@@ -100,6 +98,10 @@ def _get_agent_manifests():
 
 
 def get_efm_version():
+    return get_service_version('efm', _fetch_efm_version)
+
+
+def _fetch_efm_version():
     global _SWAGGER_URL
     _ensure_urls()
     resp = _get_session().get(_SWAGGER_URL)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Collector of Flink job metrics for the jobs started through SSB.
+
+FlinkMetricsCollector maps SSB jobs (see ssb.get_jobs()) to the Flink jobs executing them and polls the Flink REST
+API in a background thread. Each sample produces one row per job vertex with its records in/out per second, its
+back-pressure ratio and its watermark lag, plus the duration and size of the latest completed checkpoint of the job.
+summary() aggregates the rows per SSB job.
+
+The Flink REST endpoints are the ones of the Flink YARN applications, found through the YARN ResourceManager, unless
+a URL is given, either to the collector or in the WORKSHOP_FLINK_REST_URL environment variable (e.g. the local stand-in
+of the Flink REST API in tests/utils/flink_rest.py).
+
+Example:
+    with flink_metrics.FlinkMetricsCollector(['fraud_detection_job'], interval_secs=10) as collector:
+        ...
+    collector.write()
+    print(collector.summary())
+"""
+import csv
+import json
+from datetime import datetime
+
+from . import *
+from . import ssb
+from requests_gssapi import HTTPSPNEGOAuth
+
+REST_URL_ENV_VAR = 'WORKSHOP_FLINK_REST_URL'
+DEFAULT_INTERVAL_SECS = 15
+FLINK_YARN_APPLICATION_TYPE = 'Apache Flink'
+
+# Flink reports this watermark for inputs that have not received any watermark yet
+_NO_WATERMARK = -9223372036854775808
+
+COLUMNS = ['timestamp', 'ssb_job', 'flink_job_id', 'vertex_id', 'vertex', 'records_in_per_sec', 'records_out_per_sec',
+           'backpressure_ratio', 'watermark_lag_ms', 'checkpoint_duration_ms', 'checkpoint_size_bytes']
+
+
+def _get_session():
+    return get_service_session('flink', auth_factory=HTTPSPNEGOAuth if is_kerberos_enabled() else None)
+
+
+def _get(url):
+    return api_get(url, session=_get_session()).json()
+
+
+def _get_yarn_rm_url():
+    return '{}://{}:{}'.format(get_url_scheme(), get_hostname(), 8090 if is_tls_enabled() else 8088)
+
+
+def get_rest_urls():
+    """Return the base URLs of the Flink REST APIs: the one set in the environment or those of the YARN apps."""
+    if os.environ.get(REST_URL_ENV_VAR):
+        return [os.environ[REST_URL_ENV_VAR].rstrip('/')]
+    apps = _get('{}/ws/v1/cluster/apps?states=RUNNING&applicationTypes={}'.format(
+        _get_yarn_rm_url(), FLINK_YARN_APPLICATION_TYPE))
+    return [app['trackingUrl'].rstrip('/') for app in ((apps or {}).get('apps') or {}).get('app', [])]
+
+
+def map_jobs(ssb_jobs, rest_urls):
+    """
+    Return a dict of SSB job name -> (Flink REST URL, Flink job id) for the SSB jobs that are running in Flink.
+    Jobs are matched by the Flink job id of the SSB job, if SSB returns it, or else by name.
+    """
+    flink_jobs = {}  # Flink job id or name -> (REST URL, Flink job id)
+    for url in rest_urls:
+        for job in _get('{}/jobs/overview'.format(url)).get('jobs', []):
+            if job.get('state') == 'RUNNING':
+                flink_jobs[job['jid']] = (url, job['jid'])
+                flink_jobs.setdefault(job['name'], (url, job['jid']))
+    mapping = OrderedDict()
+    for job in ssb_jobs:
+        match = flink_jobs.get(job.get('flink_job_id')) or flink_jobs.get(job['name'])
+        if match:
+            mapping[job['name']] = match
+    return mapping
+
+
+def _metric_values(values):
+    return {v['id']: v.get('sum') for v in values}
+
+
+def _backpressure_ratio(data):
+    ratios = [s['ratio'] for s in data.get('subtasks', []) if s.get('ratio') is not None]
+    return max(ratios) if ratios else None
+
+
+def _watermark_lag_ms(values, now_ms):
+    watermarks = [int(v['value']) for v in values
+                  if v['id'].endswith('currentInputWatermark') and int(v['value']) != _NO_WATERMARK]
+    return now_ms - min(watermarks) if watermarks else None
+
+
+def _avg(values):
+    values = [v for v in values if v is not None]
+    return round(sum(values) / len(values), 3) if values else None
+
+
+def _max(values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+class FlinkMetricsCollector(object):
+    def __init__(self, job_names=None, interval_secs=DEFAULT_INTERVAL_SECS, flink_url=None, ssb_jobs=None):
+        """
+        :param job_names: names of the SSB jobs to follow. None means all the running jobs.
+        :param flink_url: base URL of the Flink REST API. By default, see get_rest_urls().
+        :param ssb_jobs: SSB jobs (as returned by ssb.get_jobs()) to map to Flink jobs instead of listing them.
+        """
+        self.job_names = job_names
+        self.interval_secs = interval_secs
+        self.flink_url = flink_url
+        self.ssb_jobs = ssb_jobs
+        self.jobs = OrderedDict()  # SSB job name -> (Flink REST URL, Flink job id)
+        self.rows = []
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def refresh_jobs(self):
+        """Map the SSB jobs to the Flink jobs again, e.g. after a job (re)started."""
+        if self.ssb_jobs is not None:
+            ssb_jobs = self.ssb_jobs
+        else:
+            ssb_jobs = ssb.get_jobs(state=ssb.JOB_RUNNING_STATE)
+        ssb_jobs = [j for j in ssb_jobs if self.job_names is None or j['name'] in self.job_names]
+        self.jobs = map_jobs(ssb_jobs, [self.flink_url.rstrip('/')] if self.flink_url else get_rest_urls())
+        return self.jobs
+
+    def _try(self, func, default=None):
+        try:
+            return func()
+        except Exception as exc:
+            self.errors += 1
+            LOG.debug('Failed to collect Flink metric: %s', exc)
+            return default
+
+    def _sample_job(self, ssb_job, url, flink_job_id, now):
+        job_url = '{}/jobs/{}'.format(url, flink_job_id)
+        vertices = _get(job_url).get('vertices', [])
+        checkpoint = self._try(lambda: (_get(job_url + '/checkpoints').get('latest') or {}).get('completed'))
+        now_ms = int(time.time() * 1000)
+        rows = []
+        for vertex in vertices:
+            vertex_url = '{}/vertices/{}'.format(job_url, vertex['id'])
+            metrics = self._try(lambda: _metric_values(_get(
+                vertex_url + '/subtasks/metrics?get=numRecordsInPerSecond,numRecordsOutPerSecond&agg=sum')), {})
+            rows.append(OrderedDict([
+                ('timestamp', now.isoformat()),
+                ('ssb_job', ssb_job),
+                ('flink_job_id', flink_job_id),
+                ('vertex_id', vertex['id']),
+                ('vertex', vertex.get('name')),
+                ('records_in_per_sec', metrics.get('numRecordsInPerSecond')),
+                ('records_out_per_sec', metrics.get('numRecordsOutPerSecond')),
+                ('backpressure_ratio', self._try(lambda: _backpressure_ratio(_get(vertex_url + '/backpressure')))),
+                ('watermark_lag_ms', self._try(lambda: _watermark_lag_ms(_get(vertex_url + '/watermarks'), now_ms))),
+                ('checkpoint_duration_ms', checkpoint.get('end_to_end_duration') if checkpoint else None),
+                ('checkpoint_size_bytes', checkpoint.get('state_size') if checkpoint else None),
+            ]))
+        return rows
+
+    def sample(self):
+        """Collect the metrics of all the jobs once and append the rows to the collected samples."""
+        if not self.jobs or (self.job_names is not None and set(self.job_names) - set(self.jobs)):
+            self._try(self.refresh_jobs)
+        now = datetime.utcnow()
+        rows = []
+        for ssb_job, (url, flink_job_id) in list(self.jobs.items()):
+            job_rows = self._try(lambda: self._sample_job(ssb_job, url, flink_job_id, now))
+            if job_rows is None:
+                # the job may have been restarted with a new Flink job id
+                self.jobs.pop(ssb_job, None)
+            rows.extend(job_rows or [])
+        with self._lock:
+            self.rows.extend(rows)
+        return rows
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            start = time.time()
+            self.sample()
+            self._stop_event.wait(max(0.0, self.interval_secs - (time.time() - start)))
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='flink-metrics', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def summary(self):
+        """
+        Return a dict of SSB job name -> summary of its samples: the average and maximum records in/out per second
+        of each vertex, the maximum back-pressure ratio and watermark lag across vertices and the average and
+        maximum checkpoint duration and the last checkpoint size.
+        """
+        with self._lock:
+            rows = list(self.rows)
+        summary = OrderedDict()
+        for ssb_job in OrderedDict((row['ssb_job'], None) for row in rows):
+            job_rows = [row for row in rows if row['ssb_job'] == ssb_job]
+            vertices = OrderedDict()
+            for vertex_id in OrderedDict((row['vertex_id'], None) for row in job_rows):
+                vertex_rows = [row for row in job_rows if row['vertex_id'] == vertex_id]
+                vertices[vertex_id] = OrderedDict([
+                    ('vertex', vertex_rows[0]['vertex']),
+                    ('avg_records_in_per_sec', _avg(row['records_in_per_sec'] for row in vertex_rows)),
+                    ('max_records_in_per_sec', _max(row['records_in_per_sec'] for row in vertex_rows)),
+                    ('avg_records_out_per_sec', _avg(row['records_out_per_sec'] for row in vertex_rows)),
+                    ('max_records_out_per_sec', _max(row['records_out_per_sec'] for row in vertex_rows)),
+                    ('max_backpressure_ratio', _max(row['backpressure_ratio'] for row in vertex_rows)),
+                    ('max_watermark_lag_ms', _max(row['watermark_lag_ms'] for row in vertex_rows)),
+                ])
+            # checkpoint values are repeated in every vertex row of a sample
+            samples = list(OrderedDict((row['timestamp'], row) for row in job_rows).values())
+            summary[ssb_job] = OrderedDict([
+                ('flink_job_id', job_rows[-1]['flink_job_id']),
+                ('samples', len(samples)),
+                ('max_backpressure_ratio', _max(v['max_backpressure_ratio'] for v in vertices.values())),
+                ('max_watermark_lag_ms', _max(v['max_watermark_lag_ms'] for v in vertices.values())),
+                ('avg_checkpoint_duration_ms', _avg(row['checkpoint_duration_ms'] for row in samples)),
+                ('max_checkpoint_duration_ms', _max(row['checkpoint_duration_ms'] for row in samples)),
+                ('last_checkpoint_size_bytes', job_rows[-1]['checkpoint_size_bytes']),
+                ('vertices', vertices),
+            ])
+        return summary
+
+    def write(self, path=None):
+        """
+        Write the samples as CSV to the given path (by default, in the run reports directory) and the summary as
+        JSON next to it. Return the path of the samples.
+        """
+        if path is None:
+            path = os.path.join(tracing.get_report_dir(),
+                                'flink-metrics-{}.csv'.format(datetime.now().strftime('%Y%m%d%H%M%S')))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            rows = list(self.rows)
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        with open(os.path.splitext(path)[0] + '-summary.json', 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=2)
+        return path
@@ -80,10 +80,15 @@ def get_kudu_table_name(database_name, table_name):
 
 
 def get_version():
+    return get_service_version('kudu', _fetch_version)
+
+
+def _fetch_version():
     if is_tls_enabled():
-        resp = requests.get('https://' + get_hostname() + ':8051/', verify=False, auth=HTTPSPNEGOAuth())
+        session = get_service_session('kudu', auth_factory=HTTPSPNEGOAuth, verify=False)
+        resp = session.get('https://' + get_hostname() + ':8051/')
     else:
-        resp = requests.get('http://' + get_hostname() + ':8051/')
+        resp = get_service_session('kudu').get('http://' + get_hostname() + ':8051/')
 
     if resp:
         m = re.search('<h2>Version Info</h2>\n<pre>kudu ([0-9.]+)', resp.text)
@@ -7,9 +7,7 @@ from . import nifireg
 
 DEFAULT_SSL_SERVICE_NAME = 'Default NiFi SSL Context Service'
 DEFAULT_TRUSTSTORE_LOCATION = '/opt/cloudera/security/jks/truststore.jks'
-DEFAULT_TRUSTSTORE_PASSWORD = get_the_pwd()
 DEFAULT_KEYSTORE_LOCATION = '/opt/cloudera/security/jks/keystore.jks'
-DEFAULT_KEYSTORE_PASSWORD = get_the_pwd()
 
 DEFAULT_KEYTAB_SERVICE_NAME = 'KeytabCredentialsService'
 DEFAULT_KEYTAB_LOCATION = '/keytabs/admin.keytab'
@@ -129,9 +127,12 @@ def _create_controller(pg, service_name, props, controller_class):
 
 def create_ssl_controller(pg, service_name=DEFAULT_SSL_SERVICE_NAME,
                           truststore_location=DEFAULT_TRUSTSTORE_LOCATION,
-                          truststore_password=DEFAULT_TRUSTSTORE_PASSWORD,
+                          truststore_password=None,
                           keystore_location=DEFAULT_KEYSTORE_LOCATION,
-                          keystore_password=DEFAULT_KEYSTORE_PASSWORD):
+                          keystore_password=None):
+    # Passwords default to the workshop password
+    truststore_password = truststore_password or get_the_pwd()
+    keystore_password = keystore_password or get_the_pwd()
     props = {
         'SSL Protocol': 'TLS',
         'Truststore Type': 'JKS',
@@ -255,21 +256,35 @@ def delete_all(pg):
         parameters.delete_parameter_context(context)
 
 
-def wait_for_data(pg_name, timeout_secs=120):
-    while timeout_secs:
+def wait_for_data(pg_name, timeout_secs=360, settle_secs=10):
+    """
+    Wait until data flows into the process group and then, for up to settle_secs, until data is seen leaving it, to
+    let the pipes be primed. The aggregate snapshot covers the last 5 minutes, so the flow is only considered primed
+    when the bytes out or sent grow beyond their values at the time data started flowing.
+    """
+    def _get_snapshot():
         pg = canvas.get_process_group(pg_name, 'name')
-        if pg is None:
-            break
-
-        bytes_in = pg.status.aggregate_snapshot.bytes_in
-        if bytes_in > 0:
-            break
-        timeout_secs -= 1
-        LOG.info("Data not Flowing yet, sleeping for 3")
-        time.sleep(3)
-
-    # wait a few more seconds just to let the pipes to be primed
-    time.sleep(10)
+        return pg.status.aggregate_snapshot if pg is not None else None
+
+    def _data_flowing():
+        snapshot = _get_snapshot()
+        if snapshot is None or snapshot.bytes_in > 0:
+            return snapshot or True
+        LOG.info("Data not Flowing yet")
+        return False
+
+    flowing = polling.poll(_data_flowing, timeout_secs=timeout_secs, initial_interval_secs=1, max_interval_secs=5,
+                           raise_on_timeout=False, name='nifi.wait_for_data')
+    if flowing is True or not flowing:
+        return
+    bytes_out, bytes_sent = flowing.bytes_out, flowing.bytes_sent
+
+    def _pipes_primed():
+        snapshot = _get_snapshot()
+        return snapshot is None or snapshot.bytes_out > bytes_out or snapshot.bytes_sent > bytes_sent
+
+    polling.poll(_pipes_primed, timeout_secs=settle_secs, initial_interval_secs=0.5, max_interval_secs=2,
+                 raise_on_timeout=False, name='nifi.wait_for_data:priming')
 
 
 def set_environment():
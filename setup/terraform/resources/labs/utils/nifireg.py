@@ -63,8 +63,7 @@ def save_flow_ver(process_group, registry_client, bucket, flow_name=None,
 
 def _api_request(method, endpoint, expected_codes=None, **kwargs):
     url = get_api_url() + endpoint
-    auth = None
-    return api_request(method, url, expected_codes, auth=auth, **kwargs)
+    return api_request(method, url, expected_codes, session=get_service_session('nifireg'), **kwargs)
 
 
 def _api_delete(endpoint, expected_codes=None, **kwargs):
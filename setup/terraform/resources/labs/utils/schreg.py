@@ -13,13 +13,13 @@ def get_api_url():
     return '%s://%s:%s/api/v1' % (get_url_scheme(), get_hostname(), _get_port())
 
 
+def _get_session():
+    return get_service_session('schreg', auth_factory=HTTPSPNEGOAuth if is_tls_enabled() else None)
+
+
 def _api_request(method, endpoint, **kwargs):
     url = get_api_url() + endpoint
-    if is_tls_enabled():
-        auth = HTTPSPNEGOAuth()
-    else:
-        auth = None
-    return api_request(method, url, auth=auth, **kwargs)
+    return api_request(method, url, session=_get_session(), **kwargs)
 
 
 def _api_get(endpoint, **kwargs):
@@ -14,13 +14,13 @@ def _get_api_url():
     return '%s://%s:%s' % (get_url_scheme(), get_hostname(), _get_port())
 
 
+def _get_session():
+    return get_service_session('smm', auth_factory=HTTPSPNEGOAuth if is_tls_enabled() else None)
+
+
 def _api_request(method, endpoint, expected_codes=None, **kwargs):
     url = _get_api_url() + endpoint
-    if is_tls_enabled():
-        auth = HTTPSPNEGOAuth()
-    else:
-        auth = None
-    return api_request(method, url, expected_codes, auth=auth, **kwargs)
+    return api_request(method, url, expected_codes, session=_get_session(), **kwargs)
 
 
 def api_get(endpoint, expected_codes=None, **kwargs):
@@ -36,6 +36,10 @@ def api_delete(endpoint, expected_codes=None, **kwargs):
 
 
 def get_smm_version():
+    return get_service_version('smm', _fetch_smm_version)
+
+
+def _fetch_smm_version():
     resp = api_get('/api/v1/admin/version')
     assert resp.status_code == requests.codes.ok
     version_info = resp.json()
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import json
+import queue
 import uuid
+from collections import namedtuple
 
 from . import *
 from . import cm
@@ -9,12 +11,17 @@ from requests_kerberos import HTTPKerberosAuth, DISABLED
 
 _SSB_USER = 'admin'
 _SSB_SESSION = None
+_SSB_SESSION_LOCK = threading.RLock()
 _SSB_CSRF_TOKEN = None
 
 _API_INTERNAL = 'internal'
 _API_EXTERNAL = 'external'
 _API_UI = 'ui'
-_FLINK_VERSION = None
+STOP_JOB_TIMEOUT_SECS = 300
+JOB_WATCH_INTERVAL_SECS = 1
+SAMPLE_POLL_INTERVAL_SECS = 0.5
+SAMPLE_BUFFER_ROWS = 1000
+CATALOG_TTL_SECS = 300
 
 
 _CSRF_REGEXPS = [
@@ -25,6 +32,14 @@ _CSRF_REGEXPS = [
 JOB_RUNNING_STATE = 'RUNNING'
 JOB_STOPPED_STATE = 'STOPPED'
 
+_CATALOG = {}  # catalog key -> _CatalogIndex
+_CATALOG_LOCK = threading.RLock()  # held only to read or change the catalog, never during a listing call
+_CATALOG_LOAD_LOCKS = {}  # catalog key -> lock held while listing the items of the key
+_CATALOG_EPOCH = 0  # incremented by each update or invalidation, to discard the listings that started before it
+_CATALOG_STATS = {'hits': 0, 'loads': 0, 'refreshes_on_miss': 0, 'updates': 0, 'invalidations': 0}
+_JOB_STOPS = []  # results of the jobs watched by JobWatcher instances
+_JOB_STOPS_LOCK = threading.Lock()
+
 
 def _get_csrf_token(txt, quiet=True):
     token = None
@@ -39,35 +54,14 @@ def _get_csrf_token(txt, quiet=True):
     return token
 
 
-def _get_ui_port():
-    if is_csa17_or_later():
-        return '18121'
-    else:
-        return '8001' if is_tls_enabled() else '8000'
-
-
-def _get_api_url():
-    if is_csa17_or_later():
-        return '{}://{}:{}'.format(get_url_scheme(), get_hostname(), _get_ui_port())
-    else:
-        return '{}://{}:{}/api/v1'.format(get_url_scheme(), get_hostname(), _get_ui_port())
-
-
-def _get_rest_api_url():
-    return '{}://{}:18121/api/v1'.format(get_url_scheme(), get_hostname())
-
-
-def _get_ui_url():
-    return '{}://{}:{}/ui'.format(get_url_scheme(), get_hostname(), _get_ui_port())
-
-
 def _get_url(api_type):
+    profile = get_api_profile()
     if api_type == _API_UI:
-        return _get_ui_url()
+        return profile.ui_url
     elif api_type == _API_INTERNAL:
-        return _get_api_url()
+        return profile.api_url
     else:
-        return _get_rest_api_url()
+        return profile.rest_api_url
 
 
 def _api_call(func, path, data=None, files=None, headers=None, api_type=_API_INTERNAL, token=False, auth=None):
@@ -108,255 +102,430 @@ def _api_delete(path, data=None, api_type=_API_INTERNAL, token=False):
     return _api_call(_get_session().delete, path, data=data, api_type=api_type, token=token)
 
 
-def _user_path():
-    if is_csa19_or_later():
-        return '/user'
-    else:
-        return '/internal/user/current'
-
+# Resolved once per environment profile: base URLs, endpoint paths, API types, id attributes and payload dialect of
+# the SSB version installed, so that API calls do not need to check the CSA version again
+SsbApiProfile = namedtuple('SsbApiProfile', [
+    'csa_version', 'ui_port', 'api_url', 'rest_api_url', 'ui_url',
+    'user_path', 'user_endpoint', 'udf_path', 'udf_endpoint', 'job_path', 'job_ref_attr',
+    'delete_job_path', 'delete_job_endpoint', 'data_source_path', 'data_source_endpoint', 'data_source_id_attr',
+    'provider_type_attr', 'custom_truststore', 'wrapped_responses', 'schema_detection_path', 'sql_execute_path',
+    'sql_dialect', 'tables_path', 'tables_endpoint', 'tables_tree_path', 'tables_tree_endpoint',
+    'keytab_upload_path', 'keytab_upload_endpoint', 'keytab_generate_path', 'keytab_generate_endpoint',
+    'basic_auth_login', 'sample_path', 'udf_languages', 'java_functions',
+])
 
-def _user_endpoint():
-    if is_csa19_or_later():
-        return _API_EXTERNAL
-    else:
-        return _API_INTERNAL
+UDF_LANGUAGE_JAVASCRIPT = 'JavaScript'
+UDF_LANGUAGE_PYTHON = 'Python'
+UDF_LANGUAGE_JAVA = 'Java'
 
+_SQL_DIALECT_JOB_CONFIG = 'job_config'
+_SQL_DIALECT_JOB_PARAMETERS = 'job_parameters'
 
-def _udf_path():
-    if is_csa19_or_later():
-        return '/udfs'
-    else:
-        return '/internal/udf'
 
+def _get_session():
+    global _SSB_SESSION
+    # the lock is reentrant: the login calls below get the session being initialized
+    with _SSB_SESSION_LOCK:
+        if _SSB_SESSION:
+            return _SSB_SESSION
+        _SSB_SESSION = get_service_session('ssb')
 
-def _udf_endpoint():
-    if is_csa19_or_later():
-        return _API_EXTERNAL
-    else:
-        return _API_INTERNAL
+        profile = get_api_profile()
+        _api_get('/login', api_type=_API_UI)
+        if profile.basic_auth_login:
+            if is_kerberos_enabled():
+                auth = HTTPKerberosAuth(mutual_authentication=DISABLED)
+            else:
+                auth = (_SSB_USER, get_the_pwd())
+            _api_get(profile.user_path, auth=auth, api_type=profile.user_endpoint)
+        else:
+            _api_post('/login', {'next': '', 'login': _SSB_USER, 'password': get_the_pwd()}, api_type=_API_UI,
+                      token=True)
+        return _SSB_SESSION
 
 
-def _job_path():
-    if is_csa19_or_later():
-        return '/jobs'
-    else:
-        return '/ssb/jobs'
+def _get_flink_version():
+    return get_service_version('flink', lambda: cm.get_product_version('FLINK'))
 
 
-def _delete_job_path():
-    if is_csa19_or_later():
-        return '/jobs'
-    else:
-        return '/internal/jobs'
+def _get_csa_version():
+    parcel_version = _get_flink_version()
+    version_match = re.match(r'.*csad?h?-?([0-9.]*).*', parcel_version)
+    return [int(v) for v in version_match.groups()[0].split('.')]
 
 
-def _delete_job_endpoint():
-    if is_csa19_or_later():
-        return _API_EXTERNAL
-    else:
-        return _API_INTERNAL
+def _build_api_profile():
+    version = _get_csa_version()
+    csa16 = version >= [1, 6]
+    csa17 = version >= [1, 7]
+    csa19 = version >= [1, 9]
+    scheme = get_url_scheme()
+    hostname = get_hostname()
+    if csa17:
+        ui_port = '18121'
+    else:
+        ui_port = '8001' if is_tls_enabled() else '8000'
+    versioned_endpoint = _API_EXTERNAL if csa19 else _API_INTERNAL
+    keytab_endpoint = _API_EXTERNAL if csa19 else _API_INTERNAL if csa17 else _API_UI
+    profile = SsbApiProfile(
+        csa_version=tuple(version),
+        ui_port=ui_port,
+        api_url='{}://{}:{}{}'.format(scheme, hostname, ui_port, '' if csa17 else '/api/v1'),
+        rest_api_url='{}://{}:18121/api/v1'.format(scheme, hostname),
+        ui_url='{}://{}:{}/ui'.format(scheme, hostname, ui_port),
+        user_path='/user' if csa19 else '/internal/user/current',
+        user_endpoint=versioned_endpoint,
+        udf_path='/udfs' if csa19 else '/internal/udf',
+        udf_endpoint=versioned_endpoint,
+        job_path='/jobs' if csa19 else '/ssb/jobs',
+        job_ref_attr='job_id' if csa19 else 'name',
+        delete_job_path='/jobs' if csa19 else '/internal/jobs',
+        delete_job_endpoint=versioned_endpoint,
+        data_source_path='/data-sources' if csa19 else '/internal/external-provider' if csa16
+        else '/external-providers',
+        data_source_endpoint=versioned_endpoint,
+        data_source_id_attr='id' if csa19 else 'provider_id',
+        provider_type_attr='type' if csa16 else 'provider_type',
+        custom_truststore=version >= [1, 10],
+        wrapped_responses=not csa16,
+        schema_detection_path='/internal/kafka/{}/schema?topic_name={}' if csa16
+        else '/dataprovider-endpoints/kafkaSample/{}/{}',
+        sql_execute_path='/sql/execute' if csa19 else '/ssb/sql/execute',
+        sql_dialect=_SQL_DIALECT_JOB_CONFIG if csa19 else _SQL_DIALECT_JOB_PARAMETERS,
+        tables_path='/tables' if csa19 else '/internal/data-provider' if csa16 else '/sb-source',
+        tables_endpoint=versioned_endpoint,
+        tables_tree_path='/tables/tree' if csa19 else '/internal/catalog/tables-tree' if csa16 else '/sb-source',
+        tables_tree_endpoint=versioned_endpoint,
+        keytab_upload_path='/user/keytab/upload' if csa19 else '/internal/user/upload-keytab' if csa17
+        else '/keytab/upload',
+        keytab_upload_endpoint=keytab_endpoint,
+        keytab_generate_path='/user/keytab/generate' if csa19 else '/internal/user/generate-keytab' if csa17 else None,
+        keytab_generate_endpoint=keytab_endpoint,
+        basic_auth_login=csa17,
+        sample_path='/samples' if csa19 else None,
+        udf_languages=(UDF_LANGUAGE_JAVASCRIPT, UDF_LANGUAGE_PYTHON) if version >= [1, 11]
+        else (UDF_LANGUAGE_JAVASCRIPT,),
+        java_functions=version >= [1, 10],
+    )
+    LOG.debug('SSB API profile: %s', profile)
+    return profile
+
+
+def get_api_profile():
+    """Return the SSB API profile, built on the first call after each environment profile refresh."""
+    return get_service_version('ssb_api', _build_api_profile)
 
 
-def _data_source_path():
-    if is_csa19_or_later():
-        return '/data-sources'
-    elif is_csa16_or_later():
-        return '/internal/external-provider'
-    else:
-        return '/external-providers'
+def is_csa16_or_later():
+    return get_api_profile().csa_version >= (1, 6)
 
 
-def _data_source_endpoint():
-    if is_csa19_or_later():
-        return _API_EXTERNAL
-    else:
-        return _API_INTERNAL
+def is_csa17_or_later():
+    return get_api_profile().csa_version >= (1, 7)
 
 
-def _data_source_id_attr():
-    if is_csa19_or_later():
-        return 'id'
-    else:
-        return 'provider_id'
+def is_csa19_or_later():
+    return get_api_profile().csa_version >= (1, 9)
 
 
-def _sql_execute_path():
-    if is_csa19_or_later():
-        return '/sql/execute'
-    else:
-        return '/ssb/sql/execute'
+def is_csa110_or_later():
+    return get_api_profile().csa_version >= (1, 10)
 
 
-def _tables_path():
-    if is_csa19_or_later():
-        return '/tables'
-    elif is_csa16_or_later():
-        return '/internal/data-provider'
-    else:
-        return '/sb-source'
+def is_ssb_installed():
+    return len(cm.get_services('SQL_STREAM_BUILDER')) > 0
 
 
-def _tables_endpoint():
-    if is_csa19_or_later():
-        return _API_EXTERNAL
-    else:
-        return _API_INTERNAL
+class _CatalogIndex(object):
+    """Items of one kind of SSB object, indexed by id and by name."""
+
+    def __init__(self, items, id_attr, name_attr, ignore_case=False):
+        self.id_attr = id_attr
+        self.name_attr = name_attr
+        self.ignore_case = ignore_case
+        self.loaded_at = time.time()
+        self._by_id = OrderedDict()
+        self._by_name = {}
+        for item in items:
+            self.add(item)
+
+    def _name_key(self, name):
+        return name.upper() if self.ignore_case else name
+
+    def add(self, item):
+        self.remove(item[self.id_attr])
+        self._by_id[item[self.id_attr]] = item
+        self._by_name.setdefault(self._name_key(item[self.name_attr]), []).append(item[self.id_attr])
+
+    def remove(self, item_id):
+        item = self._by_id.pop(item_id, None)
+        if item is not None:
+            ids = self._by_name[self._name_key(item[self.name_attr])]
+            ids.remove(item_id)
+            if not ids:
+                del self._by_name[self._name_key(item[self.name_attr])]
+
+    def find(self, name=None, item_id=None):
+        if item_id is not None:
+            items = [self._by_id[item_id]] if item_id in self._by_id else []
+        elif name is not None:
+            items = [self._by_id[i] for i in self._by_name.get(self._name_key(name), [])]
+        else:
+            items = list(self._by_id.values())
+        return items
 
 
-def _tables_tree_path():
-    if is_csa19_or_later():
-        return '/tables/tree'
-    elif is_csa16_or_later():
-        return '/internal/catalog/tables-tree'
-    else:
-        return '/sb-source'
+def _list_data_providers():
+    profile = get_api_profile()
+    resp = _api_get(profile.data_source_path, api_type=profile.data_source_endpoint)
+    if profile.wrapped_responses:
+        return resp.json()['data']['providers']
+    return resp.json()
 
 
-def _tables_tree_endpoint():
-    if is_csa19_or_later():
-        return _API_EXTERNAL
-    else:
-        return _API_INTERNAL
+def _list_udfs():
+    profile = get_api_profile()
+    return _api_get(profile.udf_path, api_type=profile.udf_endpoint).json()
 
 
-def _keytab_upload_path():
-    if is_csa19_or_later():
-        return '/user/keytab/upload'
-    elif is_csa17_or_later():
-        return '/internal/user/upload-keytab'
-    else:
-        return '/keytab/upload'
+def _list_tables(org):
+    profile = get_api_profile()
+    resp = _api_get(profile.tables_tree_path, api_type=profile.tables_tree_endpoint)
+    if profile.wrapped_responses:
+        return resp.json()['data']
+    data = resp.json()
+    assert 'tables' in data
+    if 'ssb' in data['tables'] and org in data['tables']['ssb']:
+        return data['tables']['ssb'][org]
+    return []
 
 
-def _keytab_upload_endpoint():
-    if is_csa19_or_later():
-        return _API_EXTERNAL
-    elif is_csa17_or_later():
-        return _API_INTERNAL
-    else:
-        return _API_UI
+def _list_jobs():
+    return _api_get(get_api_profile().job_path, api_type=_API_EXTERNAL).json()['jobs']
 
 
-def _keytab_generate_path():
-    if is_csa19_or_later():
-        return '/user/keytab/generate'
-    elif is_csa17_or_later():
-        return '/internal/user/generate-keytab'
+def _new_catalog_index(kind, items):
+    if kind == 'providers':
+        return _CatalogIndex(items, get_api_profile().data_source_id_attr, 'name')
+    elif kind == 'udfs':
+        return _CatalogIndex(items, 'id', 'name', ignore_case=True)
+    elif kind == 'jobs':
+        return _CatalogIndex(items, 'job_id', 'name')
     else:
-        raise RuntimeError('This feature is only implemented for CSA 1.7 and later.')
+        return _CatalogIndex(items, 'id', 'table_name')
 
 
-def _keytab_generate_endpoint():
-    if is_csa19_or_later():
-        return _API_EXTERNAL
-    elif is_csa17_or_later():
-        return _API_INTERNAL
-    else:
-        return _API_UI
+def _catalog_key(kind, org=None):
+    return kind if org is None else '{}:{}'.format(kind, org)
 
 
-def _get_session():
-    global _SSB_SESSION
-    if not _SSB_SESSION:
-        _SSB_SESSION = requests.Session()
-        if is_tls_enabled():
-            _SSB_SESSION.verify = get_truststore_path()
-
-        _api_get('/login', api_type=_API_UI)
-        if is_csa17_or_later():
-            if is_kerberos_enabled():
-                auth = HTTPKerberosAuth(mutual_authentication=DISABLED)
-            else:
-                auth = (_SSB_USER, get_the_pwd())
-            _api_get(_user_path(), auth=auth, api_type=_user_endpoint())
+def _load_catalog(kind, org=None, items=None):
+    """
+    Replace the catalog index of the kind with the given items or, if None, with a fresh listing. The index is not
+    stored if the catalog was updated or invalidated while listing the items.
+    """
+    with _CATALOG_LOCK:
+        epoch = _CATALOG_EPOCH
+    started_at = time.time()
+    if items is None:
+        if kind == 'providers':
+            items = _list_data_providers()
+        elif kind == 'udfs':
+            items = _list_udfs()
+        elif kind == 'jobs':
+            items = _list_jobs()
         else:
-            _api_post('/login', {'next': '', 'login': _SSB_USER, 'password': get_the_pwd()}, api_type=_API_UI, token=True)
-    return _SSB_SESSION
-
-
-def _get_flink_version():
-    global _FLINK_VERSION
-    if not _FLINK_VERSION:
-        _FLINK_VERSION = cm.get_product_version('FLINK')
-    return _FLINK_VERSION
-
-
-def _get_csa_version():
-    parcel_version = _get_flink_version()
-    version_match = re.match(r'.*csad?h?-?([0-9.]*).*', parcel_version)
-    return [int(v) for v in version_match.groups()[0].split('.')]
+            items = _list_tables(org)
+    index = _new_catalog_index(kind, items)
+    index.loaded_at = started_at
+    with _CATALOG_LOCK:
+        if epoch == _CATALOG_EPOCH:
+            _CATALOG[_catalog_key(kind, org)] = index
+        _CATALOG_STATS['loads'] += 1
+    return index
+
+
+def _find_cached(key, name, item_id, fresh, loaded_after=None):
+    """
+    Return the matching items of the cached index of the key, or None if the catalog must be loaded. An index loaded
+    after loaded_after (e.g. by another thread, while waiting for it) is always used.
+    """
+    with _CATALOG_LOCK:
+        index = _CATALOG.get(key)
+        if index is not None and loaded_after is not None and index.loaded_at >= loaded_after:
+            _CATALOG_STATS['hits'] += 1
+            return index.find(name, item_id)
+        if fresh or index is None or index.loaded_at + CATALOG_TTL_SECS < time.time():
+            return None
+        items = index.find(name, item_id)
+        if not items and (name is not None or item_id is not None):
+            if loaded_after is None:
+                _CATALOG_STATS['refreshes_on_miss'] += 1
+            return None
+        _CATALOG_STATS['hits'] += 1
+        return items
+
+
+def _catalog_find(kind, name=None, item_id=None, org=None, fresh=False):
+    """
+    Return the catalog items of the kind matching the name or id (all the items if neither is given). The catalog is
+    loaded if missing, expired or fresh=True, and refreshed once if a name or id is not found in a cached index.
+    Only the lookups of the same kind wait for a listing in progress, and then use its result if it is enough.
+    """
+    key = _catalog_key(kind, org)
+    requested_at = time.time()
+    items = _find_cached(key, name, item_id, fresh)
+    if items is not None:
+        return items
+    with _CATALOG_LOCK:
+        load_lock = _CATALOG_LOAD_LOCKS.setdefault(key, threading.RLock())
+    with load_lock:
+        items = _find_cached(key, name, item_id, fresh, loaded_after=requested_at)
+        if items is not None:
+            return items
+        return _load_catalog(kind, org).find(name, item_id)
+
+
+def _catalog_update(kind, add=None, remove_id=None, org=None):
+    global _CATALOG_EPOCH
+    with _CATALOG_LOCK:
+        _CATALOG_EPOCH += 1
+        index = _CATALOG.get(_catalog_key(kind, org))
+        if index is not None:
+            if remove_id is not None:
+                index.remove(remove_id)
+            if add is not None:
+                index.add(add)
+            _CATALOG_STATS['updates'] += 1
+
+
+def _catalog_record_created(kind, resp):
+    """Add the object returned by a create call to the catalog or, if the response does not describe it, invalidate."""
+    with _CATALOG_LOCK:
+        index = _CATALOG.get(_catalog_key(kind))
+        if index is None:
+            return
+        try:
+            item = resp.json()
+        except ValueError:
+            item = None
+        if isinstance(item, dict) and index.id_attr in item and index.name_attr in item:
+            _catalog_update(kind, add=item)
+        else:
+            invalidate_catalog(kind)
 
 
-def is_csa16_or_later():
-    return _get_csa_version() >= [1, 6]
+def invalidate_catalog(*kinds):
+    """Discard the given kinds ('providers', 'tables', 'udfs', 'jobs') of the SSB catalog, or all if none is given."""
+    global _CATALOG_EPOCH
+    with _CATALOG_LOCK:
+        _CATALOG_EPOCH += 1
+        for key in list(_CATALOG):
+            if not kinds or key.split(':')[0] in kinds:
+                del _CATALOG[key]
+                _CATALOG_STATS['invalidations'] += 1
 
 
-def is_csa17_or_later():
-    return _get_csa_version() >= [1, 7]
-
+def get_catalog_stats():
+    """Return the SSB catalog statistics. Each hit is a listing call saved."""
+    with _CATALOG_LOCK:
+        stats = dict(_CATALOG_STATS)
+        stats['listing_calls_saved'] = stats['hits']
+        return stats
 
-def is_csa19_or_later():
-    return _get_csa_version() >= [1, 9]
 
+tracing.register_report_section('ssb_catalog', get_catalog_stats)
 
-def is_csa110_or_later():
-    return _get_csa_version() >= [1, 10]
 
-
-def is_ssb_installed():
-    return len(cm.get_services('SQL_STREAM_BUILDER')) > 0
+def _delete_catalog_item(kind, path, item_id, api_type, token=False, org=None):
+    try:
+        _api_delete('{}/{}'.format(path, item_id), api_type=api_type, token=token)
+    except RuntimeError:
+        # the cached item may be stale
+        invalidate_catalog(kind)
+        raise
+    _catalog_update(kind, remove_id=item_id, org=org)
 
 
 def create_data_provider(provider_name, provider_type, properties, custom_truststore=True):
-    if is_csa16_or_later():
-        provider_type_attr = 'type'
-    else:
-        provider_type_attr = 'provider_type'
+    profile = get_api_profile()
     data = {
         'name': provider_name,
-        provider_type_attr: provider_type,
+        profile.provider_type_attr: provider_type,
         'properties': properties,
     }
-    if is_csa110_or_later():
+    if profile.custom_truststore:
         data['custom_truststore'] = custom_truststore
-    return _api_post(_data_source_path(), data, api_type=_data_source_endpoint(), token=True)
+    resp = _api_post(profile.data_source_path, data, api_type=profile.data_source_endpoint, token=True)
+    _catalog_record_created('providers', resp)
+    return resp
 
 
-def get_data_providers(provider_name=None):
-    resp = _api_get(_data_source_path(), api_type=_data_source_endpoint())
-    if is_csa16_or_later():
-        providers = resp.json()
-    else:
-        providers = resp.json()['data']['providers']
-    return [p for p in providers if provider_name is None or p['name'] == provider_name]
+def get_data_providers(provider_name=None, fresh=False):
+    return _catalog_find('providers', name=provider_name, fresh=fresh)
+
+
+def get_data_provider_id(provider_name):
+    providers = get_data_providers(provider_name)
+    if not providers:
+        raise RuntimeError('Data provider {} does not exist.'.format(provider_name))
+    return providers[0][get_api_profile().data_source_id_attr]
 
 
 def delete_data_provider(provider_name):
     assert provider_name is not None
     for provider in get_data_providers(provider_name):
-        _api_delete('{}/{}'.format(_data_source_path(), provider[_data_source_id_attr()]), api_type=_data_source_endpoint(), token=True)
+        _delete_data_provider(provider)
 
 
-def delete_all_data_providers():
-    for provider in get_data_providers():
-        delete_data_provider(provider['name'])
+def _delete_data_provider(provider):
+    profile = get_api_profile()
+    _delete_catalog_item('providers', profile.data_source_path, provider[profile.data_source_id_attr],
+                         profile.data_source_endpoint, token=True)
 
 
-def create_udf(name, description, input_types, output_type, code):
+def delete_all_data_providers():
+    for provider in get_data_providers(fresh=True):
+        _delete_data_provider(provider)
+
+
+def create_udf(name, description, input_types, output_type, code, language=UDF_LANGUAGE_JAVASCRIPT, jar_path=None):
+    """
+    Create a UDF. JavaScript and, from CSA 1.11, Python UDFs are stored by SSB, with code as their source.
+    Java UDFs (CSA 1.10 and later) are created as Flink catalog functions: code is the name of the class implementing
+    the function and jar_path the location of the JAR containing it, which must be reachable by Flink (e.g. in HDFS).
+    """
+    profile = get_api_profile()
+    if language == UDF_LANGUAGE_JAVA:
+        if not profile.java_functions:
+            raise RuntimeError('Java UDFs are only supported for CSA 1.10 and later.')
+        if jar_path is None:
+            raise RuntimeError('A jar_path is required to create the Java UDF {}.'.format(name))
+        return execute_sql("CREATE FUNCTION IF NOT EXISTS {} AS '{}' LANGUAGE JAVA USING JAR '{}'".format(
+            name, code, jar_path), job_name='create_function_{}'.format(name.lower()))
+    if language not in profile.udf_languages:
+        raise RuntimeError('{} UDFs are not supported by CSA {}.'.format(
+            language, '.'.join(str(v) for v in profile.csa_version)))
     data = {
         'name': name,
         'description': description,
-        'language': 'JavaScript',
+        'language': language,
         'input_types': input_types,
         'output_type': output_type,
         'code': code,
     }
-    return _api_post(_udf_path(), data, api_type=_udf_endpoint(), token=True)
+    resp = _api_post(profile.udf_path, data, api_type=profile.udf_endpoint, token=True)
+    _catalog_record_created('udfs', resp)
+    return resp
 
 
-def get_udfs(udf_name=None):
-    resp = _api_get(_udf_path(), api_type=_udf_endpoint())
-    return [f for f in resp.json() if udf_name is None or f['name'].upper() == udf_name.upper()]
+def drop_function(name):
+    """Drop a Flink catalog function, like the Java UDFs created by create_udf()."""
+    return execute_sql('DROP FUNCTION IF EXISTS {}'.format(name), job_name='drop_function_{}'.format(name.lower()))
+
+
+def get_udfs(udf_name=None, fresh=False):
+    return _catalog_find('udfs', name=udf_name, fresh=fresh)
 
 
 def delete_udf(udf_name=None, udf_id=None):
@@ -367,21 +536,22 @@ def delete_udf(udf_name=None, udf_id=None):
         if not udf:
             return
         udf_id = udf[0]['id']
-    _api_delete('{}/{}'.format(_udf_path(), udf_id), api_type=_udf_endpoint())
+    profile = get_api_profile()
+    _delete_catalog_item('udfs', profile.udf_path, udf_id, profile.udf_endpoint)
 
 
 def delete_all_udfs():
-    for udf in get_udfs():
+    for udf in get_udfs(fresh=True):
         delete_udf(udf_id=udf['id'])
 
 
 def detect_schema(provider_name, topic_name):
-    provider_id = get_data_providers(provider_name)[0][_data_source_id_attr()]
-    if is_csa16_or_later():
-        raw_json = _api_get('/internal/kafka/{}/schema?topic_name={}'.format(provider_id, topic_name)).text
-        return json.dumps(json.loads(raw_json), indent=2)
-    else:
-        return json.dumps(_api_get('/dataprovider-endpoints/kafkaSample/{}/{}'.format(provider_id, topic_name)).json()['data'], indent=2)
+    profile = get_api_profile()
+    provider_id = get_data_provider_id(provider_name)
+    schema = _api_get(profile.schema_detection_path.format(provider_id, topic_name)).json()
+    if profile.wrapped_responses:
+        schema = schema['data']
+    return json.dumps(schema, indent=2)
 
 
 def create_kafka_table(table_name, table_format, provider_name, topic_name, schema=None, transform_code=None,
@@ -389,7 +559,8 @@ def create_kafka_table(table_name, table_format, provider_name, topic_name, sche
                        kafka_properties=None):
     assert table_format in ['JSON', 'AVRO']
     assert table_format == 'JSON' or schema is not None
-    provider_id = get_data_providers(provider_name)[0][_data_source_id_attr()]
+    profile = get_api_profile()
+    provider_id = get_data_provider_id(provider_name)
     if table_format == 'JSON' and schema is None:
         schema = detect_schema(provider_name, topic_name)
     data = {
@@ -409,34 +580,29 @@ def create_kafka_table(table_name, table_format, provider_name, topic_name, sche
             "schema": schema,
         }
     }
-    return _api_post(_tables_path(), data, api_type=_tables_endpoint(), token=True)
+    resp = _api_post(profile.tables_path, data, api_type=profile.tables_endpoint, token=True)
+    # the tables tree groups tables by catalog and organization, which the response does not tell
+    invalidate_catalog('tables')
+    return resp
 
 
-def get_tables(table_name=None, org='ssb_default'):
-    resp = _api_get(_tables_tree_path(), api_type=_tables_tree_endpoint())
-    if is_csa16_or_later():
-        data = resp.json()
-        assert 'tables' in data
-        if 'ssb' in data['tables'] and org in data['tables']['ssb']:
-            tables = data['tables']['ssb'][org]
-        else:
-            tables = []
-    else:
-        tables = resp.json()['data']
-    return [t for t in tables if table_name is None or t['table_name'] == table_name]
+def get_tables(table_name=None, org='ssb_default', fresh=False):
+    return _catalog_find('tables', name=table_name, org=org, fresh=fresh)
 
 
-def delete_table(table_name):
+def delete_table(table_name, org='ssb_default'):
     assert table_name is not None
-    for table in get_tables(table_name):
-        _api_delete('{}/{}'.format(_tables_path(), table['id']), api_type=_tables_endpoint(), token=True)
+    profile = get_api_profile()
+    for table in get_tables(table_name, org=org):
+        _delete_catalog_item('tables', profile.tables_path, table['id'], profile.tables_endpoint, token=True, org=org)
 
 
 def execute_sql(stmt, job_name=None, execution_mode='SESSION', parallelism=None, sample_interval_millis=None, savepoint_path=None,
                 start_with_savepoint=None):
     if not job_name:
         job_name = 'job_{}_{}'.format(uuid.uuid1().hex[0:4], int(1000000*time.time()))
-    if is_csa19_or_later():
+    profile = get_api_profile()
+    if profile.sql_dialect == _SQL_DIALECT_JOB_CONFIG:
         data = {
             'sql': stmt,
             'job_config': {
@@ -474,12 +640,23 @@ def execute_sql(stmt, job_name=None, execution_mode='SESSION', parallelism=None,
         'Accept': 'application/json',
         'Content-Type': 'application/json',
     }
-    return _api_post(_sql_execute_path(), data, headers=headers, api_type=_API_EXTERNAL)
-
-
-def get_jobs(job_id=None, job_name=None, state=None):
-    resp = _api_get(_job_path(), api_type=_API_EXTERNAL)
-    return [j for j in resp.json()['jobs']
+    try:
+        return _api_post(profile.sql_execute_path, data, headers=headers, api_type=_API_EXTERNAL)
+    finally:
+        # statements can create jobs and tables (DDL)
+        invalidate_catalog('jobs', 'tables')
+
+
+def get_jobs(job_id=None, job_name=None, state=None, fresh=False):
+    """
+    Return the jobs matching the given criteria. The job states change outside of our control, so filtering by state
+    always lists the jobs again; otherwise the jobs come from the catalog and their state may be outdated.
+    """
+    if state is not None:
+        jobs = _load_catalog('jobs').find()
+    else:
+        jobs = _catalog_find('jobs', name=job_name, item_id=job_id, fresh=fresh)
+    return [j for j in jobs
             if (state is None or j['state'] == state)
             and (job_id is None or j['job_id'] == job_id)
             and (job_name is None or j['name'] == job_name)]
@@ -500,61 +677,316 @@ def _get_job(job_name=None, job_id=None, attr=None):
     return None
 
 
-def stop_job(job_name=None, job_id=None, savepoint=False, savepoint_path=None, timeout=1000, wait_secs=0):
-    assert job_name is not None or job_id is not None
-    assert job_name is None or job_id is None
+class JobWatcher(object):
+    """
+    Tracks jobs until they stop running, listing the running jobs once per interval for all of them. Each job has its
+    own deadline, counted from the moment it is watched. wait() returns a result per job with its status ('stopped'
+    or 'timed_out') and the latency between the start of the watch and the first listing without the job.
+    """
+
+    def __init__(self, interval_secs=JOB_WATCH_INTERVAL_SECS):
+        self.interval_secs = interval_secs
+        self.results = OrderedDict()  # job key -> result dict
+
+    @staticmethod
+    def _key(job):
+        return job['job_id'] if get_api_profile().job_ref_attr == 'job_id' else job['name']
+
+    def watch(self, job, timeout_secs=STOP_JOB_TIMEOUT_SECS):
+        now = time.time()
+        result = {'job_id': job.get('job_id'), 'name': job.get('name'), 'status': 'running', 'start': now,
+                  'deadline': now + timeout_secs, 'latency_secs': None}
+        self.results[self._key(job)] = result
+        return result
+
+    def _pending(self):
+        return [r for r in self.results.values() if r['status'] == 'running']
+
+    def _check(self):
+        running = set(self._key(j) for j in get_jobs(state=JOB_RUNNING_STATE))
+        now = time.time()
+        for key, result in self.results.items():
+            if result['status'] != 'running':
+                continue
+            if key not in running:
+                result['status'] = 'stopped'
+                result['latency_secs'] = round(now - result['start'], 3)
+            elif now > result['deadline']:
+                result['status'] = 'timed_out'
+        return not self._pending()
+
+    def wait(self, raise_on_timeout=True):
+        pending = self._pending()
+        if pending:
+            timeout_secs = max(r['deadline'] for r in pending) - time.time() + self.interval_secs
+            polling.poll(self._check, timeout_secs=timeout_secs, initial_interval_secs=self.interval_secs,
+                         max_interval_secs=self.interval_secs, backoff_factor=1.0, raise_on_timeout=False,
+                         name='ssb.JobWatcher')
+            for result in self._pending():
+                result['status'] = 'timed_out'
+        with _JOB_STOPS_LOCK:
+            _JOB_STOPS.extend(self.results.values())
+        timed_out = [r['name'] or r['job_id'] for r in self.results.values() if r['status'] == 'timed_out']
+        if timed_out and raise_on_timeout:
+            raise RuntimeError('Jobs did not stop in time: {}'.format(', '.join(str(j) for j in timed_out)))
+        return list(self.results.values())
+
+
+def summarize_stops(results):
+    """Return the number of jobs stopped and timed out and the minimum, average and maximum stop latencies."""
+    latencies = [r['latency_secs'] for r in results if r['status'] == 'stopped']
+    return {
+        'jobs': len(results),
+        'stopped': len(latencies),
+        'timed_out': len([r for r in results if r['status'] == 'timed_out']),
+        'min_latency_secs': min(latencies) if latencies else None,
+        'avg_latency_secs': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'max_latency_secs': max(latencies) if latencies else None,
+    }
+
+
+def get_job_stop_stats():
+    with _JOB_STOPS_LOCK:
+        return summarize_stops(_JOB_STOPS)
+
+
+tracing.register_report_section('ssb_job_stops', get_job_stop_stats)
+
+
+def _post_stop(job, savepoint=False, savepoint_path=None, timeout=1000):
     data = {
         'savepoint': savepoint,
         'savepoint_path': savepoint_path,
         'timeout': timeout,
     }
-    if is_csa19_or_later():
-        job_id = job_id or _get_job(job_name=job_name, attr='job_id')
-        path = '{}/{}/stop'.format(_job_path(), job_id)
-    else:
-        job_name = job_name or _get_job(job_id=job_id, attr='name')
-        path = '{}/{}/stop'.format(_job_path(), job_name)
-    resp = _api_post(path, api_type=_API_EXTERNAL, data=data)
-    while True:
-        jobs = get_jobs(state=JOB_RUNNING_STATE)
-        if not any((j['job_id'] == job_id or j['name'] == job_id) for j in jobs):
-            break
-        time.sleep(1)
+    profile = get_api_profile()
+    path = '{}/{}/stop'.format(profile.job_path, job[profile.job_ref_attr])
+    return _api_post(path, api_type=_API_EXTERNAL, data=data)
+
+
+def _savepoint_location(resp):
+    """
+    Return the location of the savepoint taken when stopping a job, if SSB returns it, or None. The requested path is
+    not a valid location: Flink writes the savepoint in a savepoint-<job id>-<suffix> directory under it.
+    """
+    try:
+        data = resp.json()
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        for attr in ['savepoint_path', 'savepoint_location', 'location']:
+            if data.get(attr):
+                return data[attr]
+    return None
 
+
+def stop_jobs(jobs, savepoint=False, savepoint_path=None, timeout=1000, wait_secs=0,
+              timeout_secs=STOP_JOB_TIMEOUT_SECS, raise_on_timeout=True):
+    """
+    Request all the jobs to stop and then wait for them together. Return the watch results (see JobWatcher).
+    savepoint_path can be a function returning the path for each job; with savepoint=True, the results include the
+    requested path (savepoint_dir) and the savepoint location, if SSB returns it (savepoint_path). The wait_secs
+    sleep, to let the jobs release resources like replication slots, happens once, after all of them stopped.
+    """
+    watcher = JobWatcher()
+    for job in jobs:
+        path = savepoint_path(job) if callable(savepoint_path) else savepoint_path
+        resp = _post_stop(job, savepoint=savepoint, savepoint_path=path, timeout=timeout)
+        result = watcher.watch(job, timeout_secs=timeout_secs)
+        if savepoint:
+            result['savepoint_dir'] = path
+            result['savepoint_path'] = _savepoint_location(resp)
+    results = watcher.wait(raise_on_timeout=raise_on_timeout)
+    if results:
+        LOG.debug('SSB jobs stopped: %s', summarize_stops(results))
+        time.sleep(wait_secs)
+    return results
+
+
+def _resolve_job(job_name=None, job_id=None):
+    assert job_name is not None or job_id is not None
+    assert job_name is None or job_id is None
+    job = _get_job(job_name=job_name, job_id=job_id)
+    if job is None:
+        raise RuntimeError('Job {} does not exist.'.format(job_name or job_id))
+    return job
+
+
+def stop_job(job_name=None, job_id=None, savepoint=False, savepoint_path=None, timeout=1000, wait_secs=0):
+    job = _resolve_job(job_name=job_name, job_id=job_id)
+    resp = _post_stop(job, savepoint=savepoint, savepoint_path=savepoint_path, timeout=timeout)
+    watcher = JobWatcher()
+    watcher.watch(job)
+    watcher.wait()
     # additional wait in case we need to ensure the release of resources, like replication slots
     time.sleep(wait_secs)
-
     return resp
 
 
+def delete_jobs(jobs, wait_secs=0, timeout_secs=STOP_JOB_TIMEOUT_SECS):
+    """Stop the running jobs among the given ones, wait for all of them together and then delete all the jobs."""
+    running = set(j['job_id'] for j in get_jobs(state=JOB_RUNNING_STATE))
+    results = stop_jobs([j for j in jobs if j['job_id'] in running], wait_secs=wait_secs, timeout_secs=timeout_secs)
+    profile = get_api_profile()
+    for job in jobs:
+        _delete_catalog_item('jobs', profile.delete_job_path, job['job_id'], profile.delete_job_endpoint)
+    return results
+
+
 def delete_job(job_name=None, job_id=None, wait_secs=0):
-    assert job_name is not None or job_id is not None
-    assert job_name is None or job_id is None
-    stop_job(job_name=job_name, job_id=job_id, wait_secs=wait_secs)
-    job_id = job_id or _get_job(job_name=job_name, attr='job_id')
-    _api_delete('{}/{}'.format(_delete_job_path(), job_id), api_type=_delete_job_endpoint())
+    delete_jobs([_resolve_job(job_name=job_name, job_id=job_id)], wait_secs=wait_secs)
 
 
 def stop_all_jobs(delete=False, wait_secs=0):
-    for job in get_jobs(state=JOB_RUNNING_STATE):
-        stop_job(job_id=job['job_id'], wait_secs=wait_secs)
+    return stop_jobs(get_jobs(state=JOB_RUNNING_STATE), wait_secs=wait_secs)
 
 
 def delete_all_jobs(delete=False, wait_secs=0):
-    for job in get_jobs():
-        delete_job(job_id=job['job_id'], wait_secs=wait_secs)
+    return delete_jobs(get_jobs(fresh=True), wait_secs=wait_secs)
+
+
+def get_sample_id(resp=None, job_name=None):
+    """Return the id of the results sample of a job, from the execute_sql() response or from the job listing."""
+    assert resp is not None or job_name is not None
+    if resp is not None:
+        data = resp.json()
+        sample_id = data.get('sample_id') or data.get('job_config', {}).get('sample_id')
+        if sample_id:
+            return sample_id
+        job_name = job_name or data.get('job_name') or data.get('job_config', {}).get('job_name')
+    job = _get_job(job_name=job_name) if job_name else None
+    return job.get('sample_id') if job else None
+
+
+class ResultSampler(object):
+    """
+    Iterates over the sample rows of a running job. A background thread fetches the samples and feeds a queue of at
+    most buffer_rows rows; when the consumer falls behind, the fetching pauses. The iteration ends after max_rows rows,
+    after max_secs seconds or when SSB reports the end of the samples, whichever comes first.
+
+    The samples endpoint (GET /samples/<id> of the SSB REST API) is assumed to return the rows produced since the
+    previous request, as a list or in a 'records' attribute, and to set 'end_of_samples' when the job is done.
+    SSB versions without it (before CSA 1.9) yield no rows: the iteration then only waits for max_secs. If fetching
+    the samples fails, the iteration also waits for the rest of max_secs and then raises the error.
+
+    Example:
+        sampler = ssb.ResultSampler(ssb.get_sample_id(resp), max_rows=100, max_secs=30)
+        for row in sampler:
+            ...
+        print(sampler.stats())
+    """
+
+    _END = object()
+
+    def __init__(self, sample_id, max_rows=None, max_secs=None, buffer_rows=SAMPLE_BUFFER_ROWS,
+                 interval_secs=SAMPLE_POLL_INTERVAL_SECS):
+        self.sample_id = sample_id
+        self.max_rows = max_rows
+        self.max_secs = max_secs
+        self.interval_secs = interval_secs
+        self.rows = 0
+        self.fetches = 0
+        self.start = None
+        self.end = None
+        self._queue = queue.Queue(maxsize=buffer_rows)
+        self._stop_event = threading.Event()
+        self._error = None
+
+    def _fetch(self):
+        self.fetches += 1
+        data = _api_get('{}/{}'.format(get_api_profile().sample_path, self.sample_id), api_type=_API_EXTERNAL).json()
+        if isinstance(data, list):
+            return data, False
+        return data.get('records') or [], bool(data.get('end_of_samples'))
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=self.interval_secs)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        available = False
+        try:
+            available = get_api_profile().sample_path is not None and self.sample_id is not None
+            if not available:
+                return
+            while not self._stop_event.is_set():
+                records, finished = self._fetch()
+                for record in records:
+                    if not self._put(json.loads(record) if isinstance(record, str) else record):
+                        return
+                if finished:
+                    break
+                self._stop_event.wait(self.interval_secs)
+        except Exception as exc:
+            self._error = exc
+        finally:
+            # without samples, the iteration still waits for max_secs, if given, as the wait it replaces did
+            if (available and self._error is None) or self.max_secs is None:
+                self._put(self._END)
+
+    def __iter__(self):
+        self.start = time.time()
+        deadline = self.start + self.max_secs if self.max_secs is not None else None
+        thread = threading.Thread(target=self._run, name='ssb-sampler', daemon=True)
+        thread.start()
+        try:
+            while self.max_rows is None or self.rows < self.max_rows:
+                timeout = self.interval_secs if deadline is None else deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                if item is self._END:
+                    break
+                self.rows += 1
+                yield item
+        finally:
+            self._stop_event.set()
+            thread.join()
+            self.end = time.time()
+            LOG.debug('SSB sample %s: %s', self.sample_id, self.stats())
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def secs(self):
+        if self.start is None:
+            return 0.0
+        return (self.end or time.time()) - self.start
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.secs if self.secs > 0 else 0.0
+
+    def stats(self):
+        return {'rows': self.rows, 'secs': round(self.secs, 3), 'rows_per_sec': round(self.rows_per_sec, 3),
+                'fetches': self.fetches}
+
+
+def sample_results(resp=None, job_name=None, max_rows=None, max_secs=None, buffer_rows=SAMPLE_BUFFER_ROWS):
+    """Return a ResultSampler of the job launched by execute_sql() (given its response or the job name)."""
+    return ResultSampler(get_sample_id(resp=resp, job_name=job_name), max_rows=max_rows, max_secs=max_secs,
+                         buffer_rows=buffer_rows)
 
 
 def upload_keytab(principal, keytab_file):
     global _SSB_CSRF_TOKEN
-    if is_csa17_or_later():
+    profile = get_api_profile()
+    if profile.basic_auth_login:
         data = {
             'principal': principal,
         }
         files = {'file': (os.path.basename(keytab_file), open(keytab_file, 'rb'), 'application/octet-stream')}
 
         try:
-            _api_post(_keytab_upload_path(), api_type=_keytab_upload_endpoint(), data=data, files=files)
+            _api_post(profile.keytab_upload_path, api_type=profile.keytab_upload_endpoint, data=data, files=files)
         except RuntimeError as exc:
             if exc.args and 'Keytab already exists' in exc.args[0]:
                 return
@@ -565,16 +997,19 @@ def upload_keytab(principal, keytab_file):
             'csrf_token': _SSB_CSRF_TOKEN,
         }
         files = {'keytab_file': (os.path.basename(keytab_file), open(keytab_file, 'rb'), 'application/octet-stream')}
-        _api_post('/keytab/upload', api_type=_keytab_upload_endpoint(), data=data, files=files, token=True)
+        _api_post(profile.keytab_upload_path, api_type=profile.keytab_upload_endpoint, data=data, files=files, token=True)
 
 
 def generate_keytab(principal, password):
+    profile = get_api_profile()
+    if profile.keytab_generate_path is None:
+        raise RuntimeError('This feature is only implemented for CSA 1.7 and later.')
     data = {
         'principal': principal,
         'password': password,
     }
     try:
-        _api_post(_keytab_generate_path(), api_type=_keytab_generate_endpoint(), data=data)
+        _api_post(profile.keytab_generate_path, api_type=profile.keytab_generate_endpoint, data=data)
     except RuntimeError as exc:
         if exc.args and 'Keytab already exists' in exc.args[0]:
             return
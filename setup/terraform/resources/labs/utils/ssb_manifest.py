@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Declarative provisioning of SSB objects.
+
+A manifest (a dict, or a JSON/YAML file) describes the data providers, Kafka tables, UDFs, DDL scripts and jobs of
+an environment:
+
+    providers:
+      - name: edge2ai-kafka
+        type: kafka
+        properties: {brokers: 'host:9092', protocol: plaintext}
+      - name: sr
+        type: catalog
+        properties: {catalog_type: registry, kafka.provider.id: '${provider:edge2ai-kafka}', ...}
+    tables:
+      - name: iot_enriched
+        provider: edge2ai-kafka
+        topic: iot_enriched
+        format: JSON
+    udfs:
+      - name: HAVETOKM
+        input_types: [DECIMAL, DECIMAL, DECIMAL, DECIMAL]
+        output_type: DECIMAL
+        code: ...
+        language: JavaScript            # or Python; Java UDFs take the class name as code and a jar_path
+    ddl:
+      - name: create_tables
+        sql: CREATE TABLE ...
+        tables: [transactions]          # tables created by the script; it runs only if one of them is missing
+    jobs:
+      - name: fraud_detection_job
+        sql: INSERT INTO ...
+        requires: [transactions, HAVETOKM]
+
+plan() compares the manifest with the current SSB state and returns only the operations needed: objects that are
+missing are created, UDFs and providers whose definition changed and jobs that are not running the same SQL (ignoring
+whitespace) are replaced, and, with prune=True, objects that are not in the manifest are deleted. apply() executes
+the operations in dependency order, each one as soon as the operations it depends on are completed, with at most
+aio.SERVICE_CONCURRENCY['ssb'] of them at a time: the SSB client shares one session (and, in older versions, one CSRF
+token) across threads. Unless the requires attribute says otherwise, providers come first, then Kafka tables (after
+their provider) and DDL scripts, and jobs come last.
+
+Tables, including those created by DDL scripts, are only matched by name: a table whose definition changed in the
+manifest is not updated. To change it, delete the table and apply the manifest again.
+"""
+import json
+import re
+from collections import namedtuple
+
+from . import *
+from . import aio, ssb
+from .ssb_savepoints import sql_hash
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+KINDS = ['providers', 'tables', 'udfs', 'ddl', 'jobs']
+
+# String values of provider properties of the form ${provider:<name>} are replaced with the id of the named provider
+_PROVIDER_REF_REGEX = r'^\$\{provider:([^}]+)\}$'
+
+_KAFKA_TABLE_ARGS = ['schema', 'transform_code', 'timestamp_column', 'rowtime_column', 'watermark_seconds',
+                     'kafka_properties']
+_EXECUTE_SQL_ARGS = ['execution_mode', 'parallelism', 'sample_interval_millis', 'savepoint_path',
+                     'start_with_savepoint']
+
+Operation = namedtuple('Operation', ['action', 'kind', 'name', 'requires', 'func'])
+
+
+def load_manifest(path):
+    """Load a manifest from a JSON or, if PyYAML is installed, a YAML file."""
+    with open(path) as manifest_file:
+        if path.endswith('.json'):
+            manifest = json.load(manifest_file)
+        elif yaml is None:
+            raise RuntimeError('PyYAML must be installed to load the manifest {}.'.format(path))
+        else:
+            manifest = yaml.safe_load(manifest_file)
+    unknown = set(manifest) - set(KINDS)
+    if unknown:
+        raise RuntimeError('Unknown sections in manifest {}: {}'.format(path, ', '.join(sorted(unknown))))
+    return manifest
+
+
+def _provider_refs(properties):
+    refs = []
+    for value in properties.values():
+        if isinstance(value, str):
+            match = re.match(_PROVIDER_REF_REGEX, value)
+            if match:
+                refs.append(match.groups()[0])
+    return refs
+
+
+def _resolve_provider_refs(properties):
+    resolved = {}
+    for key, value in properties.items():
+        match = re.match(_PROVIDER_REF_REGEX, value) if isinstance(value, str) else None
+        resolved[key] = ssb.get_data_provider_id(match.groups()[0]) if match else value
+    return resolved
+
+
+def _create_provider(spec):
+    ssb.create_data_provider(spec['name'], spec['type'], _resolve_provider_refs(spec.get('properties', {})),
+                             custom_truststore=spec.get('custom_truststore', True))
+
+
+def _create_table(spec):
+    kwargs = {arg: spec[arg] for arg in _KAFKA_TABLE_ARGS if arg in spec}
+    ssb.create_kafka_table(spec['name'], spec.get('format', 'JSON'), spec['provider'], spec['topic'], **kwargs)
+
+
+def _create_udf(spec):
+    ssb.create_udf(spec['name'], spec.get('description', ''), spec['input_types'], spec['output_type'], spec['code'],
+                   language=spec.get('language', ssb.UDF_LANGUAGE_JAVASCRIPT), jar_path=spec.get('jar_path'))
+
+
+def _execute(spec):
+    kwargs = {arg: spec[arg] for arg in _EXECUTE_SQL_ARGS if arg in spec}
+    ssb.execute_sql(spec['sql'], job_name=spec['name'], **kwargs)
+
+
+def _delete_job(job_id):
+    ssb.delete_job(job_id=job_id)
+
+
+def _udf_changed(spec, udf):
+    """Compare the attributes returned by SSB; those that are not returned are assumed to be unchanged."""
+    input_types = [t.upper() for t in udf.get('input_types', spec['input_types'])]
+    return (spec['code'] != udf.get('code', spec['code'])
+            or [t.upper() for t in spec['input_types']] != input_types
+            or spec['output_type'].upper() != udf.get('output_type', spec['output_type']).upper())
+
+
+def _provider_changed(spec, provider):
+    current_type = provider.get(ssb.get_api_profile().provider_type_attr)
+    return current_type is not None and current_type != spec['type']
+
+
+def _get_requires(manifest, kind, spec):
+    """Return the (kind, name) keys of the manifest objects the spec depends on."""
+    names = {k: [s['name'] for s in manifest.get(k, [])] for k in KINDS}
+    if 'requires' in spec:
+        # tables created by a DDL script are provided by the script
+        keys_by_name = {}
+        for k in KINDS:
+            for name in names[k]:
+                keys_by_name.setdefault(name, []).append((k, name))
+        for ddl in manifest.get('ddl', []):
+            for table_name in ddl.get('tables', []):
+                keys_by_name.setdefault(table_name, []).append(('ddl', ddl['name']))
+        requires = []
+        for name in spec['requires']:
+            if name not in keys_by_name:
+                raise RuntimeError('{} {} requires {}, which is not in the manifest.'.format(kind, spec['name'], name))
+            requires.extend(keys_by_name[name])
+    elif kind == 'tables':
+        requires = [('providers', spec['provider'])] if spec['provider'] in names['providers'] else []
+    elif kind == 'ddl':
+        requires = [('providers', name) for name in names['providers']]
+    elif kind == 'jobs':
+        requires = [(k, name) for k in ['tables', 'udfs', 'ddl'] for name in names[k]]
+    else:
+        requires = []
+    if kind == 'providers':
+        requires += [('providers', name) for name in _provider_refs(spec.get('properties', {}))
+                     if name in names['providers']]
+    return requires
+
+
+def plan(manifest, prune=False):
+    """Return the operations needed to bring SSB to the state described by the manifest."""
+    ops = []
+
+    def _add(action, kind, spec, func):
+        ops.append(Operation(action, kind, spec['name'], _get_requires(manifest, kind, spec), func))
+
+    providers = {p['name']: p for p in ssb.get_data_providers()}
+    for spec in manifest.get('providers', []):
+        current = providers.get(spec['name'])
+        if current is None:
+            _add('create', 'providers', spec, lambda s=spec: _create_provider(s))
+        elif _provider_changed(spec, current):
+            _add('replace', 'providers', spec,
+                 lambda s=spec: (ssb.delete_data_provider(s['name']), _create_provider(s)))
+
+    tables = set(t['table_name'] for t in ssb.get_tables())
+    for spec in manifest.get('tables', []):
+        if spec['name'] not in tables:
+            _add('create', 'tables', spec, lambda s=spec: _create_table(s))
+
+    udfs = {u['name'].upper(): u for u in ssb.get_udfs()}
+    for spec in manifest.get('udfs', []):
+        current = udfs.get(spec['name'].upper())
+        if current is None:
+            _add('create', 'udfs', spec, lambda s=spec: _create_udf(s))
+        elif _udf_changed(spec, current):
+            _add('replace', 'udfs', spec, lambda s=spec: (ssb.delete_udf(s['name']), _create_udf(s)))
+
+    for spec in manifest.get('ddl', []):
+        if not spec.get('tables') or set(spec['tables']) - tables:
+            _add('execute', 'ddl', spec, lambda s=spec: _execute(s))
+
+    jobs = {}
+    for job in ssb.get_jobs(fresh=True):
+        jobs.setdefault(job['name'], []).append(job)
+    for spec in manifest.get('jobs', []):
+        current = jobs.get(spec['name'], [])
+        # SSB may not return the statements exactly as they were submitted
+        if any(j['state'] == ssb.JOB_RUNNING_STATE and sql_hash(j.get('sql', spec['sql'])) == sql_hash(spec['sql'])
+               for j in current):
+            continue
+        if current:
+            _add('replace', 'jobs', spec,
+                 lambda s=spec, ids=[j['job_id'] for j in current]: ([_delete_job(i) for i in ids], _execute(s)))
+        else:
+            _add('execute', 'jobs', spec, lambda s=spec: _execute(s))
+
+    if prune:
+        _add_prune_operations(manifest, ops, providers, tables, udfs, jobs)
+    return ops
+
+
+def _add_prune_operations(manifest, ops, providers, tables, udfs, jobs):
+    """Add the deletion of the objects not in the manifest, jobs first and providers last."""
+    wanted = {k: set(s['name'] for s in manifest.get(k, [])) for k in KINDS}
+    wanted['tables'].update(t for s in manifest.get('ddl', []) for t in s.get('tables', []))
+    job_deletes = [Operation('delete', 'jobs', name, [],
+                             lambda ids=[j['job_id'] for j in js]: [_delete_job(i) for i in ids])
+                   for name, js in jobs.items() if name not in wanted['jobs']]
+    after_jobs = [('jobs', op.name) for op in job_deletes]
+    table_deletes = [Operation('delete', 'tables', name, after_jobs, lambda n=name: ssb.delete_table(n))
+                     for name in tables if name not in wanted['tables']]
+    udf_deletes = [Operation('delete', 'udfs', u['name'], after_jobs, lambda n=u['name']: ssb.delete_udf(n))
+                   for key, u in udfs.items() if key not in set(n.upper() for n in wanted['udfs'])]
+    after_tables = after_jobs + [('tables', op.name) for op in table_deletes]
+    provider_deletes = [Operation('delete', 'providers', name, after_tables,
+                                  lambda n=name: ssb.delete_data_provider(n))
+                        for name in providers if name not in wanted['providers']]
+    ops.extend(job_deletes + table_deletes + udf_deletes + provider_deletes)
+
+
+def apply(manifest, prune=False, dry_run=False, max_workers=None):
+    """
+    Apply the manifest (a dict or the path of a manifest file) and return the operations executed, with their
+    durations. With dry_run=True, the operations are only planned. max_workers defaults to the concurrency cap of the
+    ssb service in aio.
+    """
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+    ops = plan(manifest, prune=prune)
+    for op in ops:
+        LOG.info('SSB manifest: %s %s %s', op.action, op.kind, op.name)
+    if dry_run or not ops:
+        return [(op, None) for op in ops]
+    if max_workers is None:
+        max_workers = aio.SERVICE_CONCURRENCY['ssb']
+    if not ssb.get_api_profile().basic_auth_login:
+        # older SSB versions keep a CSRF token per session, which concurrent calls would race for
+        max_workers = 1
+
+    parent_span = tracing.TRACER.current_span()
+
+    def _run(op):
+        with tracing.TRACER.activate(parent_span):
+            with tracing.TRACER.span('ssb_manifest', '{} {} {}'.format(op.action, op.kind, op.name)) as span:
+                op.func()
+            return span.secs
+
+    def _on_error(key, exc):
+        op = ops_by_key[key]
+        LOG.error('SSB manifest: %s of %s %s failed: %s', op.action, op.kind, op.name, exc)
+
+    # dependencies on objects that already exist (no operation planned) are satisfied
+    ops_by_key = OrderedDict(((op.kind, op.name), op) for op in ops)
+    secs = aio.run_graph(OrderedDict((key, (op.requires, lambda o=op: _run(o))) for key, op in ops_by_key.items()),
+                         max_workers=max_workers, on_error=_on_error, thread_name_prefix='ssb-manifest')
+    return [(ops_by_key[key], op_secs) for key, op_secs in secs.items()]
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Savepoint-based restart of SSB jobs across workshop resets.
+
+stop_with_savepoints() stops the named jobs with a savepoint in a per-run directory and records the latest savepoint
+of each job name in a state file next to the workshop state. execute_sql() starts a job from its latest savepoint if
+the SQL statement is the same (same hash, ignoring whitespace) as the one that was running when the savepoint was
+taken, so that the job does not need to reprocess its sources to rebuild its state. Otherwise, or if the restore is
+rejected or the restored job does not reach the RUNNING state, the job starts from scratch.
+
+Flink writes each savepoint in a savepoint-<job id>-<suffix> directory under the requested one. If SSB does not
+return the location of the savepoint, it is found by listing the requested directory (with the hdfs CLI of the
+cluster host); if it cannot be found, no savepoint is recorded.
+
+The savepoint directories must be reachable by Flink; set WORKSHOP_SSB_SAVEPOINT_DIR to change the default.
+"""
+import hashlib
+import json
+from subprocess import Popen, PIPE
+
+from . import *
+from . import ssb
+
+SAVEPOINT_DIR_ENV_VAR = 'WORKSHOP_SSB_SAVEPOINT_DIR'
+DEFAULT_SAVEPOINT_DIR = 'hdfs:///tmp/ssb-savepoints'
+STATE_FILE_NAME = '.ssb-savepoints.json'
+RESTORE_TIMEOUT_SECS = 120
+
+_SAVEPOINT_DIR_PREFIX = 'savepoint-'
+_SAVEPOINT_METADATA_FILE = '_metadata'
+# states of a job that will not reach RUNNING anymore
+_FINAL_JOB_STATES = ['FAILED', 'FAILING', 'CANCELED', 'CANCELLING', 'FINISHED', 'STOPPED']
+
+_STATE_LOCK = threading.RLock()
+
+
+def sql_hash(stmt):
+    return hashlib.sha256(' '.join(stmt.split()).encode('utf-8')).hexdigest()
+
+
+def _get_state_file_path():
+    return os.path.join(os.path.dirname(os.path.realpath(get_base_dir())), STATE_FILE_NAME)
+
+
+def _load_state():
+    path = _get_state_file_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except ValueError:
+        LOG.warning('Ignoring corrupted savepoint state file %s', path)
+        return {}
+
+
+def _save_state(state):
+    path = _get_state_file_path()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _update_job_state(job_name, **attrs):
+    with _STATE_LOCK:
+        state = _load_state()
+        state.setdefault(job_name, {}).update(attrs)
+        _save_state(state)
+
+
+def get_savepoint_dir(run_id, job_name):
+    base_dir = os.environ.get(SAVEPOINT_DIR_ENV_VAR, DEFAULT_SAVEPOINT_DIR).rstrip('/')
+    return '{}/{}/{}'.format(base_dir, run_id, job_name)
+
+
+def _execute_hdfs_cmd(args):
+    proc = Popen(['hdfs', 'dfs'] + args, stdout=PIPE, stderr=PIPE)
+    stdout, stderr = proc.communicate()
+    return proc.returncode, stdout.decode('utf-8', 'replace')
+
+
+def find_savepoint(savepoint_dir):
+    """
+    Return the path of the most recent complete savepoint (one with its metadata file) under the given directory, or
+    None if there is none or the directory cannot be listed.
+    """
+    try:
+        returncode, stdout = _execute_hdfs_cmd(['-ls', '-C', '-t', savepoint_dir])
+        if returncode != 0:
+            return None
+        paths = [line.strip() for line in stdout.splitlines()
+                 if os.path.basename(line.strip().rstrip('/')).startswith(_SAVEPOINT_DIR_PREFIX)]
+        for path in paths:
+            if _execute_hdfs_cmd(['-test', '-e', '{}/{}'.format(path, _SAVEPOINT_METADATA_FILE)])[0] == 0:
+                return path
+    except OSError as exc:
+        LOG.warning('Failed to list savepoint directory %s: %s', savepoint_dir, exc)
+    return None
+
+
+def get_latest_savepoint(job_name):
+    """Return the state of the job name (savepoint_path, sql_hash, run_id, taken_at) or None if it has no savepoint."""
+    with _STATE_LOCK:
+        job_state = _load_state().get(job_name)
+    return job_state if job_state and job_state.get('savepoint_path') else None
+
+
+def stop_with_savepoints(job_names, run_id=None, wait_secs=0, timeout_secs=ssb.STOP_JOB_TIMEOUT_SECS):
+    """
+    Stop the running jobs with the given names, each with a savepoint, and record the savepoints. This is a best
+    effort: failures are logged and the jobs that did not stop are left to the regular teardown. Return the stop
+    results (see ssb.stop_jobs()).
+    """
+    run_id = run_id if run_id is not None else get_run_id()
+    try:
+        jobs = [j for j in ssb.get_jobs(state=ssb.JOB_RUNNING_STATE) if j['name'] in job_names]
+        if not jobs:
+            return []
+        results = ssb.stop_jobs(jobs, savepoint=True, savepoint_path=lambda job: get_savepoint_dir(run_id, job['name']),
+                                wait_secs=wait_secs, timeout_secs=timeout_secs, raise_on_timeout=False)
+    except RuntimeError as exc:
+        LOG.warning('Failed to stop jobs %s with savepoints: %s', ', '.join(job_names), exc)
+        return []
+    sql_by_name = {j['name']: j.get('sql') for j in jobs}
+    for result in results:
+        if result['status'] != 'stopped':
+            LOG.warning('Job %s did not stop with a savepoint in time.', result['name'])
+            continue
+        path = result['savepoint_path'] or find_savepoint(result['savepoint_dir'])
+        if not path:
+            LOG.warning('No savepoint of job %s found in %s.', result['name'], result['savepoint_dir'])
+            continue
+        attrs = {'savepoint_path': path, 'run_id': str(run_id), 'taken_at': time.time()}
+        # the hash recorded by execute_sql() is kept: SSB may not return the statement exactly as it was submitted
+        if sql_by_name.get(result['name']) and not (_load_state().get(result['name']) or {}).get('sql_hash'):
+            attrs['sql_hash'] = sql_hash(sql_by_name[result['name']])
+        _update_job_state(result['name'], **attrs)
+        LOG.info('Savepoint of job %s: %s', result['name'], path)
+    return results
+
+
+def _wait_until_running(job_name, timeout_secs):
+    """Wait for the job to be running and return True, or return False if it fails or times out first."""
+    def _get_state():
+        jobs = ssb.get_jobs(job_name=job_name, fresh=True)
+        state = jobs[0]['state'] if jobs else None
+        return state if state == ssb.JOB_RUNNING_STATE or state in _FINAL_JOB_STATES else None
+
+    state = polling.poll(_get_state, timeout_secs=timeout_secs, initial_interval_secs=ssb.JOB_WATCH_INTERVAL_SECS,
+                         max_interval_secs=ssb.JOB_WATCH_INTERVAL_SECS, backoff_factor=1.0, raise_on_timeout=False,
+                         name='ssb_savepoints.restore')
+    return state == ssb.JOB_RUNNING_STATE
+
+
+def execute_sql(stmt, job_name, restore_timeout_secs=RESTORE_TIMEOUT_SECS, **kwargs):
+    """
+    Execute the statement (see ssb.execute_sql()) as the job job_name, restoring its latest savepoint if it was
+    taken with the same statement. If the restored job does not reach the RUNNING state within restore_timeout_secs,
+    it is deleted and the statement is executed again without the savepoint.
+    """
+    digest = sql_hash(stmt)
+    job_state = get_latest_savepoint(job_name)
+    resp = None
+    if job_state and job_state.get('sql_hash') == digest:
+        try:
+            resp = ssb.execute_sql(stmt, job_name=job_name, savepoint_path=job_state['savepoint_path'],
+                                   start_with_savepoint=True, **kwargs)
+        except RuntimeError as exc:
+            LOG.warning('Failed to restore job %s from savepoint %s, starting it from scratch: %s',
+                        job_name, job_state['savepoint_path'], exc)
+        if resp is not None:
+            if _wait_until_running(job_name, restore_timeout_secs):
+                LOG.info('Job %s restored from savepoint %s', job_name, job_state['savepoint_path'])
+            else:
+                LOG.warning('Job %s did not start from savepoint %s, starting it from scratch.',
+                            job_name, job_state['savepoint_path'])
+                ssb.delete_job(job_name=job_name)
+                resp = None
+    elif job_state:
+        LOG.info('SQL of job %s changed since its savepoint was taken. Starting it from scratch.', job_name)
+    if resp is None:
+        resp = ssb.execute_sql(stmt, job_name=job_name, **kwargs)
+    # the savepoint is consumed: the next one is taken when the job is stopped
+    _update_job_state(job_name, sql_hash=digest, savepoint_path=None, started_at=time.time())
+    return resp
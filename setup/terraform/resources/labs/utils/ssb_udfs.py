@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Native alternatives to the JavaScript UDFs of the workshops.
+
+JavaScript UDFs are evaluated by a script engine in the Flink task managers, one call per row. havetokm_expr()
+returns the haversine distance (in km) as a Flink SQL expression, which is compiled with the rest of the query and
+needs neither a script engine nor a JAR deployed to the cluster. inline_havetokm() replaces the HAVETOKM() calls of a
+statement with it.
+
+benchmark_havetokm() compares both: it runs the same bounded job (random coordinates within the bounds of the fraud
+demo cities, written to a blackhole sink) without any distance, with the JavaScript UDF and with the native
+expression, and reports the cost of each variant per million invocations, net of the baseline job.
+"""
+import re
+
+from . import *
+from . import ssb
+
+NATIVE_HAVETOKM_ENV_VAR = 'WORKSHOP_NATIVE_HAVETOKM'
+EARTH_RADIUS_KM = 6371
+
+BENCHMARK_ROWS = 1000000
+BENCHMARK_TIMEOUT_SECS = 600
+BENCHMARK_UDF_NAME = 'HAVETOKM_BENCH'
+BENCHMARK_JOB_PREFIX = 'havetokm_bench_'
+
+# Coordinates of the generated transactions are within these bounds (see CITIES_DEFAULT in workshop_fraud)
+_LAT_RANGE = (-45, -27)
+_LON_RANGE = (115, 175)
+
+# Only matches calls whose arguments do not contain parentheses, like the ones in the workshop statements
+_HAVETOKM_CALL_REGEX = r'\bHAVETOKM\s*\(([^()]*)\)'
+
+_BENCHMARK_STMT = '''CREATE TEMPORARY TABLE bench_coords (
+  lat1 DOUBLE, lon1 DOUBLE, lat2 DOUBLE, lon2 DOUBLE
+) WITH (
+  'connector' = 'datagen',
+  'number-of-rows' = '{rows}',
+  'fields.lat1.min' = '{lat_min}', 'fields.lat1.max' = '{lat_max}',
+  'fields.lat2.min' = '{lat_min}', 'fields.lat2.max' = '{lat_max}',
+  'fields.lon1.min' = '{lon_min}', 'fields.lon1.max' = '{lon_max}',
+  'fields.lon2.min' = '{lon_min}', 'fields.lon2.max' = '{lon_max}'
+);
+
+CREATE TEMPORARY TABLE bench_sink (
+  distance DOUBLE
+) WITH (
+  'connector' = 'blackhole'
+);
+
+INSERT INTO bench_sink
+SELECT {distance}
+FROM bench_coords
+;
+'''
+
+
+def havetokm_expr(lat1, lon1, lat2, lon2, cast_type=None):
+    """
+    Return the Flink SQL expression of the haversine distance, in km, between the two given coordinates.
+    The expression is a DOUBLE, unless cast_type is given (e.g. 'DECIMAL(32, 16)' to match the type of a sink column).
+    """
+    expr = ('({r} * 2 * ASIN(SQRT(POWER(SIN(RADIANS(({lat2}) - ({lat1})) / 2), 2)'
+            ' + COS(RADIANS({lat1})) * COS(RADIANS({lat2})) * POWER(SIN(RADIANS(({lon2}) - ({lon1})) / 2), 2))))'
+            .format(r=EARTH_RADIUS_KM, lat1=lat1, lon1=lon1, lat2=lat2, lon2=lon2))
+    if cast_type:
+        return 'CAST({} AS {})'.format(expr, cast_type)
+    return expr
+
+
+def inline_havetokm(stmt, cast_type=None):
+    """
+    Replace the HAVETOKM(lat1, lon1, lat2, lon2) calls of the statement with the native expression, cast to cast_type
+    if given (see havetokm_expr()).
+    """
+    def _replace(match):
+        args = [a.strip() for a in match.groups()[0].split(',')]
+        if len(args) != 4:
+            raise RuntimeError('HAVETOKM expects 4 arguments: {}'.format(match.group()))
+        return havetokm_expr(*args, cast_type=cast_type)
+    return re.sub(_HAVETOKM_CALL_REGEX, _replace, stmt, flags=re.IGNORECASE)
+
+
+def use_native_havetokm():
+    return os.environ.get(NATIVE_HAVETOKM_ENV_VAR, '').lower() in ['1', 'true', 'yes']
+
+
+def _run_until_finished(variant, distance, rows, timeout_secs):
+    job_name = BENCHMARK_JOB_PREFIX + variant
+    stmt = _BENCHMARK_STMT.format(rows=rows, distance=distance, lat_min=_LAT_RANGE[0], lat_max=_LAT_RANGE[1],
+                                  lon_min=_LON_RANGE[0], lon_max=_LON_RANGE[1])
+    start = time.time()
+    ssb.execute_sql(stmt, job_name=job_name)
+    try:
+        finished = polling.poll(lambda: not ssb.get_jobs(job_name=job_name, state=ssb.JOB_RUNNING_STATE),
+                                timeout_secs=timeout_secs, initial_interval_secs=ssb.JOB_WATCH_INTERVAL_SECS,
+                                max_interval_secs=ssb.JOB_WATCH_INTERVAL_SECS, backoff_factor=1.0,
+                                raise_on_timeout=False, name='ssb_udfs.benchmark')
+        secs = time.time() - start
+    finally:
+        ssb.delete_job(job_name)
+    if not finished:
+        raise RuntimeError('Benchmark job {} did not finish in {} seconds.'.format(job_name, timeout_secs))
+    LOG.info('HAVETOKM benchmark: %s processed %s rows in %.3f seconds', variant, rows, secs)
+    return secs
+
+
+def benchmark_havetokm(js_code, rows=BENCHMARK_ROWS, timeout_secs=BENCHMARK_TIMEOUT_SECS):
+    """
+    Run the benchmark jobs one after the other and return a dict of variant -> result, with the job duration and,
+    for the distance variants, the cost in seconds per million invocations (job duration minus the baseline's).
+    js_code is the code of the JavaScript UDF (e.g. workshop_fraud.UDF_HAVETOKM_CODE); it is created as a temporary
+    UDF with DOUBLE arguments, which is deleted at the end.
+    """
+    ssb.delete_udf(BENCHMARK_UDF_NAME)
+    ssb.create_udf(BENCHMARK_UDF_NAME, 'HAVETOKM benchmark', ['DOUBLE', 'DOUBLE', 'DOUBLE', 'DOUBLE'], 'DOUBLE',
+                   js_code)
+    try:
+        variants = OrderedDict([
+            ('baseline', 'lat1 + lon1 + lat2 + lon2'),
+            ('javascript', '{}(lat1, lon1, lat2, lon2)'.format(BENCHMARK_UDF_NAME)),
+            ('native', havetokm_expr('lat1', 'lon1', 'lat2', 'lon2')),
+        ])
+        results = OrderedDict()
+        for variant, distance in variants.items():
+            with tracing.TRACER.span('ssb_udfs', 'benchmark {}'.format(variant)):
+                results[variant] = {'rows': rows, 'secs': round(_run_until_finished(variant, distance, rows,
+                                                                                    timeout_secs), 3)}
+    finally:
+        ssb.delete_udf(BENCHMARK_UDF_NAME)
+    baseline_secs = results['baseline']['secs']
+    for variant in ['javascript', 'native']:
+        results[variant]['secs_per_million'] = round(
+            max(0.0, results[variant]['secs'] - baseline_secs) * 1000000 / rows, 3)
+    return results
@@ -24,6 +24,20 @@ class BaseWorkshop(AbstractWorkshop):
         """
         return ['nifi']
 
+    @classmethod
+    def requires_prereq_context(cls):
+        """
+        Return True if the labs of this workshop rely on the context built by the labs of its prereqs.
+        """
+        return False
+
+    @classmethod
+    def teardown_resources(cls):
+        """
+        Return the set of shared resources cleaned up by the teardown of this workshop.
+        """
+        return set()
+
     def before_setup(self):
         pass
 
@@ -4,11 +4,10 @@
 Common utilities for Python scripts
 """
 from . import *
-from .utils import ssb, postgres
+from .utils import ssb, postgres, aio
 
 POSTGRES_DB_NAME = 'cdc_test'
 POSTGRES_DB_USR = 'cdc_user'
-POSTGRES_DB_PWD = get_the_pwd()
 
 DROP_TABLES = '''
 DROP TABLE IF EXISTS transactions;
@@ -49,7 +48,7 @@ CREATE TABLE transactions_cdc (
   'debezium.slot.name' = 'flink',
   'debezium.snapshot.mode' = 'initial'
 );
-'''.format(pwd=get_the_pwd(), hostname=get_hostname())
+'''
 
 LAB3_TRANSACTIONS = '''
 INSERT INTO transactions
@@ -59,6 +58,9 @@ UPDATE transactions
 SET name = 'Flink is really awesome!!!'
 WHERE id = 100;
 '''
+# snapshot of the row inserted in lab1, the insert, and the rows before and after the update
+LAB3_EXPECTED_ROWS = 4
+LAB3_MAX_WAIT_SECS = 5
 
 LAB4_CREATE_TABLE = '''
 CREATE TABLE trans_replica (
@@ -81,7 +83,7 @@ CREATE TABLE `ssb`.`ssb_default`.`trans_replica` (
   'username' = 'cdc_user',
   'driver' = 'org.postgresql.Driver'
 );
-'''.format(pwd=get_the_pwd(), hostname=get_hostname())
+'''
 
 LAB4_INSERT_INTO_REPLICA = '''
 INSERT INTO trans_replica
@@ -101,7 +103,7 @@ CREATE TABLE  `ssb`.`ssb_default`.`trans_changelog` (
   'key.fields' = 'id',
   'value.format' = 'debezium-json'
 );
-'''.format(hostname=get_hostname())
+'''
 
 LAB5_INSERT_CHANGELOG = '''
 INSERT INTO trans_changelog
@@ -155,6 +157,13 @@ class ChangeDataCaptureWorkshop(AbstractWorkshop):
         """
         return []
 
+    @classmethod
+    def teardown_resources(cls):
+        """
+        Return the set of shared resources cleaned up by the teardown of this workshop.
+        """
+        return {'ssb', 'postgres'}
+
     @classmethod
     def is_runnable(cls):
         """
@@ -171,35 +180,43 @@ class ChangeDataCaptureWorkshop(AbstractWorkshop):
         pass
 
     def teardown(self):
-        ssb.stop_all_jobs()
-        ssb.execute_sql(DROP_SSB_TABLES)
-        postgres.execute_sql(DROP_TABLES, POSTGRES_DB_NAME, POSTGRES_DB_USR, POSTGRES_DB_PWD)
+        aio.run_all(
+            aio.sequence(aio.ssb.stop_all_jobs(), aio.ssb.execute_sql(DROP_SSB_TABLES)),
+            aio.postgres.execute_sql(DROP_TABLES, POSTGRES_DB_NAME, POSTGRES_DB_USR, get_the_pwd()),
+        )
         # ssb.delete_table(IOT_ENRICHED_TABLE)
         # ssb.delete_data_provider(KAFKA_PROVIDER_NAME)
 
     def lab1_create_table(self):
-        postgres.execute_sql(LAB1_CREATE_TABLE, POSTGRES_DB_NAME, POSTGRES_DB_USR, POSTGRES_DB_PWD)
+        postgres.execute_sql(LAB1_CREATE_TABLE, POSTGRES_DB_NAME, POSTGRES_DB_USR, get_the_pwd())
 
     def lab2_create_ssb_cdc_table(self):
-        ssb.execute_sql(LAB2_CREATE_SSB_TABLE)
+        ssb.execute_sql(LAB2_CREATE_SSB_TABLE.format(pwd=get_the_pwd(), hostname=get_hostname()))
 
     def lab3_capture_changes(self):
-        ssb.execute_sql('SELECT * FROM transactions_cdc', job_name='lab3', sample_interval_millis=0)
-        postgres.execute_sql(LAB3_TRANSACTIONS, POSTGRES_DB_NAME, POSTGRES_DB_USR, POSTGRES_DB_PWD)
-        time.sleep(5)
+        resp = ssb.execute_sql('SELECT * FROM transactions_cdc', job_name='lab3', sample_interval_millis=0)
+        postgres.execute_sql(LAB3_TRANSACTIONS, POSTGRES_DB_NAME, POSTGRES_DB_USR, get_the_pwd())
+        # wait for the changes to be captured, for LAB3_MAX_WAIT_SECS at most
+        start = time.time()
+        try:
+            for _ in ssb.sample_results(resp, max_rows=LAB3_EXPECTED_ROWS, max_secs=LAB3_MAX_WAIT_SECS):
+                pass
+        except Exception as exc:
+            LOG.warning('Failed to sample the results of job lab3: {}'.format(exc))
+            time.sleep(max(0.0, LAB3_MAX_WAIT_SECS - (time.time() - start)))
         ssb.stop_job(job_name='lab3', wait_secs=3)
 
     def lab4_replicate_changes(self):
-        postgres.execute_sql(LAB4_CREATE_TABLE, POSTGRES_DB_NAME, POSTGRES_DB_USR, POSTGRES_DB_PWD)
-        ssb.execute_sql(LAB4_CREATE_SSB_TABLE)
+        postgres.execute_sql(LAB4_CREATE_TABLE, POSTGRES_DB_NAME, POSTGRES_DB_USR, get_the_pwd())
+        ssb.execute_sql(LAB4_CREATE_SSB_TABLE.format(pwd=get_the_pwd(), hostname=get_hostname()))
         ssb.execute_sql(LAB4_INSERT_INTO_REPLICA, job_name='lab4', sample_interval_millis=0)
         time.sleep(5)
         ssb.stop_job(job_name='lab4', wait_secs=3)
 
     def lab5_capture_changelog(self):
-        ssb.execute_sql(LAB5_CREATE_SSB_TABLE)
+        ssb.execute_sql(LAB5_CREATE_SSB_TABLE.format(hostname=get_hostname()))
         ssb.execute_sql(LAB5_INSERT_CHANGELOG, job_name='lab5', sample_interval_millis=0)
         time.sleep(2)
-        postgres.execute_sql(LAB5_TRANSACTIONS, POSTGRES_DB_NAME, POSTGRES_DB_USR, POSTGRES_DB_PWD)
+        postgres.execute_sql(LAB5_TRANSACTIONS, POSTGRES_DB_NAME, POSTGRES_DB_USR, get_the_pwd())
         time.sleep(5)
         ssb.stop_job(job_name='lab5')
@@ -10,13 +10,6 @@ from .utils import dataviz
 
 CONNECTION_TYPE = 'impyla'
 CONNECTION_NAME = 'Local Impala'
-CONNECTION_PARAMS = {
-    "HOST": get_hostname(),
-    "PORT": "21050",
-    "MODE": "binary",
-    "AUTH": "nosasl",
-    "SOCK": "normal",
-}
 DATASET_NAME = 'sensor data1'
 
 DATASET_EXPORT_FILE = 'visuals_dataset.json'
@@ -24,6 +17,16 @@ TABLE_VISUAL_EXPORT_FILE = 'visuals_table.json'
 SCATTER_VISUAL_EXPORT_FILE = 'visuals_scatter.json'
 
 
+def _get_connection_params():
+    return {
+        "HOST": get_hostname(),
+        "PORT": "21050",
+        "MODE": "binary",
+        "AUTH": "nosasl",
+        "SOCK": "normal",
+    }
+
+
 class DataVizWorkshop(AbstractWorkshop):
 
     @classmethod
@@ -42,6 +45,20 @@ class DataVizWorkshop(AbstractWorkshop):
         """
         return ['nifi']
 
+    @classmethod
+    def requires_prereq_context(cls):
+        """
+        Return True if the labs of this workshop rely on the context built by the labs of its prereqs.
+        """
+        return False
+
+    @classmethod
+    def teardown_resources(cls):
+        """
+        Return the set of shared resources cleaned up by the teardown of this workshop.
+        """
+        return {'dataviz'}
+
     @classmethod
     def is_runnable(cls):
         """
@@ -61,7 +78,7 @@ class DataVizWorkshop(AbstractWorkshop):
         dataviz.delete_connection(dc_name=CONNECTION_NAME)
 
     def lab2_create_connection(self):
-        dataviz.create_connection(CONNECTION_TYPE, CONNECTION_NAME, CONNECTION_PARAMS)
+        dataviz.create_connection(CONNECTION_TYPE, CONNECTION_NAME, _get_connection_params())
 
     def lab3_create_dataset(self):
         dataviz.import_artifacts2(CONNECTION_NAME, os.path.join(self.get_artifacts_dir(), DATASET_EXPORT_FILE))
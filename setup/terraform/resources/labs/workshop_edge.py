@@ -7,7 +7,7 @@ from nipyapi import canvas, versioning, nifi
 from nipyapi.nifi.rest import ApiException
 
 from . import *
-from .utils import efm, schreg, nifireg, nifi as nf, kafka, kudu, cdsw
+from .utils import efm, nifi as nf, kafka, cdsw, aio
 
 PG_NAME = 'Process Sensor Data'
 CONSUMER_GROUP_ID = 'iot-sensor-consumer'
@@ -32,6 +32,13 @@ class EdgeWorkshop(AbstractWorkshop):
         """
         return []
 
+    @classmethod
+    def teardown_resources(cls):
+        """
+        Return the set of shared resources cleaned up by the teardown of this workshop.
+        """
+        return {'nifi', 'efm', 'schreg', 'nifireg', 'kudu'}
+
     def before_setup(self):
         self.context.root_pg = nf.set_environment()
         self.context.flow_id, self.context.efm_pg_id = efm.get_flow('iot-1')
@@ -58,13 +65,15 @@ class EdgeWorkshop(AbstractWorkshop):
                 break
 
         nf.delete_all(root_pg)
-        efm.delete_all(flow_id)
-        schreg.delete_all_schemas()
         reg_client = versioning.get_registry_client('NiFi Registry')
         if reg_client:
             versioning.delete_registry_client(reg_client)
-        nifireg.delete_flows('SensorFlows')
-        kudu.drop_table()
+        aio.run_all(
+            aio.efm.delete_all(flow_id),
+            aio.schreg.delete_all_schemas(),
+            aio.nifireg.delete_flows('SensorFlows'),
+            aio.kudu.drop_table(),
+        )
 
     def lab1_sensor_simulator(self):
         # Create a processor to run the sensor simulator
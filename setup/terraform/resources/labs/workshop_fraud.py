@@ -8,7 +8,7 @@ from nipyapi import canvas, versioning, nifi, parameters
 from nipyapi.nifi.rest import ApiException
 
 from . import *
-from .utils import schreg, nifireg, nifi as nf, kafka, kudu, cdsw, impala, ssb, smm, dataviz
+from .utils import schreg, nifireg, nifi as nf, kafka, kudu, cdsw, impala, ssb, ssb_savepoints, ssb_udfs, smm, dataviz, aio
 
 PG_NAME = 'Fraud Detection'
 REGISTRY_BUCKET_NAME = 'FraudFlow'
@@ -1366,6 +1366,7 @@ UDF_TO_KUDU_STRING_CODE = '''function TO_KUDU_STRING(input){
 TO_KUDU_STRING($p0);  // this line must exist
 '''
 
+SSB_FRAUD_JOB_NAME = 'fraud_detection_job'
 SSB_FRAUD_JOB = '''DROP TEMPORARY VIEW IF EXISTS frauds;
 CREATE TEMPORARY VIEW frauds AS
 SELECT
@@ -1416,16 +1417,20 @@ FROM frauds
 
 DATAVIZ_CONNECTION_TYPE = 'impyla'
 DATAVIZ_CONNECTION_NAME = 'Impala'
-DATAVIZ_CONNECTION_PARAMS = {
-    'HOST': get_hostname(),
-    'PORT': '21050',
-    'MODE': 'binary',
-    'AUTH': 'plain' if is_kerberos_enabled() else 'nosasl',
-    'SOCK': 'ssl' if is_tls_enabled() else 'normal',
-}
 
 DATAVIZ_EXPORT_FILE = 'fraud-demo-viz.json'
 
+
+def _get_dataviz_connection_params():
+    return {
+        'HOST': get_hostname(),
+        'PORT': '21050',
+        'MODE': 'binary',
+        'AUTH': 'plain' if is_kerberos_enabled() else 'nosasl',
+        'SOCK': 'ssl' if is_tls_enabled() else 'normal',
+    }
+
+
 def read_in_schema(uri=_TRANSACTION_SCHEMA_URI):
     if 'TRANSACTION_SCHEMA_FILE' in os.environ and os.path.exists(os.environ['TRANSACTION_SCHEMA_FILE']):
         return open(os.environ['TRANSACTION_SCHEMA_FILE']).read()
@@ -1454,6 +1459,13 @@ class FraudWorkshop(AbstractWorkshop):
         """
         return []
 
+    @classmethod
+    def teardown_resources(cls):
+        """
+        Return the set of shared resources cleaned up by the teardown of this workshop.
+        """
+        return {'nifi', 'dataviz', 'ssb', 'schreg', 'nifireg', 'kudu', 'cdsw'}
+
     @classmethod
     def is_runnable(cls):
         """
@@ -1474,9 +1486,6 @@ class FraudWorkshop(AbstractWorkshop):
     def teardown(self):
         root_pg = nf.set_environment()
 
-        dataviz.delete_dataset(dc_name=DATAVIZ_CONNECTION_NAME)
-        dataviz.delete_connection(dc_name=DATAVIZ_CONNECTION_NAME)
-
         canvas.schedule_process_group(root_pg.id, False)
         while True:
             failed = False
@@ -1491,19 +1500,29 @@ class FraudWorkshop(AbstractWorkshop):
             if not failed:
                 break
 
-        ssb.stop_all_jobs(wait_secs=3)
-        ssb.execute_sql(SSB_DROP_TABLES_STMT, job_name="drop_tables")
-        ssb.delete_all_jobs()
-        ssb.delete_all_udfs()
-        ssb.delete_all_data_providers()
         nf.delete_all(root_pg)
-        schreg.delete_all_schemas()
         reg_client = versioning.get_registry_client('NiFi Registry')
         if reg_client:
             versioning.delete_registry_client(reg_client)
-        nifireg.delete_flows(REGISTRY_BUCKET_NAME)
-        kudu.drop_table()
-        cdsw.delete_all_model_api_keys()
+        aio.run_all(
+            aio.sequence(
+                aio.dataviz.delete_dataset(dc_name=DATAVIZ_CONNECTION_NAME),
+                aio.dataviz.delete_connection(dc_name=DATAVIZ_CONNECTION_NAME),
+            ),
+            aio.sequence(
+                # keep the state of the fraud detection job for the next setup
+                aio.ssb_savepoints.stop_with_savepoints([SSB_FRAUD_JOB_NAME], run_id=self.run_id),
+                aio.ssb.stop_all_jobs(wait_secs=3),
+                aio.ssb.execute_sql(SSB_DROP_TABLES_STMT, job_name="drop_tables"),
+                aio.ssb.delete_all_jobs(),
+                aio.ssb.delete_all_udfs(),
+                aio.ssb.delete_all_data_providers(),
+            ),
+            aio.schreg.delete_all_schemas(),
+            aio.nifireg.delete_flows(REGISTRY_BUCKET_NAME),
+            aio.kudu.drop_table(),
+            aio.cdsw.delete_all_model_api_keys(),
+        )
 
     def lab1_register_schema(self):
         schreg.create_schema('transactions', 'Transaction data', read_in_schema())
@@ -1830,10 +1849,15 @@ class FraudWorkshop(AbstractWorkshop):
                        ['STRING'], 'STRING', UDF_TO_KUDU_STRING_CODE)
 
     def lab9_run_ssb_job_fraud_detection_geo(self):
-        ssb.execute_sql(SSB_FRAUD_JOB, job_name="fraud_detection_job")
+        if ssb_udfs.use_native_havetokm():
+            # same type as the distance column of the fraudulent_txn table
+            stmt = ssb_udfs.inline_havetokm(SSB_FRAUD_JOB, cast_type='DECIMAL(32, 16)')
+        else:
+            stmt = SSB_FRAUD_JOB
+        ssb_savepoints.execute_sql(stmt, job_name=SSB_FRAUD_JOB_NAME)
 
     def lab10_create_connection(self):
-        dataviz.create_connection(DATAVIZ_CONNECTION_TYPE, DATAVIZ_CONNECTION_NAME, DATAVIZ_CONNECTION_PARAMS,
+        dataviz.create_connection(DATAVIZ_CONNECTION_TYPE, DATAVIZ_CONNECTION_NAME, _get_dataviz_connection_params(),
                                   username='admin' if is_kerberos_enabled() else None,
                                   password=get_the_pwd() if is_kerberos_enabled() else None)
 
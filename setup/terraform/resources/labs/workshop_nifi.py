@@ -7,7 +7,7 @@ from nipyapi import canvas, versioning, nifi
 from nipyapi.nifi.rest import ApiException
 
 from . import *
-from .utils import efm, schreg, nifireg, nifi as nf, kafka, kudu, cdsw
+from .utils import efm, schreg, nifireg, nifi as nf, kafka, kudu, cdsw, aio
 
 PG_NAME = 'Process Sensor Data'
 CONSUMER_GROUP_ID = 'iot-sensor-consumer'
@@ -50,6 +50,13 @@ class NiFiWorkshop(AbstractWorkshop):
         """
         return ['edge']
 
+    @classmethod
+    def teardown_resources(cls):
+        """
+        Return the set of shared resources cleaned up by the teardown of this workshop.
+        """
+        return {'nifi', 'efm', 'schreg', 'nifireg', 'kudu', 'cdsw'}
+
     def before_setup(self):
         self.context.root_pg = nf.set_environment()
         self.context.flow_id, self.context.efm_pg_id = efm.get_flow('iot-1')
@@ -77,14 +84,16 @@ class NiFiWorkshop(AbstractWorkshop):
                 break
 
         nf.delete_all(root_pg)
-        efm.delete_all(flow_id)
-        schreg.delete_all_schemas()
         reg_client = versioning.get_registry_client('NiFi Registry')
         if reg_client:
             versioning.delete_registry_client(reg_client)
-        nifireg.delete_flows('SensorFlows')
-        kudu.drop_table()
-        cdsw.delete_all_model_api_keys()
+        aio.run_all(
+            aio.efm.delete_all(flow_id),
+            aio.schreg.delete_all_schemas(),
+            aio.nifireg.delete_flows('SensorFlows'),
+            aio.kudu.drop_table(),
+            aio.cdsw.delete_all_model_api_keys(),
+        )
 
     def lab1_register_schema(self):
         # Create Schema
@@ -57,6 +57,20 @@ class SqlStreamBuilderWorkshop(AbstractWorkshop):
         """
         return ['nifi']
 
+    @classmethod
+    def requires_prereq_context(cls):
+        """
+        Return True if the labs of this workshop rely on the context built by the labs of its prereqs.
+        """
+        return False
+
+    @classmethod
+    def teardown_resources(cls):
+        """
+        Return the set of shared resources cleaned up by the teardown of this workshop.
+        """
+        return {'ssb', 'schreg'}
+
     @classmethod
     def is_runnable(cls):
         """
@@ -119,13 +133,7 @@ class SqlStreamBuilderWorkshop(AbstractWorkshop):
         schreg.create_schema(
             IOT_ENRICHED_AVRO_TOPIC, 'Schema for the data in the iot_enriched_avro topic', read_schema())
 
-        provider = ssb.get_data_providers(KAFKA_PROVIDER_NAME)[0]
-        # try:
-        #     provider_id = provider['provider_id']
-        # except:
-        #     print(provider)
-        #     raise
-        provider_id = provider.get('provider_id', provider.get('id'))  # property name changed in CSA 1.9
+        provider_id = ssb.get_data_provider_id(KAFKA_PROVIDER_NAME)
         props = {
             'catalog_type': 'registry',
             'kafka.provider.id': provider_id,
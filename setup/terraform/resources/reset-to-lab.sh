@@ -27,7 +27,25 @@ if [[ -f /keytabs/admin.keytab ]]; then
   kinit -kt /keytabs/admin.keytab admin
 fi
 
+# Completed labs are tracked per RUN_ID, so keep it stable across resets.
+# By default the environment is torn down and set up again from scratch, which also repairs changes made by hand.
+# Set RESUME=1 to trust the tracked state and only execute the labs that are missing or changed.
+RUN_ID_FILE=$BASE_DIR/.run-id
+if [[ ! -s $RUN_ID_FILE ]]; then
+  date +%s > $RUN_ID_FILE
+fi
+export RUN_ID=$(cat $RUN_ID_FILE)
+
+# Set IMPORT_REPORT=1 to print the time spent importing the workshop modules after each step.
+if [[ ${IMPORT_REPORT:-0} == "1" ]]; then
+  export WORKSHOP_IMPORT_REPORT=1
+fi
+
 cd $BASE_DIR
-python3 -c "import labs; labs.workshop_teardown(target_workshop='${TARGET_WORKSHOP}')" 2> >(suppress_deprecation_warning >&2)
-python3 -c "import labs; labs.workshop_setup(target_workshop='${TARGET_WORKSHOP}', target_lab=${TARGET_LAB})" 2> >(suppress_deprecation_warning >&2)
+if [[ ${RESUME:-0} == "1" ]]; then
+  python3 -c "import labs; labs.workshop_reset(target_workshop='${TARGET_WORKSHOP}', target_lab=${TARGET_LAB})" 2> >(suppress_deprecation_warning >&2)
+else
+  python3 -c "import labs; labs.workshop_teardown(target_workshop='${TARGET_WORKSHOP}')" 2> >(suppress_deprecation_warning >&2)
+  python3 -c "import labs; labs.workshop_setup(target_workshop='${TARGET_WORKSHOP}', target_lab=${TARGET_LAB})" 2> >(suppress_deprecation_warning >&2)
+fi
 echo "Done!"
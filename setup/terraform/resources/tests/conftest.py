@@ -36,7 +36,8 @@ def setup_all(setup_flag, teardown_flag, run_id, request):
     global _LAST_WORKSHOP
     module_path = os.path.dirname(request.module.__file__)
     workshop = os.path.basename(module_path)
-    if setup_flag:
+    # Modules that test the helpers against local stand-ins do not need any workshop
+    if setup_flag and getattr(request.module, 'REQUIRES_CLUSTER', True):
         if _LAST_WORKSHOP != workshop:
             print('\nTEARDOWN:{}:{}\n'.format(run_id, _LAST_WORKSHOP if _LAST_WORKSHOP else 'GLOBAL'))
             workshop_teardown(target_workshop=_LAST_WORKSHOP, run_id=run_id)
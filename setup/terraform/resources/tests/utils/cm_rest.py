@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in of the Cloudera Manager time-series API, for testing the CM metrics collector without a cluster.
+
+CmRestStandIn serves, from an in-memory description of the time series of each tsquery, the endpoints read by
+labs.utils.cm_metrics:
+    /api/version
+    /api/<version>/timeseries
+Queries without time series return no data, like CM does for metrics without data points, and queries in
+failing_queries return 400. Any other path returns 404. The time series can be changed while the server is running,
+e.g. between samples, and the parameters of the /timeseries requests are kept in requests.
+
+Example:
+    with CmRestStandIn({'select cpu_percent_across_hosts': [series([(now, 12.5)])]}) as cm_api:
+        monkeypatch.setattr(cm, 'get_cm_api_url', lambda *args, **kwargs: cm_api.api_url)
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_VERSION = 'v41'
+
+
+def series(points, entity_name='host-1'):
+    """Return the description of a time series. points is a list of (datetime in UTC, value) tuples."""
+    return {'entity_name': entity_name, 'points': list(points)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body)
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/api/version':
+            self._send(200, API_VERSION, content_type='text/plain')
+        elif url.path == '/api/{}/timeseries'.format(API_VERSION):
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            self.server.standin.requests.append(params)
+            payload = self.server.standin.get_timeseries_payload(params.get('query'))
+            if payload is None:
+                self._send(400, {'message': 'Invalid query: {}'.format(params.get('query'))})
+            else:
+                self._send(200, payload)
+        else:
+            self._send(404, {'message': 'Not found: {}'.format(self.path)})
+
+
+class CmRestStandIn(object):
+    def __init__(self, timeseries=None, failing_queries=None):
+        self.timeseries = dict(timeseries or {})
+        self.failing_queries = set(failing_queries or [])
+        self.requests = []
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self._server.server_address[:2])
+
+    @property
+    def api_url(self):
+        return '{}/api/{}'.format(self.url, API_VERSION)
+
+    def get_timeseries_payload(self, tsquery):
+        """Return the JSON payload of the tsquery, or None if the query fails."""
+        if tsquery in self.failing_queries:
+            return None
+        time_series = [{
+            'metadata': {'entityName': s['entity_name'], 'metricName': tsquery.split()[-1]},
+            'data': [{'timestamp': ts.strftime('%Y-%m-%dT%H:%M:%S.000Z'), 'value': value, 'type': 'SAMPLE'}
+                     for ts, value in s['points']],
+        } for s in self.timeseries.get(tsquery, [])]
+        return {'items': [{'timeSeries': time_series, 'warnings': [], 'timeSeriesQuery': tsquery}]}
+
+    def start(self):
+        if self._server is None:
+            self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+            self._server.daemon_threads = True
+            self._server.standin = self
+            self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05},
+                                            name='cm-rest-standin', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
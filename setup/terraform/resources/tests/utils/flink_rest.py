@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in of the Flink REST API, for testing the Flink metrics collector without a cluster.
+
+FlinkRestStandIn serves, from an in-memory description of the jobs, the endpoints read by labs.utils.flink_metrics:
+    /jobs/overview
+    /jobs/<job id>
+    /jobs/<job id>/checkpoints
+    /jobs/<job id>/vertices/<vertex id>/subtasks/metrics
+    /jobs/<job id>/vertices/<vertex id>/backpressure
+    /jobs/<job id>/vertices/<vertex id>/watermarks
+Any other path returns 404. The jobs can be changed while the server is running, e.g. between samples.
+
+Example:
+    with FlinkRestStandIn([job('abc123', 'my_job', [vertex('v1', 'Source', records_out=10.0)])]) as flink:
+        collector = FlinkMetricsCollector(flink_url=flink.url, ssb_jobs=[{'name': 'my_job'}])
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Flink reports this watermark for inputs that have not received any watermark yet
+NO_WATERMARK = -9223372036854775808
+
+_JOB_PATH_REGEX = r'^/jobs/([^/]+)(/checkpoints)?$'
+_VERTEX_PATH_REGEX = r'^/jobs/([^/]+)/vertices/([^/]+)/(subtasks/metrics|backpressure|watermarks)$'
+
+
+def vertex(vertex_id, name, records_in=None, records_out=None, backpressure=None, watermark_lag_ms=None):
+    """
+    Return the description of a job vertex. backpressure is the list of the back-pressure ratios of its subtasks and
+    watermark_lag_ms the lag of its input watermark behind the current time (None for no watermark yet).
+    """
+    return {'id': vertex_id, 'name': name, 'records_in': records_in, 'records_out': records_out,
+            'backpressure': backpressure or [], 'watermark_lag_ms': watermark_lag_ms}
+
+
+def job(jid, name, vertices, state='RUNNING', checkpoint=None):
+    """Return the description of a job. checkpoint is a dict with the end_to_end_duration and state_size, or None."""
+    return {'jid': jid, 'name': name, 'state': state, 'vertices': vertices, 'checkpoint': checkpoint}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        payload = self.server.standin.get_payload(urlparse(self.path).path)
+        if payload is None:
+            self._send(404, {'errors': ['Not found: {}'.format(self.path)]})
+        else:
+            self._send(200, payload)
+
+
+class FlinkRestStandIn(object):
+    def __init__(self, jobs=None):
+        self.jobs = list(jobs or [])
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self._server.server_address[:2])
+
+    def _find_job(self, jid):
+        return next((j for j in self.jobs if j['jid'] == jid), None)
+
+    def _job_payload(self, job_desc):
+        return {'jid': job_desc['jid'], 'name': job_desc['name'], 'state': job_desc['state'],
+                'vertices': [{'id': v['id'], 'name': v['name']} for v in job_desc['vertices']]}
+
+    def _checkpoints_payload(self, job_desc):
+        completed = dict(job_desc['checkpoint'], status='COMPLETED') if job_desc['checkpoint'] else None
+        return {'latest': {'completed': completed}}
+
+    def _vertex_payload(self, vertex_desc, endpoint):
+        if endpoint == 'subtasks/metrics':
+            metrics = [('numRecordsInPerSecond', vertex_desc['records_in']),
+                       ('numRecordsOutPerSecond', vertex_desc['records_out'])]
+            return [{'id': metric, 'sum': value} for metric, value in metrics if value is not None]
+        if endpoint == 'backpressure':
+            return {'status': 'ok', 'subtasks': [{'subtask': i, 'ratio': ratio}
+                                                 for i, ratio in enumerate(vertex_desc['backpressure'])]}
+        lag_ms = vertex_desc['watermark_lag_ms']
+        watermark = NO_WATERMARK if lag_ms is None else int(time.time() * 1000) - lag_ms
+        return [{'id': '0.currentInputWatermark', 'value': str(watermark)}]
+
+    def get_payload(self, path):
+        """Return the JSON payload of the path, or None if the path is unknown."""
+        if path == '/jobs/overview':
+            return {'jobs': [{'jid': j['jid'], 'name': j['name'], 'state': j['state']} for j in self.jobs]}
+        match = re.match(_JOB_PATH_REGEX, path)
+        if match:
+            job_desc = self._find_job(match.groups()[0])
+            if job_desc is None:
+                return None
+            return self._checkpoints_payload(job_desc) if match.groups()[1] else self._job_payload(job_desc)
+        match = re.match(_VERTEX_PATH_REGEX, path)
+        if match:
+            jid, vertex_id, endpoint = match.groups()
+            job_desc = self._find_job(jid)
+            vertex_desc = next((v for v in job_desc['vertices'] if v['id'] == vertex_id), None) if job_desc else None
+            return self._vertex_payload(vertex_desc, endpoint) if vertex_desc else None
+        return None
+
+    def start(self):
+        if self._server is None:
+            self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+            self._server.daemon_threads = True
+            self._server.standin = self
+            self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05},
+                                            name='flink-rest-standin', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testing the CM metrics collector against a local stand-in of the CM time-series API
+"""
+import csv
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+from ...labs import tracing
+from ...labs.utils import cm, cm_metrics
+from ...labs.utils.cm_metrics import FIXED_COLUMNS, LOOKBACK_SECS, MetricsCollector, query_latest
+from .cm_rest import CmRestStandIn, series
+
+REQUIRES_CLUSTER = False
+
+CPU_QUERY = 'select cpu_percent_across_hosts where category = CLUSTER'
+MEMORY_QUERY = 'select physical_memory_used where category = HOST'
+FAILING_QUERY = 'select invalid_metric where'
+METRICS = [('host_cpu_percent', CPU_QUERY), ('host_memory_used_bytes', MEMORY_QUERY)]
+
+
+def _minutes_ago(minutes, now=None):
+    return (now or datetime.utcnow()) - timedelta(minutes=minutes)
+
+
+@pytest.fixture
+def cm_api(monkeypatch):
+    now = datetime.utcnow()
+    timeseries = {
+        CPU_QUERY: [series([(_minutes_ago(2, now), 10.0), (_minutes_ago(1, now), 25.0)], entity_name='cluster-1')],
+        # one time series per host, in no particular order
+        MEMORY_QUERY: [
+            series([(_minutes_ago(1, now), 3000.0), (_minutes_ago(2, now), 1000.0)], entity_name='host-1'),
+            series([(_minutes_ago(2, now), 500.0)], entity_name='host-2'),
+            series([], entity_name='host-3'),
+        ],
+    }
+    with CmRestStandIn(timeseries, failing_queries=[FAILING_QUERY]) as standin:
+        monkeypatch.setattr(cm, 'get_cm_api_url', lambda *args, **kwargs: standin.api_url)
+        monkeypatch.setattr(cm, '_get_session', requests.Session)
+        yield standin
+
+
+def test_cm_metrics_query_latest(cm_api):
+    now = datetime.utcnow()
+    assert query_latest(CPU_QUERY, now) == 25.0
+    assert query_latest(MEMORY_QUERY, now) == 3500.0
+    assert query_latest('select cpu_percent_across_hosts where category = HOST', now) is None
+
+    params = cm_api.requests[0]
+    assert (params['query'], params['desiredRollup']) == (CPU_QUERY, 'RAW')
+    window = datetime.strptime(params['to'], '%Y-%m-%dT%H:%M:%S.000Z') - \
+        datetime.strptime(params['from'], '%Y-%m-%dT%H:%M:%S.000Z')
+    assert window == timedelta(seconds=LOOKBACK_SECS)
+
+    with pytest.raises(RuntimeError):
+        query_latest(FAILING_QUERY, now)
+
+
+def test_cm_metrics_sample(cm_api):
+    collector = MetricsCollector(METRICS + [('invalid', FAILING_QUERY)])
+    assert collector.columns == FIXED_COLUMNS + ['host_cpu_percent', 'host_memory_used_bytes', 'invalid']
+
+    with tracing.TRACER.span('workshop', 'nifi_workshop'), tracing.TRACER.span('lab', 'lab2_create_flow'):
+        row = collector.sample()
+    assert list(row) == collector.columns
+    assert row['phase'] == 'nifi_workshop/lab2_create_flow'
+    assert (row['host_cpu_percent'], row['host_memory_used_bytes'], row['invalid']) == (25.0, 3500.0, None)
+    assert collector.errors == 1
+
+    collector.set_phase('ramp-up')
+    cm_api.timeseries[CPU_QUERY][0]['points'].append((datetime.utcnow(), 50.0))
+    row = collector.sample()
+    assert (row['phase'], row['host_cpu_percent']) == ('ramp-up', 50.0)
+    assert collector.rows[-1] == row and len(collector.rows) == 2
+    assert collector.errors == 2
+
+
+def test_cm_metrics_default_metrics(cm_api):
+    assert list(MetricsCollector().metrics.items()) == list(cm_metrics.DEFAULT_METRICS.items())
+    assert all(tsquery.startswith('select ') for tsquery in cm_metrics.DEFAULT_METRICS.values())
+    row = MetricsCollector().sample()
+    assert (row['host_cpu_percent'], row['host_memory_used_bytes']) == (25.0, 3500.0)
+
+
+def test_cm_metrics_background_thread(cm_api):
+    with MetricsCollector(METRICS, interval_secs=0.05) as collector:
+        time.sleep(0.3)
+    samples = len(collector.rows)
+    assert samples >= 2
+    time.sleep(0.1)
+    assert len(collector.rows) == samples
+    assert collector.errors == 0
+
+
+def test_cm_metrics_write(cm_api, tmp_path):
+    collector = MetricsCollector(METRICS)
+    collector.set_phase('steady')
+    collector.sample()
+    collector.sample()
+    path = collector.write(str(tmp_path / 'metrics' / 'cm-metrics.csv'))
+    with open(path, newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert len(rows) == 2
+    assert list(rows[0]) == collector.columns
+    assert [(row['phase'], row['host_cpu_percent'], row['host_memory_used_bytes']) for row in rows] == \
+        [('steady', '25.0', '3500.0')] * 2
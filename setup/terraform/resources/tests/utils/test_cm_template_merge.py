@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testing that the indexed template merge engine of cm_template produces the same cluster template as the legacy one
+"""
+import copy
+import json
+import os
+import shutil
+
+import pytest
+from ... import cm_template
+
+REQUIRES_CLUSTER = False
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(cm_template.__file__), 'templates')
+CONFIGS = {
+    'THE_PWD': 'supersecret1', 'CLUSTER_HOST': 'cdp.example.com', 'PUBLIC_DNS': 'cdp.example.com',
+    'PRIVATE_IP': '10.0.0.1', 'IPA_HOST': 'ipa.example.com', 'CLUSTER_ID': '0', 'PEER_CLUSTER_ID': '1',
+    'CDH_MAJOR_VERSION': '7', 'CDH_VERSION': '7.1.9', 'CDH_BUILD': '7.1.9-1.cdh7.1.9.p0.44702451',
+    'CDH_PARCEL_REPO': 'https://archive.example.com/cdh7', 'CM_VERSION': '7.11.3', 'CM_BUILD_NUMBER': '48425906',
+    'CSA_VERSION': '1.11.0.0', 'CSA_PARCEL_REPO': 'https://archive.example.com/csa', 'FLINK_BUILD': '1.16.2',
+    'CFM_VERSION': '2.1.6.0', 'CFM_BUILD': '2.1.6.0-323', 'CFM_PARCEL_REPO': 'https://archive.example.com/cfm',
+    'SCHEMAREGISTRY_BUILD': '0.10.0', 'STREAMS_MESSAGING_MANAGER_BUILD': '2.3.0',
+    'STREAMS_REPLICATION_MANAGER_BUILD': '1.0.0', 'CDSW_VERSION': '1.10.4', 'CDSW_BUILD': '1.10.4.p1.42963181',
+    'CDSW_PARCEL_REPO': 'https://archive.example.com/cdsw', 'CDSW_DOMAIN': 'cdsw.example.com',
+    'ECS_VERSION': '1.5.2', 'ECS_BUILD': '1.5.2-b886', 'ECS_PARCEL_REPO': 'https://archive.example.com/ecs',
+    'ECS_PUBLIC_DNS': 'ecs.example.com', 'CSP_PARCEL_REPO': 'https://archive.example.com/csp',
+    'DOCKER_DEVICE': '/dev/nvme1n1', 'ANACONDA_PRODUCT': 'Anaconda', 'ANACONDA_VERSION': '2019.10',
+    'ANACONDA_PARCEL_REPO': 'https://archive.example.com/anaconda', 'USE_IPA': 'no',
+    cm_template.REQUIRES_PREFIX + '7': '',
+}
+# impala.json does not render valid JSON with TLS and without Kerberos, so that combination is not covered
+SECURITY_CONFIGS = [
+    {'ENABLE_TLS': 'no', 'ENABLE_KERBEROS': 'no'},
+    {'ENABLE_TLS': 'no', 'ENABLE_KERBEROS': 'yes'},
+    {'ENABLE_TLS': 'yes', 'ENABLE_KERBEROS': 'yes'},
+]
+
+
+@pytest.fixture
+def templates(monkeypatch, tmp_path):
+    """Load the templates of the repository from a copy, so that the template catalog is not written to the tree."""
+    template_dir = str(tmp_path / 'templates')
+    shutil.copytree(TEMPLATE_DIR, template_dir)
+    for name in os.listdir(template_dir):
+        # load_templates() sets the HAS_<template> environment variables
+        monkeypatch.setenv('HAS_' + os.path.splitext(name)[0].upper(), '')
+    for name, value in [('TEMPLATES', {}), ('TEMPLATE_DIR', None), ('CATALOG', None), ('JINJA2_ENV', None),
+                        ('CACHE_DIR', None)]:
+        monkeypatch.setattr(cm_template, name, value)
+    cm_template.init_jinja2_env(template_dir)
+    cm_template.load_templates(template_dir)
+    return template_dir
+
+
+def _render(template_dir, template_names, security_config):
+    # like cm_template.main(), HAS_<template> is only set for the selected templates, not for their dependencies
+    configs = dict(CONFIGS, **security_config)
+    configs.update(('HAS_' + name, '1' if name in template_names else '') for name in cm_template.TEMPLATES)
+    return [cm_template.load_template(cm_template.TEMPLATES[name], configs)
+            for name in cm_template.fix_dependencies(template_dir, template_names)]
+
+
+@pytest.mark.parametrize('security_config', SECURITY_CONFIGS)
+@pytest.mark.parametrize('template_names', [
+    None,  # all the templates
+    ['NIFI', 'KAFKA', 'SCHEMAREGISTRY', 'FLINK', 'KUDU', 'IMPALA'],
+    ['CDSW', 'ZEPPELIN'],
+])
+def test_cm_template_merge_engines_match(templates, template_names, security_config):
+    rendered = _render(templates, template_names or list(cm_template.TEMPLATES), security_config)
+    assert len(rendered) > 1
+    legacy = cm_template.merge_templates_legacy(copy.deepcopy(rendered))
+    indexed = cm_template.merge_templates(copy.deepcopy(rendered))
+    assert json.dumps(indexed, indent=2, sort_keys=True) == json.dumps(legacy, indent=2, sort_keys=True)
+    assert indexed == legacy
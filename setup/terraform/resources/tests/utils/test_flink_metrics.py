@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testing the Flink metrics collector against a local stand-in of the Flink REST API
+"""
+import csv
+import json
+import os
+import time
+
+import pytest
+from ...labs.utils.flink_metrics import COLUMNS, FlinkMetricsCollector
+from .flink_rest import FlinkRestStandIn, job, vertex
+
+REQUIRES_CLUSTER = False
+
+FRAUD_JOB = 'fraud_job'
+TXN_JOB = 'txn_job'
+SSB_JOBS = [
+    {'name': FRAUD_JOB},  # matched by name
+    {'name': TXN_JOB, 'flink_job_id': 'bbb'},  # matched by Flink job id
+    {'name': 'stopped_job'},
+]
+
+
+@pytest.fixture
+def flink():
+    jobs = [
+        job('aaa', FRAUD_JOB, [
+            vertex('src', 'Source: transactions', records_out=100.0, backpressure=[0.0, 0.1]),
+            vertex('sink', 'Sink: fraudulent_txn', records_in=100.0, backpressure=[0.5, 0.25],
+                   watermark_lag_ms=2000),
+        ], checkpoint={'end_to_end_duration': 120, 'state_size': 4096}),
+        job('bbb', 'insert-into_default_catalog.default_database.txn', [vertex('calc', 'Calc')]),
+        # a previous run of the same SSB job must not be matched
+        job('ccc', FRAUD_JOB, [vertex('old', 'Old')], state='CANCELED'),
+        job('ddd', 'stopped_job', [vertex('v', 'V')], state='FINISHED'),
+    ]
+    with FlinkRestStandIn(jobs) as standin:
+        yield standin
+
+
+def _sample_twice(collector, flink):
+    collector.sample()
+    time.sleep(0.01)
+    src, sink = flink.jobs[0]['vertices']
+    src['records_out'] = 300.0
+    sink.update(records_in=300.0, backpressure=[0.75], watermark_lag_ms=500)
+    flink.jobs[0]['checkpoint'] = {'end_to_end_duration': 180, 'state_size': 8192}
+    collector.sample()
+
+
+def test_flink_metrics_map_jobs(flink):
+    collector = FlinkMetricsCollector(flink_url=flink.url + '/', ssb_jobs=SSB_JOBS)
+    jobs = collector.refresh_jobs()
+    assert list(jobs.items()) == [(FRAUD_JOB, (flink.url, 'aaa')), (TXN_JOB, (flink.url, 'bbb'))]
+
+    collector = FlinkMetricsCollector([TXN_JOB], flink_url=flink.url, ssb_jobs=SSB_JOBS)
+    assert list(collector.refresh_jobs()) == [TXN_JOB]
+
+
+def test_flink_metrics_sample(flink):
+    collector = FlinkMetricsCollector(flink_url=flink.url, ssb_jobs=SSB_JOBS)
+    rows = collector.sample()
+    assert rows == collector.rows
+    assert all(list(row) == COLUMNS for row in rows)
+    assert len({row['timestamp'] for row in rows}) == 1
+    assert [(row['ssb_job'], row['flink_job_id'], row['vertex_id'], row['vertex']) for row in rows] == [
+        (FRAUD_JOB, 'aaa', 'src', 'Source: transactions'),
+        (FRAUD_JOB, 'aaa', 'sink', 'Sink: fraudulent_txn'),
+        (TXN_JOB, 'bbb', 'calc', 'Calc'),
+    ]
+    src, sink, calc = rows
+    assert (src['records_in_per_sec'], src['records_out_per_sec']) == (None, 100.0)
+    assert (sink['records_in_per_sec'], sink['records_out_per_sec']) == (100.0, None)
+    assert (src['backpressure_ratio'], sink['backpressure_ratio']) == (0.1, 0.5)
+    assert src['watermark_lag_ms'] is None
+    assert abs(sink['watermark_lag_ms'] - 2000) < 1000
+    assert all((row['checkpoint_duration_ms'], row['checkpoint_size_bytes']) == (120, 4096) for row in [src, sink])
+    assert (calc['records_in_per_sec'], calc['backpressure_ratio'], calc['watermark_lag_ms']) == (None, None, None)
+    assert (calc['checkpoint_duration_ms'], calc['checkpoint_size_bytes']) == (None, None)
+    assert collector.errors == 0
+
+
+def test_flink_metrics_summary(flink):
+    collector = FlinkMetricsCollector(flink_url=flink.url, ssb_jobs=SSB_JOBS)
+    _sample_twice(collector, flink)
+    summary = collector.summary()
+    assert list(summary) == [FRAUD_JOB, TXN_JOB]
+
+    fraud = summary[FRAUD_JOB]
+    assert (fraud['flink_job_id'], fraud['samples']) == ('aaa', 2)
+    assert fraud['max_backpressure_ratio'] == 0.75
+    assert abs(fraud['max_watermark_lag_ms'] - 2000) < 1000
+    assert (fraud['avg_checkpoint_duration_ms'], fraud['max_checkpoint_duration_ms']) == (150, 180)
+    assert fraud['last_checkpoint_size_bytes'] == 8192
+    assert list(fraud['vertices']) == ['src', 'sink']
+    src, sink = fraud['vertices'].values()
+    assert src['vertex'] == 'Source: transactions'
+    assert (src['avg_records_out_per_sec'], src['max_records_out_per_sec']) == (200.0, 300.0)
+    assert (src['avg_records_in_per_sec'], src['max_records_in_per_sec']) == (None, None)
+    assert (sink['avg_records_in_per_sec'], sink['max_records_in_per_sec']) == (200.0, 300.0)
+    assert (src['max_backpressure_ratio'], sink['max_backpressure_ratio']) == (0.1, 0.75)
+    assert src['max_watermark_lag_ms'] is None
+
+    txn = summary[TXN_JOB]
+    assert (txn['flink_job_id'], txn['samples'], list(txn['vertices'])) == ('bbb', 2, ['calc'])
+    assert (txn['avg_checkpoint_duration_ms'], txn['last_checkpoint_size_bytes']) == (None, None)
+
+
+def test_flink_metrics_job_restarted(flink):
+    collector = FlinkMetricsCollector([FRAUD_JOB, TXN_JOB], flink_url=flink.url, ssb_jobs=SSB_JOBS)
+    collector.sample()
+    flink.jobs[0]['jid'] = 'eee'
+    rows = collector.sample()
+    assert [row['ssb_job'] for row in rows] == [TXN_JOB]
+    assert list(collector.jobs) == [TXN_JOB]
+    assert collector.errors == 1
+
+    rows = collector.sample()
+    assert [(row['ssb_job'], row['flink_job_id']) for row in rows] == [(FRAUD_JOB, 'eee')] * 2 + [(TXN_JOB, 'bbb')]
+    assert collector.summary()[FRAUD_JOB]['flink_job_id'] == 'eee'
+
+
+def test_flink_metrics_background_thread(flink):
+    with FlinkMetricsCollector(flink_url=flink.url, ssb_jobs=SSB_JOBS, interval_secs=0.05) as collector:
+        time.sleep(0.3)
+    samples = collector.summary()[FRAUD_JOB]['samples']
+    assert samples >= 2
+    time.sleep(0.1)
+    assert collector.summary()[FRAUD_JOB]['samples'] == samples
+
+
+def test_flink_metrics_write(flink, tmp_path):
+    collector = FlinkMetricsCollector(flink_url=flink.url, ssb_jobs=SSB_JOBS)
+    _sample_twice(collector, flink)
+    path = collector.write(str(tmp_path / 'metrics' / 'flink-metrics.csv'))
+    with open(path, newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert len(rows) == 6
+    assert list(rows[0]) == COLUMNS
+    assert [row['records_out_per_sec'] for row in rows if row['vertex_id'] == 'src'] == ['100.0', '300.0']
+    with open(os.path.join(str(tmp_path), 'metrics', 'flink-metrics-summary.json')) as summary_file:
+        assert json.load(summary_file) == json.loads(json.dumps(collector.summary()))
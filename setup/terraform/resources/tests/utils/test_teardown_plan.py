@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testing the order and concurrency of the workshop teardowns with stub workshops
+"""
+from collections import OrderedDict
+
+import pytest
+from ... import labs
+from .workshop_stubs import EVENTS, StubWorkshop, executed, register
+
+REQUIRES_CLUSTER = False
+
+RUN_ID = '1'
+TEARDOWN_SECS = 0.2
+
+
+class BaseWorkshop(StubWorkshop):
+    WORKSHOP_ID = 'stub_base'
+    RESOURCES = {'cm'}
+    TEARDOWN_SECS = TEARDOWN_SECS
+
+    def lab1_setup(self):
+        self.record('lab1')
+
+
+class NifiWorkshop(StubWorkshop):
+    WORKSHOP_ID = 'stub_nifi'
+    PREREQS = ['stub_base']
+    RESOURCES = {'nifi'}
+    TEARDOWN_SECS = TEARDOWN_SECS
+
+
+class KafkaWorkshop(StubWorkshop):
+    WORKSHOP_ID = 'stub_kafka'
+    PREREQS = ['stub_base']
+    RESOURCES = {'kafka', 'schreg'}
+    TEARDOWN_SECS = TEARDOWN_SECS
+
+
+class FlowWorkshop(StubWorkshop):
+    WORKSHOP_ID = 'stub_flow'
+    PREREQS = [('stub_nifi', 2), ('stub_kafka', 3)]
+    RESOURCES = {'nifi', 'schreg'}
+    TEARDOWN_SECS = TEARDOWN_SECS
+
+
+class OtherFlowWorkshop(StubWorkshop):
+    WORKSHOP_ID = 'stub_other_flow'
+    RESOURCES = {'nifi'}
+    TEARDOWN_SECS = TEARDOWN_SECS
+
+
+class AnythingWorkshop(StubWorkshop):
+    WORKSHOP_ID = 'stub_anything'
+    TEARDOWN_SECS = TEARDOWN_SECS
+
+
+class FailingWorkshop(StubWorkshop):
+    WORKSHOP_ID = 'stub_failing'
+    PREREQS = ['stub_nifi']
+
+    def teardown(self):
+        raise RuntimeError('Teardown failed')
+
+
+STUBS = [BaseWorkshop, NifiWorkshop, KafkaWorkshop, FlowWorkshop, OtherFlowWorkshop, AnythingWorkshop,
+         FailingWorkshop]
+
+
+def _teardown_times():
+    return {workshop: (start, end) for workshop, step, start, end, _ in EVENTS if step == 'teardown'}
+
+
+def _overlap(times, workshop1, workshop2):
+    return times[workshop1][0] < times[workshop2][1] and times[workshop2][0] < times[workshop1][1]
+
+
+def test_teardown_nodes(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, *STUBS)
+    assert labs._get_teardown_nodes(['stub_flow', 'stub_kafka']) == OrderedDict([
+        ('stub_flow', ['stub_nifi', 'stub_kafka']),
+        ('stub_nifi', ['stub_base']),
+        ('stub_base', []),
+        ('stub_kafka', ['stub_base']),
+    ])
+    # the serial teardown tears down the prereqs once per dependent
+    assert labs._get_serial_teardown_order(['stub_flow']) == ['stub_flow', 'stub_nifi', 'stub_base', 'stub_kafka',
+                                                              'stub_base']
+
+
+def test_teardown_order(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, *STUBS)
+    BaseWorkshop(RUN_ID).execute_setup()
+    assert list(labs.get_completed_labs(RUN_ID, 'stub_base')) == ['lab1_setup']
+    executed()
+
+    labs._execute_teardown_plan(['stub_flow'], RUN_ID)
+    times = _teardown_times()
+    assert sorted(times) == ['stub_base', 'stub_flow', 'stub_kafka', 'stub_nifi']
+    assert len(executed()) == len(times)
+    # each workshop is torn down after the workshops that depend on it
+    assert times['stub_flow'][1] <= min(times['stub_nifi'][0], times['stub_kafka'][0])
+    assert max(times['stub_nifi'][1], times['stub_kafka'][1]) <= times['stub_base'][0]
+    # and concurrently with the ones it shares no resources with
+    assert _overlap(times, 'stub_nifi', 'stub_kafka')
+    assert labs.get_completed_labs(RUN_ID, 'stub_base') == {}
+
+    stats = labs._get_last_teardown_stats()
+    assert sorted(w['workshop'] for w in stats['workshops']) == sorted(times)
+    assert stats['serial_secs'] > stats['wall_secs']
+
+
+def test_teardown_resource_conflicts(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, *STUBS)
+    labs._execute_teardown_plan(['stub_other_flow', 'stub_nifi', 'stub_kafka', 'stub_anything'], RUN_ID)
+    times = _teardown_times()
+    assert sorted(times) == ['stub_anything', 'stub_base', 'stub_kafka', 'stub_nifi', 'stub_other_flow']
+    # both clean up the NiFi canvas
+    assert not _overlap(times, 'stub_other_flow', 'stub_nifi')
+    assert _overlap(times, 'stub_other_flow', 'stub_kafka')
+    # a teardown without declared resources can touch anything, so it runs alone
+    assert not any(_overlap(times, 'stub_anything', w) for w in times if w != 'stub_anything')
+
+
+def test_teardown_serial(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, *STUBS)
+    labs._execute_teardown_plan(['stub_flow'], RUN_ID, max_workers=1)
+    times = _teardown_times()
+    assert not _overlap(times, 'stub_nifi', 'stub_kafka')
+    assert len({thread for _, _, _, _, thread in EVENTS}) == 1
+
+
+def test_teardown_failure(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, *STUBS)
+    with pytest.raises(RuntimeError, match='Teardown failed'):
+        labs._execute_teardown_plan(['stub_failing', 'stub_kafka'], RUN_ID)
+    # the prereqs of the failed workshop are not torn down
+    assert ('stub_nifi', 'teardown') not in executed()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testing the setup state of the workshops (satisfied, resumable and stale setups) with stub workshops
+"""
+from ... import labs
+from ...labs import SETUP_RESUMABLE, SETUP_SATISFIED, SETUP_STALE
+from .workshop_stubs import StubWorkshop, executed, register
+
+REQUIRES_CLUSTER = False
+
+RUN_ID = '1'
+TOPIC = 'transactions'
+
+
+class DataWorkshop(StubWorkshop):
+    WORKSHOP_ID = 'stub_data'
+
+    def lab1_create_table(self):
+        self.record('lab1')
+
+    def lab2_create_topic(self):
+        self.context.topic = TOPIC
+        self.record('lab2')
+
+    def lab3_create_flow(self):
+        self.record('lab3')
+
+    def lab4_produce(self):
+        # reads the context set by lab2
+        self.record('lab4:' + self.context.topic)
+
+
+class AppWorkshop(StubWorkshop):
+    WORKSHOP_ID = 'stub_app'
+    PREREQS = [('stub_data', 3)]
+
+    def lab1_deploy(self):
+        self.record('lab1')
+
+
+def test_setup_status_transitions(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, DataWorkshop)
+    assert DataWorkshop(RUN_ID).get_setup_status(3) == SETUP_STALE
+
+    DataWorkshop(RUN_ID).execute_setup(3)
+    assert executed() == [('stub_data', 'lab1'), ('stub_data', 'lab2')]
+
+    workshop = DataWorkshop(RUN_ID)
+    assert workshop.get_setup_status(3) == SETUP_SATISFIED
+    # lab3 does not read the context, which is lost between executions
+    assert workshop.get_setup_status(4) == SETUP_RESUMABLE
+    # lab4 reads an attribute of the context set by the completed lab2
+    assert workshop.get_setup_status(5) == SETUP_STALE
+    # lab2 was completed beyond the target lab
+    assert workshop.get_setup_status(2) == SETUP_STALE
+    assert DataWorkshop('2').get_setup_status(3) == SETUP_STALE
+
+
+def test_setup_resumes_missing_labs(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, DataWorkshop)
+    DataWorkshop(RUN_ID).execute_setup(3)
+    executed()
+    DataWorkshop(RUN_ID).execute_setup(4)
+    assert executed() == [('stub_data', 'lab3')]
+    assert DataWorkshop(RUN_ID).get_setup_status(4) == SETUP_SATISFIED
+    assert list(labs.get_completed_labs(RUN_ID, 'stub_data')) == ['lab1_create_table', 'lab2_create_topic',
+                                                                  'lab3_create_flow']
+
+
+def test_setup_replays_labs_whose_context_is_lost(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, DataWorkshop)
+    DataWorkshop(RUN_ID).execute_setup(3)
+    executed()
+    DataWorkshop(RUN_ID).execute_setup(5)
+    assert executed() == [('stub_data', 'lab1'), ('stub_data', 'lab2'), ('stub_data', 'lab3'),
+                          ('stub_data', 'lab4:transactions')]
+    assert DataWorkshop(RUN_ID).get_setup_status(5) == SETUP_SATISFIED
+
+
+def test_setup_status_changed_inputs(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, DataWorkshop)
+    DataWorkshop(RUN_ID).execute_setup(3)
+    # lab2 references the module constant, so its fingerprint changes
+    monkeypatch.setitem(globals(), 'TOPIC', 'payments')
+    assert DataWorkshop(RUN_ID).get_setup_status(3) == SETUP_STALE
+    assert DataWorkshop(RUN_ID).get_setup_status(2) == SETUP_STALE
+
+
+def test_reset_keeps_resumes_and_rolls_back(monkeypatch, tmp_path):
+    register(monkeypatch, tmp_path, DataWorkshop, AppWorkshop)
+    # nothing is recorded yet, so the workshop is torn down in case it was set up by other means
+    labs.workshop_reset('stub_data', 3, run_id=RUN_ID)
+    assert executed() == [('stub_data', 'teardown'), ('stub_data', 'lab1'), ('stub_data', 'lab2')]
+
+    labs.workshop_reset('stub_data', 3, run_id=RUN_ID)
+    assert executed() == []
+
+    labs.workshop_reset('stub_data', 4, run_id=RUN_ID)
+    assert executed() == [('stub_data', 'lab3')]
+
+    # stub_data is now set up beyond the target lab of the prereq of stub_app, so it is rolled back with its dependent
+    labs.workshop_reset('stub_app', 2, run_id=RUN_ID)
+    assert executed() == [('stub_app', 'teardown'), ('stub_data', 'teardown'),
+                          ('stub_data', 'lab1'), ('stub_data', 'lab2'), ('stub_app', 'lab1')]
+
+    # stub_app is outside of the chain of stub_data: full reset
+    labs.workshop_reset('stub_data', 3, run_id=RUN_ID)
+    assert executed() == [('stub_app', 'teardown'), ('stub_data', 'teardown'),
+                          ('stub_data', 'lab1'), ('stub_data', 'lab2')]
+    assert list(labs.get_completed_labs(RUN_ID, 'stub_app')) == []
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stub workshops, for testing the setup state and teardown plans of labs.AbstractWorkshop without a cluster.
+
+The labs and teardown of StubWorkshop subclasses only record their execution in EVENTS. The subclasses are not
+registered in labs.WORKSHOPS when they are defined, so that they never take part in the setups and teardowns of the
+real workshops: register() makes them available for the duration of a test, with the workshop state and the run
+reports in a temporary directory.
+
+Example:
+    class MyWorkshop(StubWorkshop):
+        WORKSHOP_ID = 'my_workshop'
+
+        def lab1_create_topic(self):
+            self.record('lab1')
+
+    def test_setup(monkeypatch, tmp_path):
+        register(monkeypatch, tmp_path, MyWorkshop)
+        MyWorkshop('1').execute_setup()
+        assert executed() == [('my_workshop', 'lab1')]
+"""
+import threading
+import time
+
+from ...labs import tracing
+from ... import labs
+
+# (workshop id, step, start time, end time, thread name) tuples
+EVENTS = []
+_EVENTS_LOCK = threading.Lock()
+
+
+class _StubWorkshopMeta(labs.AbstractWorkshopMeta):
+    def __init__(cls, name, bases, dct):
+        type.__init__(cls, name, bases, dct)
+
+
+class StubWorkshop(labs.AbstractWorkshop, metaclass=_StubWorkshopMeta):
+    WORKSHOP_ID = None
+    PREREQS = []
+    RESOURCES = None
+    TEARDOWN_SECS = 0
+
+    @classmethod
+    def workshop_id(cls):
+        return cls.WORKSHOP_ID
+
+    @classmethod
+    def prereqs(cls):
+        return cls.PREREQS
+
+    @classmethod
+    def teardown_resources(cls):
+        return cls.RESOURCES
+
+    def record(self, step, start=None):
+        end = time.time()
+        with _EVENTS_LOCK:
+            EVENTS.append((self.workshop_id(), step, start or end, end, threading.current_thread().name))
+
+    def teardown(self):
+        start = time.time()
+        time.sleep(self.TEARDOWN_SECS)
+        self.record('teardown', start)
+
+
+def register(monkeypatch, tmp_path, *workshop_classes):
+    """Register the stub workshops until the end of the test, with an empty workshop state and no events."""
+    monkeypatch.setattr(labs, '_get_state_file_path', lambda: str(tmp_path / 'workshop-state.json'))
+    monkeypatch.setenv(tracing.REPORT_DIR_ENV_VAR, str(tmp_path / 'reports'))
+    for cls in workshop_classes:
+        monkeypatch.setitem(labs.WORKSHOPS, cls.workshop_id(), cls)
+    with _EVENTS_LOCK:
+        del EVENTS[:]
+
+
+def executed():
+    """Return the (workshop id, step) tuples of the events recorded since the last call, in order of completion."""
+    with _EVENTS_LOCK:
+        events = [event[:2] for event in EVENTS]
+        del EVENTS[:]
+        return events